@@ -1,31 +1,22 @@
 from typing import Annotated
 import os
 from typing_extensions import TypedDict
-from langchain_tavily import TavilySearch
 from langgraph.graph import StateGraph, START
 from langgraph.graph.message import add_messages
-from llm import Gemini
 from dotenv import load_dotenv
 from Tools.BasicToolNode import BasicToolNode
-from langgraph.prebuilt import ToolNode, tools_condition
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import SystemMessage
-from langfuse import Langfuse
-from llm import Gemini
-from Tools.RagTool import RAGTool
-
-from langgraph.graph import StateGraph, START
-from langgraph.graph.message import add_messages
+from langgraph.prebuilt import tools_condition
+from langchain_core.messages import SystemMessage, AIMessage, AIMessageChunk, HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from metrics import LatencyStats
+from services import services
+from tracing import span_callbacks
 
 load_dotenv()
 
-langfuse = Langfuse(
-    public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
-    host=os.getenv("LANGFUSE_HOST")
-)
-
-bot = Gemini()
+# The model, tools, response cache and compiled graph live in `services` and are
+# built on first use or by services.warm_up(), not when this module is imported.
 
 system_prompt = """
 You are a smart assistant with access to two tools:
@@ -45,17 +36,6 @@ Only use TavilySearch if rag_search doesn't find relevant information and you ne
 When you find relevant information from rag_search, use it to answer the user's question directly.
 """
 
-
-
-tavily_api = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilySearch(api_key=tavily_api)
-
-tool = TavilySearch(max_results=3, client=tavily_client)
-rag_tool = RAGTool(gemini_instance=bot)
-tools = [tool, rag_tool]
-
-bot_with_tools = bot.model.bind_tools(tools)
-
 import re
 
 def remove_braced_text(paragraph):
@@ -64,80 +44,282 @@ def remove_braced_text(paragraph):
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
-graph_builder = StateGraph(State)
+    # Estimated prompt size of the latest model call
+    prompt_tokens: int
+
+# Earlier turns are trimmed, oldest first, to keep the prompt under this many tokens
+history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+prompt_stats = LatencyStats(unit="tokens")
+
+# Per-tool deadlines in seconds, e.g. TOOL_TIMEOUTS="rag_search=5,tavily_search=8"; others get TOOL_TIMEOUT
+tool_timeout = float(os.getenv("TOOL_TIMEOUT", "10"))
+tool_timeouts = {
+    name.strip(): float(seconds)
+    for name, _, seconds in (item.partition("=") for item in os.getenv("TOOL_TIMEOUTS", "").split(",") if item.strip())
+}
+
+
+def trim_history(messages):
+    """Keep the current turn whole and as many earlier whole turns as fit the token budget."""
+    current_turn = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    budget = history_token_budget - count_tokens_approximately(messages[current_turn:])
+    history = []
+    if budget > 0 and current_turn:
+        history = trim_messages(
+            messages[:current_turn],
+            max_tokens=budget,
+            token_counter=count_tokens_approximately,
+            strategy="last",
+            start_on="human",
+        )
+    return history + messages[current_turn:]
+
+
+def build_messages(state: State, config: RunnableConfig = None):
+    # Inject system prompt
+    from llm import system_prompt
+
+    # Context the retrieval router already fetched goes into the first prompt of the turn
+    prefetch = ((config or {}).get("configurable") or {}).get("prefetch")
+    if prefetch is not None and prefetch.context and isinstance(state["messages"][-1], HumanMessage):
+        system_prompt += (
+            "\nrag_search has already been run for the current question. Answer from these results"
+            " unless they are not relevant:\n" + prefetch.context
+        )
+
+    return [SystemMessage(content=system_prompt)] + trim_history(state["messages"])
+
+
+def chatbot_update(state: State, messages, response):
+    """
+    The reply, plus removals for the turns trimmed out of the prompt: they
+    would never fit again, so the checkpointed thread stays bounded too.
+    """
+    kept = {m.id for m in messages}
+    removed = [RemoveMessage(id=m.id) for m in state["messages"] if m.id not in kept]
+    prompt_tokens = count_tokens_approximately(messages)
+    prompt_stats.observe("call", prompt_tokens)
+    return {"messages": removed + [response], "prompt_tokens": prompt_tokens}
+
+
+def chatbot(state: State, config: RunnableConfig):
+    messages = build_messages(state, config)
+    admission = services.admission
+    if admission is None:
+        response = services.bot_with_tools.invoke(messages)
+    else:
+        response = admission.call("chat", lambda: services.bot_with_tools.invoke(messages))
+    return chatbot_update(state, messages, response)
 
 
+async def achatbot(state: State, config: RunnableConfig):
+    messages = build_messages(state, config)
+    # Model calls queue for Gemini ahead of upload embeddings; AdmissionRejected reaches the API as a 429
+    admission = services.admission
+    if admission is None:
+        response = await services.bot_with_tools.ainvoke(messages)
+    else:
+        response = await admission.acall("chat", lambda: services.bot_with_tools.ainvoke(messages))
+    return chatbot_update(state, messages, response)
 
 
-def chatbot(state: State):
-    print(f"Processing query: {state['messages'][-1].content}")
+def build_graph(checkpointer):
+    """Compile the agent graph; called once by services.graph."""
+    graph_builder = StateGraph(State)
 
-    # Inject system prompt
-    from langchain_core.messages import SystemMessage
-    from llm import system_prompt  
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
 
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
+    # Tool calls of one model turn run side by side, each under its own deadline
+    tool_node = BasicToolNode(services.tools, timeout=tool_timeout, timeouts=tool_timeouts)
 
-    response = bot_with_tools.invoke(messages)
+    graph_builder.add_node("tools", RunnableLambda(tool_node, afunc=tool_node.acall))
 
-    print(f"Tool calls: {getattr(response, 'tool_calls', None)}")
-    print(f"Response content: {getattr(response, 'content', 'No content')}")
-    return {"messages": [response]}
+    graph_builder.add_conditional_edges(
+        "chatbot",
+        tools_condition,
+    )
 
+    graph_builder.add_edge("tools", "chatbot")
+    graph_builder.add_edge(START, "chatbot")
 
-graph_builder.add_node("chatbot", chatbot)
+    # Each user_id is a checkpointed thread; its earlier turns are replayed into the prompt
+    return graph_builder.compile(checkpointer=checkpointer)
 
-tool_node = ToolNode(tools = [tool, rag_tool])
 
-graph_builder.add_node("tools", tool_node)
+def thread_config(user_id):
+    return {"configurable": {"thread_id": user_id}}
 
-graph_builder.add_conditional_edges(
-    "chatbot",
-    tools_condition,
-)
 
-graph_builder.add_edge("tools", "chatbot")
-graph_builder.add_edge(START, "chatbot")
+def run_config(user_id, prefetch=None):
+    # The span callbacks time every model and tool run in the graph
+    config = dict(thread_config(user_id), callbacks=[span_callbacks])
+    # rag_search limits chat-history retrieval to this user's turns
+    config["configurable"]["user_id"] = user_id
+    if prefetch is not None:
+        # Read by rag_search and the chatbot node; not persisted with the checkpoint
+        config["configurable"]["prefetch"] = prefetch
+    return config
 
-graph = graph_builder.compile()
 
+async def astart_prefetch(user_input, user_id=None):
+    """With SPECULATIVE_RETRIEVAL=on, start hybrid_search on the user message alongside the first model call."""
+    prefetcher = services.prefetcher
+    if prefetcher is None:
+        return None
+    prefetch = prefetcher.start(user_input, user_id)
+    await prefetcher.route(prefetch)
+    return prefetch
 
 
+def finish_prefetch(prefetch):
+    if prefetch is not None:
+        services.prefetcher.finish(prefetch)
 
 
+async def ahas_history(user_id):
+    snapshot = await services.graph.aget_state(thread_config(user_id))
+    return bool(snapshot.values.get("messages"))
 
 
+async def aremember_turn(user_id, user_input, reply):
+    """Add a turn answered outside the graph (e.g. from the response cache) to the user's thread."""
+    await services.graph.aupdate_state(
+        thread_config(user_id),
+        {"messages": [HumanMessage(content=user_input), AIMessage(content=reply)]},
+        as_node="chatbot",
+    )
 
-def stream_graph_updates(user_input: str):
-    chunks = []
-    tool_results = []
-    print(f"Starting stream for: {user_input}")
-    
-    for event in graph.stream({"messages": [{"role": "user", "content": user_input}]}):
-        print(f"Event: {list(event.keys())}")
-        for node_name, value in event.items():
-            if node_name == "tools":
-                # Skip tool output, we only want the final chatbot response
-                tool_results.append(value["messages"][-1].content)
-                print(f"Tool executed: {tool_results[-1][:100]}...")
-            elif node_name == "chatbot":
-                msg = value["messages"][-1]
-                if hasattr(msg, "content") and msg.content:
-                    content = msg.content
-                    # Only add content that's not a tool call (actual response)
-                    if content and not hasattr(msg, 'tool_calls') or (hasattr(msg, 'tool_calls') and not msg.tool_calls):
-                        chunks.append(content)
-                        print(f"Added final response: {content[:100]}...")
-    
+
+
+
+
+
+
+
+def collect_event(event, chunks, tool_results, prompt_tokens):
+    for node_name, value in event.items():
+        if node_name == "tools":
+            # Not part of the reply, but kept for used_chat_history: the tool calls of
+            # one turn run side by side, so rag_search's output can be any of them
+            tool_results.extend(msg.content for msg in value["messages"] if isinstance(msg, ToolMessage))
+        elif node_name == "chatbot":
+            prompt_tokens.append(value.get("prompt_tokens", 0))
+            msg = value["messages"][-1]
+            if hasattr(msg, "content") and msg.content:
+                content = msg.content
+                # Only add content that's not a tool call (actual response)
+                if content and not hasattr(msg, 'tool_calls') or (hasattr(msg, 'tool_calls') and not msg.tool_calls):
+                    chunks.append(content)
+
+
+FALLBACK_RESPONSE = "I apologize, but I couldn't process your request properly."
+
+
+def used_chat_history(tool_results, prefetch):
+    """Whether the turn's retrieved context (rag_search or the routed prefetch) included the user's past turns."""
+    from llm import CHAT_HISTORY_FOUND
+
+    contexts = [*tool_results, prefetch.context if prefetch is not None else None]
+    return any(isinstance(context, str) and CHAT_HISTORY_FOUND in context for context in contexts)
+
+
+def record_prompt_tokens(prompt_tokens):
+    total = sum(prompt_tokens)
+    prompt_stats.observe("turn", total)
+    return total
+
+
+def final_response(chunks):
     if chunks:
-        final_response = "".join(chunks)
+        response = "".join(chunks)
     else:
         # Fallback if no final response was captured
-        final_response = "I apologize, but I couldn't process your request properly."
+        response = FALLBACK_RESPONSE
     
-    content = remove_braced_text(final_response)
-    print(f"Final response: {content[:200]}...")
-    return content
+    return remove_braced_text(response)
+
+
+def stream_graph_updates(user_input: str, user_id: str = "terminal"):
+    chunks = []
+    tool_results = []
+    prompt_tokens = []
+
+    for event in services.graph.stream({"messages": [{"role": "user", "content": user_input}]}, run_config(user_id)):
+        collect_event(event, chunks, tool_results, prompt_tokens)
+
+    record_prompt_tokens(prompt_tokens)
+    return final_response(chunks)
+
+
+async def arun_turn(user_input: str, user_id: str):
+    """(reply, whether retrieval used the user's chat history) for one turn through the graph."""
+    chunks = []
+    tool_results = []
+    prompt_tokens = []
+    prefetch = await astart_prefetch(user_input, user_id)
+
+    try:
+        async for event in services.graph.astream(
+            {"messages": [{"role": "user", "content": user_input}]}, run_config(user_id, prefetch)
+        ):
+            collect_event(event, chunks, tool_results, prompt_tokens)
+    finally:
+        finish_prefetch(prefetch)
+
+    record_prompt_tokens(prompt_tokens)
+    return final_response(chunks), used_chat_history(tool_results, prefetch)
+
+
+async def astream_graph_updates(user_input: str, user_id: str):
+    reply, _ = await arun_turn(user_input, user_id)
+    return reply
+
+
+async def astream_chat_events(user_input: str, user_id: str):
+    """
+    Yield (event, data) pairs for a chat turn as they happen: `token` for every
+    model token, `tool_start` / `tool_end` around each tool call and a final
+    `done` carrying the cleaned reply, the turn's prompt tokens and whether
+    retrieval used the user's chat history.
+    """
+    chunks = []
+    tool_results = []
+    prompt_tokens = []
+    prefetch = await astart_prefetch(user_input, user_id)
+
+    try:
+        async for mode, payload in services.graph.astream(
+            {"messages": [{"role": "user", "content": user_input}]},
+            run_config(user_id, prefetch),
+            stream_mode=["messages", "updates"],
+        ):
+            if mode == "messages":
+                message, metadata = payload
+                if (
+                    metadata.get("langgraph_node") == "chatbot"
+                    and isinstance(message, AIMessageChunk)
+                    and isinstance(message.content, str)
+                    and message.content
+                ):
+                    yield "token", {"text": message.content}
+                continue
+
+            collect_event(payload, chunks, tool_results, prompt_tokens)
+            for node_name, value in payload.items():
+                for msg in value["messages"]:
+                    if node_name == "chatbot":
+                        for tool_call in getattr(msg, "tool_calls", None) or []:
+                            yield "tool_start", {"id": tool_call["id"], "name": tool_call["name"], "args": tool_call["args"]}
+                    elif node_name == "tools" and isinstance(msg, ToolMessage):
+                        yield "tool_end", {"id": msg.tool_call_id, "name": msg.name, "status": msg.status}
+    finally:
+        finish_prefetch(prefetch)
+
+    yield "done", {
+        "reply": final_response(chunks),
+        "prompt_tokens": record_prompt_tokens(prompt_tokens),
+        "chat_history": used_chat_history(tool_results, prefetch),
+    }
     
 
 def terminal():
@@ -148,15 +330,15 @@ def terminal():
             if user_input.lower() in ["quit", "exit", "q", "end", "stop"]:
                 print("Goodbye!")
                 break
-            stream_graph_updates(user_input)
+            print("Assistant: " + stream_graph_updates(user_input))
         except:
             user_input = "What do you know about LangGraph?"
             print("User: " + user_input)
-            stream_graph_updates(user_input)
+            print("Assistant: " + stream_graph_updates(user_input))
             break
 
 def test_rag_direct():
-    print(rag_tool.invoke({"query": "What's in the document Sayed Hayat Ahmad.pdf?"}))
+    print(services.rag_tool.invoke({"query": "What's in the document Sayed Hayat Ahmad.pdf?"}))
 
     
 if __name__ == "__main__":
@@ -1,30 +1,116 @@
+import asyncio
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from uuid import uuid4
 
 from langchain_core.messages import ToolMessage
 
+from metrics import registry
+from tracing import span_callbacks, submit
+
+
+tool_timeouts = registry.counter("tool_timeouts_total", "Tool calls abandoned at their deadline.", labels=("tool",))
+
 
 class BasicToolNode:
-    """A node that runs the tools requested in the last AIMessage."""
+    """
+    A node that runs the tools requested in the last AIMessage.
+
+    All tool calls of the message run at once, each under its own deadline
+    (`timeouts[name]`, else `timeout` seconds). A tool that raises or misses its
+    deadline answers with an error ToolMessage instead of failing the turn, so
+    the model can go on with the tools that did answer. Results keep the order
+    of the tool calls.
+    """
 
-    def __init__(self, tools: list) -> None:
+    def __init__(self, tools: list, timeout: float = 10.0, timeouts: dict = None, max_workers: int = 8) -> None:
         self.tools_by_name = {tool.name: tool for tool in tools}
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        # Sync path only; the async path runs the tools as tasks on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tools")
 
-    def __call__(self, inputs: dict):
+    def timeout_for(self, name):
+        return self.timeouts.get(name, self.timeout)
+
+    @staticmethod
+    def _tool_calls(inputs):
         if messages := inputs.get("messages", []):
-            message = messages[-1]
-        else:
-            raise ValueError("No message found in input")
+            return messages[-1].tool_calls
+        raise ValueError("No message found in input")
+
+    @staticmethod
+    def _message(tool_call, result):
+        return ToolMessage(
+            content=result if isinstance(result, str) else json.dumps(result),
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+        )
+
+    @staticmethod
+    def _error(tool_call, error, message):
+        return ToolMessage(
+            content=json.dumps({"error": error, "tool": tool_call["name"], "message": message}),
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+            status="error",
+        )
+
+    def _timed_out(self, tool_call, run_id):
+        name = tool_call["name"]
+        message = f"{name} did not answer within {self.timeout_for(name)}s"
+        tool_timeouts.inc(name)
+        # The tool never reports back (cancelled, or still running on its thread), so close its span here
+        span_callbacks.on_tool_error(TimeoutError(message), run_id=run_id)
+        return self._error(tool_call, "timeout", message)
+
+    def _run(self, tool_call, config, run_id):
+        return self.tools_by_name[tool_call["name"]].invoke(tool_call["args"], dict(config or {}, run_id=run_id))
+
+    def __call__(self, inputs: dict, config=None):
+        start = time.perf_counter()
+        started = []
+        for tool_call in self._tool_calls(inputs):
+            run_id = uuid4()
+            future = None
+            if tool_call["name"] in self.tools_by_name:
+                future = submit(self._executor, self._run, tool_call, config, run_id)
+            started.append((tool_call, run_id, future))
+
         outputs = []
-        for tool_call in message.tool_calls:
-            tool_result = self.tools_by_name[tool_call["name"]].invoke(
-                tool_call["args"]
-            )
-            outputs.append(
-                ToolMessage(
-                    content=json.dumps(tool_result),
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"],
-                )
-            )
+        for tool_call, run_id, future in started:
+            if future is None:
+                outputs.append(self._error(tool_call, "unknown_tool", f"No tool named {tool_call['name']}"))
+                continue
+            # Every deadline counts from the submission, not from when its turn to be collected comes
+            remaining = start + self.timeout_for(tool_call["name"]) - time.perf_counter()
+            try:
+                outputs.append(self._message(tool_call, future.result(timeout=max(0.0, remaining))))
+            except FutureTimeoutError:
+                future.cancel()
+                outputs.append(self._timed_out(tool_call, run_id))
+            except Exception as e:
+                outputs.append(self._error(tool_call, "tool_error", f"{type(e).__name__}: {e}"))
         return {"messages": outputs}
 
+    async def _arun(self, tool_call, config):
+        tool = self.tools_by_name.get(tool_call["name"])
+        if tool is None:
+            return self._error(tool_call, "unknown_tool", f"No tool named {tool_call['name']}")
+        run_id = uuid4()
+        try:
+            result = await asyncio.wait_for(
+                tool.ainvoke(tool_call["args"], dict(config or {}, run_id=run_id)),
+                self.timeout_for(tool_call["name"]),
+            )
+        except asyncio.TimeoutError:
+            return self._timed_out(tool_call, run_id)
+        except Exception as e:
+            return self._error(tool_call, "tool_error", f"{type(e).__name__}: {e}")
+        return self._message(tool_call, result)
+
+    async def acall(self, inputs: dict, config=None):
+        """Async twin of __call__; a tool that misses its deadline is cancelled."""
+        outputs = await asyncio.gather(*(self._arun(tool_call, config) for tool_call in self._tool_calls(inputs)))
+        return {"messages": list(outputs)}
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Type
+
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, PrivateAttr
+
+
+class CachedWebSearch(BaseTool):
+    """
+    TTL cache in front of a web search tool (TavilySearch), under the same name
+    and arguments so the model cannot tell the difference.
+
+    Results are keyed by the normalized query plus every other argument, expire
+    after `ttl_seconds` and the least recently used are evicted past
+    `max_entries`. Identical searches that arrive while one is in flight wait for
+    that call instead of starting their own (single flight). On the sync path a
+    waiter gives up after `timeout` seconds (the tool's deadline) and makes its
+    own call, so a hung leader does not hang every identical search with it.
+    """
+
+    name: str = "tavily_search"
+    description: str = ""
+    args_schema: Type[BaseModel] = None
+
+    _tool: BaseTool = PrivateAttr()
+    _ttl_seconds: float = PrivateAttr()
+    _max_entries: int = PrivateAttr()
+    _timeout: float = PrivateAttr()
+    _entries: OrderedDict = PrivateAttr()
+    _inflight: dict = PrivateAttr()
+    _ainflight: dict = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _stats: dict = PrivateAttr()
+
+    def __init__(self, tool, ttl_seconds=300, max_entries=1000, timeout=None, **kwargs):
+        super().__init__(name=tool.name, description=tool.description, args_schema=tool.args_schema, **kwargs)
+        self._tool = tool
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._timeout = timeout
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._ainflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evictions": 0, "errors": 0,
+                       "wait_timeouts": 0}
+
+    @staticmethod
+    def key(args):
+        args = dict(args)
+        args["query"] = " ".join(str(args.get("query", "")).lower().split())
+        return json.dumps(args, sort_keys=True, default=str)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] >= self._ttl_seconds:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def _put(self, key, result):
+        with self._lock:
+            self._stats["misses"] += 1
+            # Tavily reports some failures in the payload; those are not worth keeping
+            if isinstance(result, dict) and "error" in result:
+                return
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _failed(self):
+        with self._lock:
+            self._stats["errors"] += 1
+
+    def _run(self, **kwargs):
+        key = self.key(kwargs)
+        result = self._get(key)
+        if result is not None:
+            return result
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            try:
+                return future.result(timeout=self._timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self._stats["wait_timeouts"] += 1
+                return self._call(key, kwargs)
+        try:
+            result = self._call(key, kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _call(self, key, kwargs):
+        try:
+            result = self._tool.invoke(kwargs)
+        except Exception:
+            self._failed()
+            raise
+        self._put(key, result)
+        return result
+
+    async def _fetch(self, key, kwargs):
+        try:
+            result = await self._tool.ainvoke(kwargs)
+        except Exception:
+            self._failed()
+            raise
+        self._put(key, result)
+        return result
+
+    async def _arun(self, **kwargs):
+        key = self.key(kwargs)
+        result = self._get(key)
+        if result is not None:
+            return result
+        task = self._ainflight.get(key)
+        if task is None:
+            task = self._ainflight[key] = asyncio.ensure_future(self._fetch(key, kwargs))
+            # A failure is reported to every waiter; retrieving it here keeps asyncio from warning
+            task.add_done_callback(lambda t: (self._ainflight.pop(key, None), t.cancelled() or t.exception()))
+        else:
+            with self._lock:
+                self._stats["coalesced"] += 1
+        # Shielded: a waiter hitting its deadline must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), ttl_seconds=self._ttl_seconds)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = round((stats["hits"] + stats["coalesced"]) / lookups, 4) if lookups else 0.0
+        return stats
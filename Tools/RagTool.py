@@ -1,3 +1,4 @@
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import BaseTool
 from typing import Type
 from pydantic import BaseModel, PrivateAttr  
@@ -11,14 +12,26 @@ class RAGTool(BaseTool):
     args_schema: Type[BaseModel] = RAGToolInput
 
     _gemini: any = PrivateAttr()  
+    _prefetcher: any = PrivateAttr()
 
-    def __init__(self, gemini_instance, **kwargs):
+    def __init__(self, gemini_instance, prefetcher=None, **kwargs):
         super().__init__(**kwargs)
         self._gemini = gemini_instance  
+        self._prefetcher = prefetcher
 
-    def _run(self, query: str) -> str:
-        context = self._gemini.hybrid_search(query)
+    def _run(self, query: str, config: RunnableConfig) -> str:
+        user_id = (config.get("configurable") or {}).get("user_id")
+        context = self._gemini.hybrid_search(query, user_id=user_id)
         return context
 
-    def _arun(self, query: str):
-        raise NotImplementedError("This tool does not support async")
+    async def _arun(self, query: str, config: RunnableConfig) -> str:
+        # The search speculatively started for this turn, if the model asked for (about) the same thing
+        configurable = config.get("configurable") or {}
+        prefetch = configurable.get("prefetch")
+        if self._prefetcher is not None and prefetch is not None:
+            context = await self._prefetcher.take(prefetch, query)
+            if context is not None:
+                return context
+        # Chat history is searched within the asking user's own turns
+        context = await self._gemini.ahybrid_search(query, user_id=configurable.get("user_id"))
+        return context
@@ -0,0 +1,377 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import re
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import LatencyStats, registry
+
+
+# Calls waiting for Gemini are admitted in this order, then by arrival
+PRIORITIES = ("interactive", "background")
+
+queue_depth = registry.gauge("gemini_admission_queue_depth", "Gemini calls waiting for admission.", ["priority"])
+queue_wait = registry.histogram(
+    "gemini_admission_wait_seconds", "Time Gemini calls waited for admission.", ["kind", "priority"]
+)
+rejections = registry.counter(
+    "gemini_admission_rejected_total", "Gemini calls refused because they would miss their queue deadline.",
+    ["kind", "priority"],
+)
+rate_limits = registry.counter("gemini_rate_limited_total", "Rate-limit errors returned by Gemini.", ["kind"])
+
+_RETRY_DELAY = re.compile(r"retry(?:_delay|Delay)?\D{0,12}?(\d+(?:\.\d+)?)\s*s\b", re.IGNORECASE)
+
+
+class AdmissionRejected(Exception):
+    """A call that would not be admitted before its deadline; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_rate_limit(error):
+    """Gemini's quota errors (google.api_core ResourceExhausted, HTTP 429), also when wrapped by langchain."""
+    while error is not None:
+        if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+            return True
+        text = str(error)
+        if text.startswith("429 ") or "RESOURCE_EXHAUSTED" in text:
+            return True
+        error = error.__cause__
+    return False
+
+
+def _retry_hint(error):
+    """The delay Gemini asked for, in seconds, if the error carries one."""
+    hint = getattr(error, "retry_after", None)
+    if hint is None:
+        match = _RETRY_DELAY.search(str(error))
+        hint = float(match.group(1)) if match else None
+    return hint
+
+
+class _Waiter:
+    def __init__(self, rank, loop):
+        self.rank = rank
+        self.queued = True
+        # Woken whenever it may have moved to the front or a slot was freed
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class AdmissionController:
+    """
+    Admission control for Gemini calls, shared by the chat model and the embeddings.
+
+    A call needs a token from a bucket refilled at `rate` per second (holding up
+    to `burst`; a rate of 0 means no rate cap) and one of the concurrency slots.
+    Calls that cannot start queue by priority, interactive before background,
+    then in arrival order. An interactive call that would wait longer than
+    `queue_timeout` seconds is refused with AdmissionRejected, at once when the
+    queue already makes that likely, instead of piling onto a backlog; background
+    calls wait as long as it takes.
+
+    Concurrency adapts to Gemini's quota: a rate-limit error halves the limit
+    (down to 1) and pauses admission for a backoff, Gemini's retry hint if it
+    gave one, and every success grows the limit back towards `concurrency` by
+    about one slot per limit's worth of calls. The rate-limited call is retried
+    up to `retries` times.
+    """
+
+    def __init__(self, rate=0.0, burst=None, concurrency=32, queue_timeout=10.0, retries=4, backoff=1.0,
+                 max_backoff=30.0):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.wait_stats = LatencyStats()
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._limit = float(concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        # Moving average of how long an admitted call holds its slot, for the wait estimate
+        self._service_s = 0.0
+        self._queue = []
+        self._queued = [0] * len(PRIORITIES)
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "rejected": 0, "rate_limited": 0, "retries": 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                queued=dict(zip(PRIORITIES, self._queued)),
+                in_flight=self._in_flight,
+                concurrency_limit=self._slots(),
+                max_concurrency=self.concurrency,
+                rate=self.rate,
+                paused_s=round(max(self._paused_until - time.monotonic(), 0.0), 2),
+                wait_ms=self.wait_stats.snapshot(),
+            )
+
+    # === Queue state, always under self._lock ===
+
+    def _slots(self):
+        return max(int(self._limit), 1)
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _head(self):
+        # Waiters that gave up are only marked; drop them once they reach the front
+        while self._queue and not self._queue[0][2].queued:
+            heapq.heappop(self._queue)
+        return self._queue[0][2] if self._queue else None
+
+    def _wake_head(self):
+        head = self._head()
+        if head is not None:
+            head.wake()
+
+    def _dequeue(self, waiter):
+        waiter.queued = False
+        self._queued[waiter.rank] -= 1
+        queue_depth.set(self._queued[waiter.rank], PRIORITIES[waiter.rank])
+
+    def _estimate(self, rank, now, calls=1):
+        """Rough seconds until the last of `calls` calls of priority `rank` arriving now would be admitted."""
+        ahead = sum(self._queued[:rank + 1])
+        wait = max(self._paused_until - now, 0.0)
+        slots = self._slots()
+        free = slots - self._in_flight
+        if ahead + calls > free:
+            wait += math.ceil((ahead + calls - free) / slots) * self._service_s
+        if self.rate:
+            wait = max(wait, (ahead + calls - self._tokens) / self.rate)
+        return wait
+
+    def _grant(self, waiter, now):
+        """0 once `waiter` is admitted, else seconds until it may be (None: until it is woken)."""
+        self._refill(now)
+        if self._head() is not waiter:
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= self._slots():
+            return None
+        if self.rate and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        heapq.heappop(self._queue)
+        self._dequeue(waiter)
+        if self.rate:
+            self._tokens -= 1
+        self._in_flight += 1
+        self._stats["admitted"] += 1
+        # The next in line may be able to start too
+        self._wake_head()
+        return 0
+
+    def _rejection(self, kind, priority, retry_after):
+        self._stats["rejected"] += 1
+        rejections.inc(kind, priority)
+        return AdmissionRejected(
+            f"Gemini is at capacity; the {kind} call would wait more than {self.queue_timeout:g}s.",
+            retry_after=round(max(retry_after, 1.0), 1),
+        )
+
+    # === Waiting for a slot ===
+
+    def _deadline(self, priority):
+        if priority == "interactive" and self.queue_timeout:
+            return time.monotonic() + self.queue_timeout
+        return None
+
+    def _enqueue(self, kind, priority, deadline, loop):
+        rank = PRIORITIES.index(priority)
+        now = time.monotonic()
+        with self._lock:
+            self._refill(now)
+            if deadline is not None:
+                estimate = self._estimate(rank, now)
+                if now + estimate > deadline:
+                    raise self._rejection(kind, priority, estimate)
+            waiter = _Waiter(rank, loop)
+            heapq.heappush(self._queue, (rank, next(self._seq), waiter))
+            self._queued[rank] += 1
+            queue_depth.set(self._queued[rank], priority)
+        return waiter
+
+    def _poll(self, waiter, kind, priority, deadline):
+        """0 once admitted, else how long to wait before trying again (None: until woken)."""
+        waiter.event.clear()
+        with self._lock:
+            now = time.monotonic()
+            timeout = self._grant(waiter, now)
+            if timeout == 0 or deadline is None:
+                return timeout
+            if now >= deadline:
+                self._dequeue(waiter)
+                self._wake_head()
+                raise self._rejection(kind, priority, self._estimate(waiter.rank, now))
+        return deadline - now if timeout is None else min(timeout, deadline - now)
+
+    def _leave(self, waiter):
+        with self._lock:
+            if waiter.queued:
+                self._dequeue(waiter)
+                self._wake_head()
+
+    def _admitted(self, kind, priority, started):
+        waited = time.monotonic() - started
+        queue_wait.observe(waited, kind, priority)
+        self.wait_stats.observe(f"{kind}_{priority}", waited * 1000)
+
+    def acquire(self, kind, priority="interactive", deadline=None):
+        started = time.monotonic()
+        waiter = self._enqueue(kind, priority, deadline, None)
+        try:
+            while (timeout := self._poll(waiter, kind, priority, deadline)) != 0:
+                waiter.event.wait(timeout)
+        except BaseException:
+            self._leave(waiter)
+            raise
+        self._admitted(kind, priority, started)
+
+    async def aacquire(self, kind, priority="interactive", deadline=None):
+        started = time.monotonic()
+        waiter = self._enqueue(kind, priority, deadline, asyncio.get_running_loop())
+        try:
+            while (timeout := self._poll(waiter, kind, priority, deadline)) != 0:
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._leave(waiter)
+            raise
+        self._admitted(kind, priority, started)
+
+    def release(self, kind, elapsed, error=None):
+        """Free the slot of a call that took `elapsed` seconds; `error` is what it raised, if anything."""
+        limited = error is not None and is_rate_limit(error)
+        with self._lock:
+            self._in_flight -= 1
+            if limited:
+                self._stats["rate_limited"] += 1
+                self._limit = max(self._limit / 2, 1.0)
+                self._tokens = min(self._tokens, 0.0)
+            elif error is None:
+                self._limit = min(self._limit + 1 / self._limit, float(self.concurrency))
+                self._service_s = elapsed if not self._service_s else 0.8 * self._service_s + 0.2 * elapsed
+            self._wake_head()
+        if limited:
+            rate_limits.inc(kind)
+        return limited
+
+    def _back_off(self, error, attempt):
+        """Pause admission after a rate-limit error, for Gemini's hint or an exponential backoff with jitter."""
+        delay = _retry_hint(error)
+        if delay is None:
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self._stats["retries"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def check(self, kind="chat", priority="interactive", calls=1):
+        """Raise AdmissionRejected now if `calls` calls queued at this moment would miss their deadline."""
+        if self._deadline(priority) is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            estimate = self._estimate(PRIORITIES.index(priority), now, calls)
+            if estimate > self.queue_timeout:
+                raise self._rejection(kind, priority, estimate)
+
+    # === Calls ===
+
+    def call(self, kind, fn, priority="interactive"):
+        """fn() once admitted, retried on rate-limit errors."""
+        deadline = self._deadline(priority)
+        for attempt in itertools.count():
+            self.acquire(kind, priority, deadline)
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                if not self.release(kind, time.monotonic() - started, e) or attempt >= self.retries:
+                    raise
+                self._back_off(e, attempt)
+                continue
+            except BaseException as e:
+                self.release(kind, time.monotonic() - started, e)
+                raise
+            self.release(kind, time.monotonic() - started)
+            return result
+
+    async def acall(self, kind, fn, priority="interactive"):
+        """Await fn() once admitted, retried on rate-limit errors; fn returns a new awaitable per attempt."""
+        deadline = self._deadline(priority)
+        for attempt in itertools.count():
+            await self.aacquire(kind, priority, deadline)
+            started = time.monotonic()
+            try:
+                result = await fn()
+            except Exception as e:
+                if not self.release(kind, time.monotonic() - started, e) or attempt >= self.retries:
+                    raise
+                self._back_off(e, attempt)
+                continue
+            except BaseException as e:
+                self.release(kind, time.monotonic() - started, e)
+                raise
+            self.release(kind, time.monotonic() - started)
+            return result
+
+
+class AdmittedEmbeddings(Embeddings):
+    """
+    An embedding model whose calls go through an AdmissionController: queries
+    are interactive (a chat turn waits on them), document batches from uploads
+    and chat history are background.
+    """
+
+    def __init__(self, embeddings, admission):
+        self.embeddings = embeddings
+        self.admission = admission
+
+    def __getattr__(self, name):
+        # Behave like the wrapped model for anything we don't override (model, task_type, ...)
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def embed_documents(self, texts, **kwargs):
+        # A batch of queries (CachedEmbeddings.embed_queries) is waited on like a single query
+        priority = "interactive" if kwargs.get("task_type") == "RETRIEVAL_QUERY" else "background"
+        return self.admission.call("embed", lambda: self.embeddings.embed_documents(texts, **kwargs), priority)
+
+    def embed_query(self, text):
+        return self.admission.call("embed", lambda: self.embeddings.embed_query(text))
+
+    async def aembed_documents(self, texts):
+        return await self.admission.acall("embed", lambda: self.embeddings.aembed_documents(texts), "background")
+
+    async def aembed_query(self, text):
+        return await self.admission.acall("embed", lambda: self.embeddings.aembed_query(text))
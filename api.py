@@ -1,17 +1,86 @@
-from fastapi import FastAPI, UploadFile, File, Request
+import asyncio
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from Agent import stream_graph_updates
+from Agent import (
+    arun_turn, astream_chat_events, ahas_history, aremember_turn,
+    prompt_stats, FALLBACK_RESPONSE,
+)
+from admission import AdmissionRejected
+from chat_writer import BacklogFullError
+from document_parser import is_supported
+from extraction import ExtractionPool
+from ingestion import IngestionJobs, QueueFullError
 from logging_config import RequestIDMiddleware, logger
+from metrics import registry
+from services import services
 from dotenv import load_dotenv
-from llm import Gemini
 
-bot = Gemini()
+
+async def ready_bot():
+    await services.wait_ready()
+    return services.bot
+
+
+ingestion = IngestionJobs(
+    ready_bot,
+    workers=int(os.getenv("INGEST_WORKERS", "2")),
+    max_queued=int(os.getenv("INGEST_MAX_QUEUED", "100")),
+    spool_dir=os.getenv("UPLOAD_SPOOL_DIR") or None,
+    extraction=ExtractionPool(
+        workers=int(os.getenv("EXTRACT_WORKERS", "2")),
+        timeout=float(os.getenv("EXTRACT_TIMEOUT", "300")),
+        max_pages=int(os.getenv("EXTRACT_MAX_PAGES", "2000")),
+        pages_per_part=int(os.getenv("EXTRACT_PAGES_PER_PART", "25")),
+    ),
+)
+
+
+# /chat/batch: turns per request, and turns answered at once
+chat_batch_max = int(os.getenv("CHAT_BATCH_MAX_SIZE", "1000"))
+chat_batch_concurrency = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve right away; the model, indexes and graph are built in the background
+    services.start_warm_up()
+    await ingestion.start()
+    yield
+    await ingestion.stop()
+    await services.aclose()
+
+
+async def require_ready():
+    """Dependency for endpoints that need the services: waits for warm-up, 503 if it failed."""
+    try:
+        await services.wait_ready()
+    except Exception:
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {services.error}")
+
+
+async def admit_chat():
+    """Dependency for chat endpoints: 429 at once when Gemini's queue would outlast GEMINI_QUEUE_TIMEOUT."""
+    if services.admission is not None:
+        services.admission.check()
+
+
+def too_many_requests(e):
+    return {"detail": str(e), "retry_after": e.retry_after}
 
 
 class ChatRequest(BaseModel):
     message: str
     user_id: str
 
+class BatchChatRequest(BaseModel):
+    requests: list[ChatRequest]
+
 class SearchRequest(BaseModel):
     query: str
 
@@ -20,49 +89,327 @@ app = FastAPI(
     description="Chatbot using Gemini, FastAPI, and Tavily.",
     version="1.0.0",
     docs_url="/docs",      
-    redoc_url="/redoc"      
+    redoc_url="/redoc",
+    lifespan=lifespan,
 )
 app.add_middleware(RequestIDMiddleware)
 
-@app.post("/chat/")
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, e: AdmissionRejected):
+    return JSONResponse(status_code=429, content=too_many_requests(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+@app.exception_handler(BacklogFullError)
+async def chat_backlog_full(request: Request, e: BacklogFullError):
+    # MongoDB is not keeping up (or is down); the turn could not be persisted
+    return JSONResponse(status_code=503, content={"detail": str(e)})
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once warm-up finished, 503 (with progress or the error) until then."""
+    if not services.ready:
+        services.start_warm_up()
+        return JSONResponse(status_code=503, content=services.status())
+    return services.status()
+
+
+async def use_response_cache(user_id):
+    # A follow-up's answer depends on the conversation, so only opening turns are cached
+    return services.response_cache is not None and not await ahas_history(user_id)
+
+
+async def cached_reply(message):
+    return await services.response_cache.alookup(message)
+
+
+async def remember_reply(message, reply, started):
+    if services.response_cache is not None and reply != FALLBACK_RESPONSE:
+        await services.response_cache.astore(message, reply, (time.perf_counter() - started) * 1000)
+
+
+async def answer_turn(message, user_id, logger):
+    """
+    One /chat/ turn: the response cache for opening turns, else the graph; the
+    turn is journaled either way. Returns (reply, whether it drew on the user's
+    chat history); such a reply is personal and is not cached for others.
+    """
+    start = time.perf_counter()
+    cacheable = await use_response_cache(user_id)
+    reply = await cached_reply(message) if cacheable else None
+    personal = False
+    if reply is not None:
+        logger.info("Answered from response cache")
+        await aremember_turn(user_id, message, reply)
+    else:
+        reply, personal = await arun_turn(message, user_id)
+        if cacheable and not personal:
+            await remember_reply(message, reply, start)
+    logger.info(f"Bot response: {reply}")
+    await services.bot.aingest_response(message, reply, user_id)
+    return reply, personal
+
+
+@app.post("/chat/", dependencies=[Depends(require_ready), Depends(admit_chat)])
 async def chat(req: ChatRequest, request: Request):
     logger = request.state.logger
     logger.info(f"User query: {req.message}")
-    reply = stream_graph_updates(req.message)
-    logger.info(f"Bot response: {reply}")
-    bot.ingest_response(req.message, reply, req.user_id)
+    reply, _ = await answer_turn(req.message, req.user_id, logger)
     return {"reply": reply}
 
 
+def batch_key(message):
+    return " ".join(message.lower().split())
+
+
+async def run_chat_batch(turns, logger, concurrency):
+    """
+    Answer `turns` ((user_id, message) pairs) and yield a result for each as it
+    finishes, tagged with its index. The distinct messages are embedded in one
+    batched call first, which the embedding cache then serves to the response
+    cache, speculative retrieval and rag_search. A user's turns run in order;
+    different users' turns run side by side, at most `concurrency` at a time.
+    Opening turns (no thread history, the same rule as the response cache)
+    with the same message share one graph run, and the answer is added to each
+    of those users' threads, unless it drew on the leading user's chat history.
+    """
+    try:
+        await services.bot.embedding_model.aembed_queries(list(dict.fromkeys(message for _, message in turns)))
+    except Exception as e:
+        # Each turn embeds its own query instead
+        logger.warning(f"Batched query embedding failed: {e}")
+
+    by_user = {}
+    for index, (user_id, message) in enumerate(turns):
+        by_user.setdefault(user_id, []).append((index, message))
+
+    slots = asyncio.Semaphore(concurrency)
+    results = asyncio.Queue()
+    shared = {}
+
+    async def share(user_id, message, leader):
+        """(reply, shared) for a turn repeating the opening turn `leader` answers."""
+        reply, personal = await asyncio.shield(leader)
+        if personal:
+            # Built on the leading user's own past turns: this user gets an answer of their own
+            reply, _ = await lead(user_id, message, None)
+            return reply, False
+        await aremember_turn(user_id, message, reply)
+        await services.bot.aingest_response(message, reply, user_id)
+        return reply, True
+
+    async def lead(user_id, message, future):
+        try:
+            async with slots:
+                answer = await answer_turn(message, user_id, logger)
+        except BaseException as e:
+            if future is not None:
+                future.set_exception(e if isinstance(e, Exception) else RuntimeError("The shared turn was cancelled."))
+            raise
+        if future is not None:
+            future.set_result(answer)
+        return answer
+
+    async def run_turn(index, user_id, message, opening):
+        start = time.perf_counter()
+        result = {"index": index, "user_id": user_id}
+        try:
+            key = batch_key(message)
+            if opening and key in shared:
+                result["reply"], result["shared"] = await share(user_id, message, shared[key])
+            else:
+                future = None
+                if opening:
+                    future = shared[key] = asyncio.get_running_loop().create_future()
+                    # Read by the turns that share it; a failure nobody else waited on is not an unhandled error
+                    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                result["reply"], _ = await lead(user_id, message, future)
+                result["shared"] = False
+        except AdmissionRejected as e:
+            result.update(too_many_requests(e), status=429)
+        except Exception as e:
+            logger.error(f"Batch turn {index} failed: {e}")
+            result.update(detail=f"{type(e).__name__}: {e}", status=500)
+        result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    async def run_user(user_id, user_turns):
+        try:
+            async with slots:
+                opening = not await ahas_history(user_id)
+        except Exception as e:
+            # Not shared then, but still answered
+            logger.warning(f"Could not read the thread of {user_id}: {e}")
+            opening = False
+        for index, message in user_turns:
+            await results.put(await run_turn(index, user_id, message, opening))
+            opening = False
+
+    tasks = [asyncio.create_task(run_user(user_id, user_turns)) for user_id, user_turns in by_user.items()]
+    try:
+        for _ in turns:
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream", dependencies=[Depends(require_ready), Depends(admit_chat)])
+async def chat_stream(req: ChatRequest, request: Request):
+    """Server-Sent Events version of /chat/: tokens are pushed as Gemini produces them."""
+    logger = request.state.logger
+    logger.info(f"User query (stream): {req.message}")
+    start = time.perf_counter()
+
+    async def chat_events():
+        cacheable = await use_response_cache(req.user_id)
+        cached = await cached_reply(req.message) if cacheable else None
+        if cached is not None:
+            logger.info("Answered from response cache")
+            await aremember_turn(req.user_id, req.message, cached)
+            yield "token", {"text": cached}
+            yield "done", {"reply": cached, "cached": True, "prompt_tokens": 0}
+            return
+        async for event, data in astream_chat_events(req.message, req.user_id):
+            if event == "done":
+                personal = data.pop("chat_history")
+                if cacheable and not personal:
+                    await remember_reply(req.message, data["reply"], start)
+                data["cached"] = False
+            yield event, data
+
+    async def events():
+        ttft_ms = None
+        try:
+            async for event, data in chat_events():
+                if event == "token" and ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+                    logger.info(f"Time to first token: {ttft_ms} ms")
+                if event == "done":
+                    reply = data["reply"]
+                    logger.info(f"Bot response: {reply}")
+                    await services.bot.aingest_response(req.message, reply, req.user_id)
+                    data["ttft_ms"] = ttft_ms
+                    data["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                yield sse(event, data)
+        except AdmissionRejected as e:
+            # The 200 is already sent; a turn rejected mid-way ends with an error event instead
+            logger.warning(f"Chat turn rejected: {e}")
+            yield sse("error", dict(too_many_requests(e), status=429))
+        except Exception as e:
+            # Likewise for any other failure, so the client can tell it from a finished reply
+            logger.error(f"Chat stream failed: {e}")
+            yield sse("error", {"detail": f"{type(e).__name__}: {e}", "status": 500})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 
 
+
+@app.post("/chat/batch", dependencies=[Depends(require_ready)])
+async def chat_batch(req: BatchChatRequest, request: Request):
+    """
+    Many /chat/ turns in one request, for evaluation and bulk jobs. Results come
+    back as Server-Sent Events as each turn finishes: `result` with the turn's
+    index, reply and time (or its `status` and `detail` if it failed), then `done`.
+    """
+    logger = request.state.logger
+    if len(req.requests) > chat_batch_max:
+        raise HTTPException(status_code=413, detail=f"A batch holds at most {chat_batch_max} turns.")
+    if services.admission is not None:
+        # Weighted by the turns that run at once; each turn's calls are still admitted one by one
+        services.admission.check(calls=min(len(req.requests), chat_batch_concurrency))
+    logger.info(f"Chat batch: {len(req.requests)} turns")
+    start = time.perf_counter()
+
+    async def events():
+        failed = shared = 0
+        async for result in run_chat_batch([(r.user_id, r.message) for r in req.requests], logger, chat_batch_concurrency):
+            failed += "status" in result
+            shared += bool(result.get("shared"))
+            yield sse("result", result)
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Chat batch done: {len(req.requests)} turns, {failed} failed, {shared} shared, {total_ms} ms")
+        yield sse("done", {"turns": len(req.requests), "failed": failed, "shared": shared, "total_ms": total_ms})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/stats/", dependencies=[Depends(require_ready)])
+async def stats():
+    bot = services.bot
+    response_cache = services.response_cache
+    checkpointer = services.checkpointer
+    return {
+        "embedding_cache": bot.embedding_model.stats(),
+        "retrieval_ms": bot.retrieval_stats.snapshot(),
+        "retrieval_cache": bot.retrieval_cache.stats() if bot.retrieval_cache is not None else None,
+        "context_tokens": bot.context_packer.stats.snapshot() if bot.context_packer is not None else None,
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "web_cache": services.web_search.stats() if hasattr(services.web_search, "stats") else None,
+        "prefetch": services.prefetcher.stats() if services.prefetcher is not None else None,
+        "chat_writer": bot.chat_writer.stats(),
+        "extraction_ms": ingestion.extraction.stats.snapshot(),
+        "admission": services.admission.stats() if services.admission is not None else None,
+        "prompt_tokens": prompt_stats.snapshot(),
+        "threads": checkpointer.thread_count() if hasattr(checkpointer, "thread_count") else None,
+        "startup_ms": services.timings,
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: span latency histograms, error counters and model token counts."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/traces/{request_id}")
+async def traces(request_id: str):
+    """Spans recorded for one request (the X-Request-ID header), with TRACE_EXPORTER=local."""
+    exporter = services.trace_exporter
+    if not hasattr(exporter, "for_request"):
+        raise HTTPException(status_code=404, detail="Spans are not kept locally; see TRACE_EXPORTER.")
+    return {"request_id": request_id, "spans": exporter.for_request(request_id)}
+
+
 @app.post("/upload/")
 async def upload_document(file: UploadFile = File(...)):
+    """Accept the file and queue it; poll /upload/{job_id} for progress."""
     filename = file.filename
-    filename_lower = filename.lower()
-    contents = await file.read()
-    text = ""
+    if not is_supported(filename):
+        return {"status": "error", "message": "Unsupported file type."}
 
     try:
-        if filename_lower.endswith(".txt"):
-            text = contents.decode("utf-8", errors="ignore")
-        elif filename_lower.endswith(".pdf"):
-            import io
-            from PyPDF2 import PdfReader
-            pdf = PdfReader(io.BytesIO(contents))
-            text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-        elif filename_lower.endswith(".docx"):
-            import io
-            from docx import Document
-            doc = Document(io.BytesIO(contents))
-            text = "\n".join([para.text for para in doc.paragraphs])
-        else:
-            return {"status": "error", "message": "Unsupported file type."}
-
-        # Use original filename, not lowercased
-        bot.ingest_document(text, doc_id=filename, filename=filename)
-        return {"status": "success", "message": f"{filename} uploaded and processed."}
-    except Exception as e:
-        print(f"Upload error: {e}")
-        return {"status": "error", "message": f"Error processing file: {str(e)}"}
\ No newline at end of file
+        job = await ingestion.submit(filename, file.file)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "accepted", "job_id": job["job_id"], "message": f"{filename} queued for processing."}
+
+
+@app.get("/upload/{job_id}")
+async def upload_status(job_id: str):
+    job = ingestion.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id.")
+    return job
+
+
+@app.delete("/upload/{job_id}")
+async def cancel_upload(job_id: str):
+    """Cancel a queued or running upload; chunks already stored are kept."""
+    job = ingestion.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id.")
+    return job
@@ -0,0 +1,129 @@
+"""
+A burst of /chat/ traffic and an upload against a Gemini quota, without and with admission control.
+
+The fake chat model and embeddings share a quota of `--rps` calls per second
+and raise a 429 beyond it, as Gemini does. `--clients` users send
+`--requests` chat turns each while a document is ingested in small embedding
+batches. Each mode runs in its own process against `api.app`:
+  off       GEMINI_ADMISSION=off: every call goes straight to the model
+  adaptive  no rate cap; rate-limit errors halve the concurrency limit and pause admission
+  bucket    a token bucket at 90% of the quota as well
+Reported per mode: chat turns answered, answered with failed retrieval, refused with a
+429, failed with a 5xx; latency of the answered turns; the upload's outcome; and
+how many calls the quota turned away.
+
+    python -m benchmarks.admission --rps 20 --clients 24
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import fakes
+from benchmarks.load import QUANTILES, document, summarize
+
+
+async def chat_client(client, i, requests, outcomes, latencies):
+    for n in range(requests):
+        start = time.perf_counter()
+        r = await client.post("/chat/", json={"message": f"what grew in region {(i + n) % 7}", "user_id": f"bench-{i}-{n}"})
+        if r.status_code == 200:
+            if "Error retrieving documents" in r.json()["reply"]:
+                outcomes["degraded"] += 1
+            else:
+                outcomes["ok"] += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+        elif r.status_code == 429:
+            outcomes["429"] += 1
+        else:
+            outcomes["5xx"] += 1
+
+
+async def run(args):
+    import httpx
+    import api
+    from services import services
+
+    logging.getLogger("app").setLevel(logging.CRITICAL)
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await client.get("/ready")
+            await services.wait_ready()
+            # The quota window starts empty
+            await asyncio.sleep(1.0)
+
+            outcomes = {"ok": 0, "degraded": 0, "429": 0, "5xx": 0}
+            latencies = []
+            started = time.perf_counter()
+            r = await client.post("/upload/", files={"file": ("report.txt", document(0, args.sections))})
+            job_id = r.json()["job_id"]
+            await asyncio.gather(*(chat_client(client, i, args.requests, outcomes, latencies) for i in range(args.clients)))
+            chat_s = time.perf_counter() - started
+            while (job := (await client.get(f"/upload/{job_id}")).json())["finished_at"] is None:
+                await asyncio.sleep(0.1)
+            upload_s = time.perf_counter() - started
+
+    return {
+        "outcomes": outcomes,
+        "latency": summarize(latencies) if latencies else None,
+        "chat_s": round(chat_s, 2),
+        "upload": job["status"],
+        "upload_s": round(upload_s, 2),
+        "quota_rejected": fakes.quota.rejected,
+        "quota_accepted": fakes.quota.accepted,
+    }
+
+
+def child(args):
+    fakes.install(llm=args.llm_latency, embed=args.embed_latency, mongo=0.001, token=0.0, rps=args.rps)
+    os.environ["RESPONSE_CACHE"] = "off"
+    os.environ["EMBED_BATCH_SIZE"] = str(args.batch_size)
+    if args.mode == "off":
+        os.environ["GEMINI_ADMISSION"] = "off"
+    else:
+        os.environ["GEMINI_RPS"] = str(args.rps * 0.9 if args.mode == "bucket" else 0)
+        os.environ["GEMINI_QUEUE_TIMEOUT"] = str(args.queue_timeout)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run(args))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rps", type=int, default=20, help="the fake Gemini quota, calls per second")
+    parser.add_argument("--clients", type=int, default=24)
+    parser.add_argument("--requests", type=int, default=3, help="chat turns per client")
+    parser.add_argument("--sections", type=int, default=300, help="paragraphs in the uploaded document")
+    parser.add_argument("--batch-size", type=int, default=8, help="EMBED_BATCH_SIZE")
+    parser.add_argument("--queue-timeout", type=float, default=10.0, help="GEMINI_QUEUE_TIMEOUT")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--mode", choices=("off", "adaptive", "bucket"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return child(args)
+
+    print(f"{args.clients} clients x {args.requests} chat turns and one upload, quota {args.rps} calls/s")
+    print(f"{'mode':<10}{'ok':>5}{'degr':>6}{'429':>5}{'5xx':>5}" + "".join(f"{'p' + str(q):>9}" for q in QUANTILES)
+          + f"{'chat s':>8}{'upload':>11}{'upload s':>10}{'quota 429s':>12}")
+    for mode in ("off", "adaptive", "bucket"):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.admission", *sys.argv[1:], "--mode", mode],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        o, latency = result["outcomes"], result["latency"]
+        quantiles = "".join(f"{latency['p' + str(q)]:>9.0f}" if latency else f"{'-':>9}" for q in QUANTILES)
+        print(f"{mode:<10}{o['ok']:>5}{o['degraded']:>6}{o['429']:>5}{o['5xx']:>5}{quantiles}{result['chat_s']:>8.1f}"
+              f"{result['upload']:>11}{result['upload_s']:>10.1f}{result['quota_rejected']:>12}")
+
+
+if __name__ == "__main__":
+    main()
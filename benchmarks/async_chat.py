@@ -0,0 +1,77 @@
+"""
+Concurrency benchmark for /chat/: blocking graph path vs the async path.
+
+Both variants run through FastAPI in-process against the local fakes, so only
+the code path differs. Usage:
+
+    python -m benchmarks.async_chat --requests 50 --concurrency 25
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import time
+
+from benchmarks import fakes
+
+
+async def drive(app, total, concurrency):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(i):
+            async with semaphore:
+                r = await client.post("/chat/", json={"message": f"question {i} about the report", "user_id": f"bench-{i}"})
+                r.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - start
+
+
+def blocking_app():
+    """The pre-async /chat/ handler: sync graph and pymongo calls inside `async def`."""
+    from fastapi import FastAPI
+    import api
+    from Agent import stream_graph_updates
+    from services import services
+
+    app = FastAPI()
+
+    @app.post("/chat/")
+    async def chat(req: api.ChatRequest):
+        reply = stream_graph_updates(req.message, req.user_id)
+        services.bot.ingest_response(req.message, reply, req.user_id)
+        return {"reply": reply}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--mongo-latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    fakes.install(llm=args.llm_latency, embed=args.embed_latency, mongo=args.mongo_latency)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        logging.getLogger("app").setLevel(logging.WARNING)
+        before = asyncio.run(drive(blocking_app(), args.requests, args.concurrency))
+        after = asyncio.run(drive(api.app, args.requests, args.concurrency))
+
+    print(f"requests={args.requests} concurrency={args.concurrency}")
+    print(f"blocking /chat/: {args.requests / before:8.1f} req/s ({before:.2f}s)")
+    print(f"async    /chat/: {args.requests / after:8.1f} req/s ({after:.2f}s)")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
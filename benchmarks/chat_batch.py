@@ -0,0 +1,116 @@
+"""
+/chat/batch vs the same turns sent one by one to /chat/.
+
+`--turns` opening turns from fresh users, drawn from `--distinct` questions so
+that some repeat, as in a bulk-FAQ or evaluation set. Each mode runs in its
+own process against `api.app` on the local fakes:
+  sequential  one /chat/ request after another
+  batch       one /chat/batch request (CHAT_BATCH_CONCURRENCY turns at a time)
+Reported: wall time, turns per second, embedding model calls, hybrid_search
+runs and turns answered by a shared graph run.
+
+    python -m benchmarks.chat_batch --turns 200 --distinct 120
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks import fakes
+
+
+def questions(turns, distinct):
+    rng = random.Random(0)
+    pool = [f"how much did revenue grow in region {i} last quarter" for i in range(distinct)]
+    return pool[:turns] + [rng.choice(pool) for _ in range(turns - distinct)]
+
+
+def read_events(text):
+    for block in text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        yield event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+async def run(args):
+    import httpx
+    import api
+    from services import services
+
+    logging.getLogger("app").setLevel(logging.WARNING)
+    turns = [(f"bench-{i}", message) for i, message in enumerate(questions(args.turns, args.distinct))]
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await client.get("/ready")
+            await services.wait_ready()
+            bot = services.bot
+            embed_calls = bot.embedding_model.calls
+
+            shared = failed = 0
+            started = time.perf_counter()
+            if args.mode == "sequential":
+                for user_id, message in turns:
+                    r = await client.post("/chat/", json={"message": message, "user_id": user_id})
+                    failed += r.status_code != 200
+            else:
+                body = {"requests": [{"user_id": user_id, "message": message} for user_id, message in turns]}
+                r = await client.post("/chat/batch", json=body)
+                for event, data in read_events(r.text):
+                    if event == "result":
+                        failed += "status" in data
+                        shared += data.get("shared", False)
+            elapsed = time.perf_counter() - started
+
+            return {
+                "seconds": round(elapsed, 2),
+                "turns_per_s": round(len(turns) / elapsed, 2),
+                "embed_calls": bot.embedding_model.calls - embed_calls,
+                "searches": bot.retrieval_stats.snapshot().get("total", {}).get("count", 0),
+                "shared": shared,
+                "failed": failed,
+            }
+
+
+def child(args):
+    fakes.install(llm=args.llm_latency, embed=args.embed_latency, mongo=0.002, token=0.0)
+    os.environ["CHAT_BATCH_CONCURRENCY"] = str(args.concurrency)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run(args))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=120, help="distinct questions among the turns")
+    parser.add_argument("--concurrency", type=int, default=8, help="CHAT_BATCH_CONCURRENCY")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--mode", choices=("sequential", "batch"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return child(args)
+
+    print(f"{args.turns} opening turns, {args.distinct} distinct questions")
+    print(f"{'mode':<12}{'seconds':>9}{'turns/s':>9}{'embed calls':>13}{'searches':>10}{'shared':>8}{'failed':>8}")
+    results = {}
+    for mode in ("sequential", "batch"):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.chat_batch", *sys.argv[1:], "--mode", mode],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        r = results[mode] = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<12}{r['seconds']:>9.1f}{r['turns_per_s']:>9.1f}{r['embed_calls']:>13}{r['searches']:>10}"
+              f"{r['shared']:>8}{r['failed']:>8}")
+    print(f"batch throughput: {results['batch']['turns_per_s'] / results['sequential']['turns_per_s']:.1f}x sequential")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Chat-history retrieval over the asking user's recent turns, as the user count grows.
+
+`--turns` past turns are seeded for each of 10, 100 and 1000 users (`--users`),
+spread over the last 60 days; every user's turns are about their own project,
+in shared vocabulary. Each user then asks about their project, and the chat
+stage of hybrid_search reads the user's CHAT_HISTORY_WINDOW_DAYS window, newest
+first, through the (user_id, timestamp) index and ranks it in process. No index
+over every user's turns is kept, so latency should not grow with the user count.
+mongomock scans a collection for every query, which no indexed Mongo lookup
+does, so the collection here serves the query shapes the search issues
+(_id $in, user_id + timestamp range) from dicts, as those indexes would.
+Reported per scale: median / p95 chat-stage latency and the share of returned
+turns that belong to another user.
+
+    python -m benchmarks.chat_history_scope --users 10 100 1000 --turns 50
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from benchmarks import fakes
+
+
+WORDS = "budget deadline vendor launch review hiring roadmap risk invoice migration".split()
+
+
+class IndexedCursor:
+    def __init__(self, docs, projection):
+        self._docs = docs
+        self._projection = projection
+
+    def sort(self, *args, **kwargs):
+        # Already newest first, like a walk of the (user_id, timestamp desc) index
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        fields = ["_id", *(self._projection or {})]
+        return [{key: doc[key] for key in fields if key in doc} for doc in self._docs]
+
+
+class IndexedChats:
+    """The async chat-history collection with the _id and (user_id, timestamp) indexes."""
+
+    def __init__(self, turns):
+        self.by_id = {turn["_id"]: turn for turn in turns}
+        self.by_user = {}
+        for turn in sorted(turns, key=lambda turn: turn["timestamp"], reverse=True):
+            self.by_user.setdefault(turn["user_id"], []).append(turn)
+
+    async def aggregate(self, pipeline, *args, **kwargs):
+        raise RuntimeError("$search is not available")
+
+    def find(self, query, projection=None):
+        if "_id" in query:
+            return IndexedCursor([self.by_id[i] for i in query["_id"]["$in"] if i in self.by_id], projection)
+        since = query.get("timestamp", {}).get("$gte", datetime.min)
+        turns = self.by_user.get(query["user_id"], [])
+        # The index range scan stops at the window's oldest turn
+        window = []
+        for turn in turns:
+            if turn["timestamp"] < since:
+                break
+            window.append(turn)
+        return IndexedCursor(window, projection)
+
+
+def seed(users, turns, rng):
+    now = datetime.utcnow()
+    docs = []
+    for user in range(users):
+        for _ in range(turns):
+            topic = rng.sample(WORDS, 3)
+            docs.append({
+                "_id": ObjectId(),
+                "user_id": f"user-{user}",
+                "user_query": f"what is the {topic[0]} for my project {' '.join(topic[1:])}",
+                "response_text": f"The {topic[0]} for project p{user} is {rng.randint(1, 99)} and the {topic[1]} is on track.",
+                "timestamp": now - timedelta(days=rng.uniform(0, 60)),
+            })
+    return docs
+
+
+async def measure(bot, chats, queries, k):
+    latencies, foreign, returned = [], 0, 0
+    for user_id, query in queries:
+        started = time.perf_counter()
+        results = await bot._asearch_chat(query, k, user_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+        returned += len(results)
+        foreign += sum(chats.by_id[result["_id"]]["user_id"] != user_id for result in results)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "foreign": foreign / returned if returned else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--turns", type=int, default=50, help="past turns per user")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6, help="candidates per source, as hybrid_search fetches")
+    args = parser.parse_args()
+
+    fakes.install(mongo=0.0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        from services import services
+        bot = services.bot
+
+    rng = random.Random(0)
+    print(f"{args.turns} turns per user, {bot.chat_window_days:g}-day window, {args.queries} queries, k={args.k}")
+    print(f"{'users':>7}{'turns':>9}{'p50 ms':>9}{'p95 ms':>9}{'other users':>13}")
+    for users in args.users:
+        turns = seed(users, args.turns, rng)
+        chats = IndexedChats(turns)
+        bot.async_chat_history_collection = chats
+        queries = [(f"user-{u}", f"what is the {rng.choice(WORDS)} for my project")
+                   for u in (rng.randrange(users) for _ in range(args.queries))]
+        r = asyncio.run(measure(bot, chats, queries, args.k))
+        print(f"{users:>7}{len(turns):>9}{r['p50']:>9.2f}{r['p95']:>9.2f}{r['foreign']:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
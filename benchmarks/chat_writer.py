@@ -0,0 +1,153 @@
+"""
+Chat-turn persistence: one insert_one per reply vs the write-behind ChatHistoryWriter.
+
+"persist" is the time /chat/ spends on the turn before it can return: a Mongo
+round trip for insert_one, a journal append + fsync for the writer. The crash
+checks abandon a writer without stopping it and replay its journal into a new
+one, once before and once after the batch reached Mongo; the last one has a
+second worker process crash and the restarted worker adopt its journal.
+
+    python -m benchmarks.chat_writer --turns 500 --concurrency 25 --mongo-latency 0.02
+"""
+import argparse
+import asyncio
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks import fakes
+
+
+def turn(i):
+    return {
+        "user_id": "bench",
+        "timestamp": datetime.utcnow(),
+        "user_query": f"question {i} about the report",
+        "response_text": f"answer {i} with some numbers from the report",
+    }
+
+
+async def persist_all(persist, turns, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    ms = []
+
+    async def one(i):
+        async with semaphore:
+            await asyncio.sleep(0)  # the rest of the request, so background flushes interleave
+            start = time.perf_counter()
+            await persist(turn(i))
+            ms.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(turns)))
+    return ms, time.perf_counter() - start
+
+
+def report(name, ms, wall):
+    print(f"{name:<14}{np.percentile(ms, 50):>10.2f}{np.percentile(ms, 95):>10.2f}"
+          f"{statistics.mean(ms):>10.2f}{len(ms) / wall:>12.0f}")
+
+
+def abandon(writer):
+    """What a crash leaves: the journal as written, and its lock released by the OS."""
+    writer._task.cancel()
+    writer._owner.close()
+
+
+async def run(args, journal_dir):
+    from chat_writer import ChatHistoryWriter
+
+    db = fakes.FakeAsyncMongoClient()["bench"]
+    writes = {"insert_one": 0}
+    direct = db["direct"]
+
+    async def insert_one(entry):
+        writes["insert_one"] += 1
+        await direct.insert_one(entry)
+
+    writer = ChatHistoryWriter(db["buffered"], os.path.join(journal_dir, "bench.journal"),
+                               max_batch=args.batch, flush_interval=args.interval)
+    await writer.start()
+
+    print(f"{'path':<14}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'turns/s':>12}")
+    report("insert_one", *await persist_all(insert_one, args.turns, args.concurrency))
+    ms, wall = await persist_all(writer.submit, args.turns, args.concurrency)
+    await writer.stop()
+    report("write-behind", ms, wall)
+
+    stats = writer.stats()
+    print(f"\nMongo writes: {writes['insert_one']} insert_one vs {stats['flushes']} insert_many")
+    print(f"flush latency: {stats['flush_ms']}")
+    print(f"stored: {await db['direct'].count_documents({})} direct, {await db['buffered'].count_documents({})} buffered")
+
+    # Crash before the flush: turns are only in the journal
+    path = os.path.join(journal_dir, "crash.journal")
+    crashed = ChatHistoryWriter(db["crash"], path, max_batch=10 ** 6, flush_interval=3600)
+    for i in range(100):
+        await crashed.submit(turn(i))
+    abandon(crashed)
+    recovered = ChatHistoryWriter(db["crash"], path)
+    await recovered.start()
+    await recovered.stop()
+    print(f"\ncrash before flush: replayed {recovered.stats()['replayed']}, "
+          f"stored {await db['crash'].count_documents({})} of 100")
+
+    # Crash after insert_many but before the journal was truncated
+    path = os.path.join(journal_dir, "late.journal")
+    crashed = ChatHistoryWriter(db["late"], path, max_batch=10 ** 6, flush_interval=3600)
+    for i in range(100):
+        await crashed.submit(turn(i))
+    abandon(crashed)
+    await db["late"].insert_many(list(crashed._buffer))
+    recovered = ChatHistoryWriter(db["late"], path)
+    await recovered.start()
+    await recovered.stop()
+    print(f"crash after insert:  replayed {recovered.stats()['replayed']}, "
+          f"stored {await db['late'].count_documents({})} of 100 (no duplicates)")
+
+    # Another worker process (its own pid, so its own journal) crashes before flushing
+    base = os.path.join(journal_dir, "workers.journal")
+    subprocess.run([sys.executable, "-m", "benchmarks.chat_writer", "--crash-worker", base], check=True)
+    survivor = ChatHistoryWriter(db["workers"], base)
+    await survivor.start()
+    await survivor.stop()
+    print(f"other worker crash:  replayed {survivor.stats()['replayed']}, "
+          f"stored {await db['workers'].count_documents({})} of 100, "
+          f"journals left {len(glob.glob(base.replace('.journal', '.*')))}")
+
+
+async def crash_worker(base):
+    from chat_writer import ChatHistoryWriter
+
+    writer = ChatHistoryWriter(fakes.FakeAsyncMongoClient()["bench"]["workers"], base, max_batch=10 ** 6, flush_interval=3600)
+    for i in range(100):
+        await writer.submit(turn(i))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--mongo-latency", type=float, default=0.02)
+    parser.add_argument("--crash-worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.crash_worker:
+        return asyncio.run(crash_worker(args.crash_worker))
+
+    fakes.install(mongo=args.mongo_latency)
+    with tempfile.TemporaryDirectory() as journal_dir:
+        asyncio.run(run(args, journal_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Size of the rag_search result with and without the context packer.
+
+The corpus has a long document (so neighbouring, overlapping chunks are retrieved
+together), a near-copy of it under another doc_id, and chat history where the
+same answer was given several times. For each query the verbatim top_k result is
+compared with the packed one: estimated tokens, and how many distinct facts
+(the numbered sentences of the document) each still contains.
+
+    python -m benchmarks.context_packing --queries 20 --budget 400
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import re
+import statistics
+import tempfile
+
+from benchmarks import fakes
+
+
+def report_text(sections):
+    return " ".join(
+        f"Fact {i}: revenue in region {i % 9} grew {i % 13} percent in quarter {i % 4} because of cloud sales."
+        for i in range(sections)
+    )
+
+
+def facts(text):
+    return len(set(re.findall(r"Fact (\d+):", text)))
+
+
+async def run(bot, queries, top_k):
+    from context_packer import approx_tokens
+
+    rows = []
+    packer = bot.context_packer
+    for i in range(queries):
+        query = f"how did revenue grow in region {i % 9}"
+        bot.context_packer = None
+        verbatim = await bot.ahybrid_search(query, top_k)
+        bot.context_packer = packer
+        packed = await bot.ahybrid_search(query, top_k)
+        rows.append({
+            "verbatim_tokens": approx_tokens(verbatim), "packed_tokens": approx_tokens(packed),
+            "verbatim_facts": facts(verbatim), "packed_facts": facts(packed),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--budget", type=int, default=400)
+    args = parser.parse_args()
+
+    fakes.install(llm=0.0, embed=0.0, mongo=0.0)
+    os.environ["VECTOR_INDEX"] = "exact"
+    os.environ["VECTOR_INDEX_PATH"] = os.path.join(tempfile.mkdtemp(), "vector_index.npz")
+    os.environ["CONTEXT_TOKEN_BUDGET"] = str(args.budget)
+    # Each query is searched with and without packing; a cached result would hide the difference
+    os.environ["RETRIEVAL_CACHE"] = "off"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from services import services
+        bot = services.bot
+        text = report_text(60)
+        bot.ingest_document(text, doc_id="report", filename="report.txt")
+        bot.ingest_document(text.replace("cloud sales", "cloud sales."), doc_id="report-copy", filename="report (1).txt")
+        for i in range(4):
+            bot.ingest_response(f"how did revenue grow in region {i}", f"Revenue in region {i} grew {i} percent.", "bench")
+            bot.ingest_response(f"How did revenue grow in region {i}?", f"Revenue in region {i} grew {i} percent.", "bench")
+        rows = asyncio.run(run(bot, args.queries, args.top_k))
+
+    print(f"top_k={args.top_k}, budget={args.budget} tokens, medians over {len(rows)} queries")
+    print(f"{'':<10}{'tokens':>8}{'facts':>8}{'facts/100 tokens':>18}")
+    for mode in ("verbatim", "packed"):
+        tokens = statistics.median(row[f"{mode}_tokens"] for row in rows)
+        found = statistics.median(row[f"{mode}_facts"] for row in rows)
+        print(f"{mode:<10}{tokens:>8.0f}{found:>8.0f}{100 * found / tokens:>18.1f}")
+    print(f"packer stats: {bot.context_packer.stats.snapshot()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Per-user conversation threads: retrieval calls and prompt size over a long session.
+
+One user alternates new questions with follow-ups ("and ...", "tell me more").
+"stateless" gives every turn a fresh user_id, which is how /chat/ behaved
+without a checkpointer; "unbounded" keeps the whole thread in the prompt;
+"budget" trims it to HISTORY_TOKEN_BUDGET. Prompt tokens are per turn, summed over
+its model calls (a retrieval turn makes two).
+
+    python -m benchmarks.conversation_memory --turns 100 --budget 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import statistics
+import time
+
+from benchmarks import fakes
+
+
+REPORT = " ".join(
+    f"Section {i}: revenue grew by {i} percent in region {i % 7} while costs in unit {i % 5} stayed flat."
+    for i in range(200)
+)
+
+
+def message(turn):
+    if turn % 2:
+        return "tell me more" if turn % 4 == 1 else "and what about the costs"
+    return f"what does the report say about region {turn % 7} in section {turn}"
+
+
+async def session(app, turns, user_id):
+    import httpx
+    import Agent
+    from services import services
+
+    searches = 0
+    search = services.bot.ahybrid_search
+
+    async def counted(query, top_k=3):
+        nonlocal searches
+        searches += 1
+        return await search(query, top_k)
+
+    services.bot.ahybrid_search = counted
+    follow_up_ms, tokens = [], []
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for turn in range(turns):
+                start = time.perf_counter()
+                r = await client.post("/chat/", json={"message": message(turn), "user_id": user_id(turn)})
+                r.raise_for_status()
+                if turn % 2:
+                    follow_up_ms.append((time.perf_counter() - start) * 1000)
+                tokens.append(Agent.prompt_stats.snapshot()["turn"]["last_tokens"])
+    finally:
+        services.bot.ahybrid_search = search
+    return searches, follow_up_ms, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    fakes.install(llm=args.llm_latency, token=0.0)
+
+    # Every turn must reach the graph
+    os.environ["RESPONSE_CACHE"] = "off"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        import Agent
+        from services import services
+        logging.getLogger("app").setLevel(logging.WARNING)
+        services.bot.ingest_document(REPORT, filename="report.txt")
+
+        results = {}
+        for name, budget, user_id in (
+            ("stateless", args.budget, lambda turn: f"stateless-{turn}"),
+            ("unbounded", 10 ** 9, lambda turn: "unbounded"),
+            ("budget", args.budget, lambda turn: "budget"),
+        ):
+            Agent.history_token_budget = budget
+            results[name] = asyncio.run(session(api.app, args.turns, user_id))
+        thread = services.graph.get_state(Agent.thread_config("budget")).values["messages"]
+
+    print(f"turns={args.turns} (half follow-ups), HISTORY_TOKEN_BUDGET={args.budget}")
+    print(f"{'mode':<11}{'rag calls':>10}{'follow-up p50 ms':>18}{'prompt tok p50':>16}{'prompt tok last':>17}{'max':>8}")
+    for name, (searches, follow_up_ms, tokens) in results.items():
+        print(f"{name:<11}{searches:>10}{statistics.median(follow_up_ms):>18.1f}"
+              f"{statistics.median(tokens):>16.0f}{tokens[-1]:>17}{max(tokens):>8}")
+    print(f"messages kept in the budgeted thread after {args.turns} turns: {len(thread)}")
+
+
+if __name__ == "__main__":
+    main()
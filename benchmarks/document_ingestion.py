@@ -0,0 +1,177 @@
+"""
+Peak memory of document ingestion: whole-file vs streaming, on synthetic PDFs and text files.
+
+"whole" is the upload path before streaming: the upload read into one bytes
+object, every PDF page's text joined into one string, split in one go, and
+`aingest_document` planning every chunk before embedding. "streaming" is the
+job worker's path now: the spooled file read a page (or a 64 KiB block of
+text) at a time, split as it is read, and fed to `aingest_chunks`, which stops
+reading while `EMBED_CONCURRENCY` batches are in flight. Extraction runs in a
+thread here (EXTRACT_WORKERS=0), so its memory is measured in this process.
+
+Every measurement runs in its own process and reports how far the peak RSS
+rose above the RSS after setup:
+  parse+split  turning the file into chunks
+  ingest       parsing, embedding and writing; the chunk and embedding cache
+               collections are sinks, as a remote Mongo keeps nothing in this
+               process (mongomock would), and KEYWORD_INDEX is off for the same reason
+
+    python -m benchmarks.document_ingestion --pages 100,1000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from bson import ObjectId
+
+from benchmarks import fakes
+
+
+def write_pdf(path, pages, lines=40):
+    """A minimal text-only PDF, written one page at a time."""
+    offsets = {}
+    with open(path, "wb") as f:
+        def obj(number, body):
+            offsets[number] = f.tell()
+            f.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for i in range(pages):
+            obj(4 + 2 * i, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                           f"/Contents {5 + 2 * i} 0 R >>".encode())
+            text = " ".join(f"({sentence(i, line)}) Tj T*" for line in range(lines))
+            stream = f"BT /F1 10 Tf 12 TL 40 750 Td {text} ET".encode()
+            obj(5 + 2 * i, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+        xref = f.tell()
+        f.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+        for number in sorted(offsets):
+            f.write(f"{offsets[number]:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def write_text(path, pages, lines=40):
+    with open(path, "w") as f:
+        for i in range(pages):
+            f.write(" ".join(sentence(i, line) for line in range(lines)) + "\n\n")
+
+
+def sentence(page, line):
+    return f"Page {page} line {line}: revenue in region {line % 7} grew {page % 13} percent, costs in unit {line % 5} stayed flat."
+
+
+def whole_chunks(filename, path):
+    """The old upload path: read the upload, join every page's text, split it all at once."""
+    from PyPDF2 import PdfReader
+    from llm import Gemini
+
+    with open(path, "rb") as f:
+        contents = f.read()
+    if filename.endswith(".pdf"):
+        text = "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(contents)).pages)
+    else:
+        text = contents.decode("utf-8", errors="ignore")
+    return text, Gemini._split(text)
+
+
+class Sink:
+    """Async collection that acknowledges writes and keeps nothing."""
+
+    def find(self, *args, **kwargs):
+        return fakes.FakeAsyncCursor([])
+
+    async def bulk_write(self, requests, **kwargs):
+        result = fakes.BulkWriteResult()
+        result.upserted_ids = {i: ObjectId() for i, op in enumerate(requests) if type(op).__name__ == "UpdateOne"}
+        return result
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def child(filename, path, mode, stage):
+    fakes.install(embed=0.0, mongo=0.0)
+    os.environ["KEYWORD_INDEX"] = "off"
+    os.environ["EMBEDDING_CACHE_SIZE"] = "64"
+    with contextlib.redirect_stdout(io.StringIO()):
+        from document_parser import iter_chunks, iter_sections
+        from extraction import ExtractionPool
+        from services import services
+        bot = services.bot
+        bot.async_doc_collection = Sink()
+        bot.embedding_model.async_collection = Sink()
+        # Warm up what the first call would otherwise import or build
+        whole_chunks("warm.txt", __file__)
+        asyncio.run(bot.aingest_document("warm up", doc_id="warm", filename="warm.txt"))
+
+    async def ingest():
+        if mode == "whole":
+            text, _ = await asyncio.to_thread(whole_chunks, filename, path)
+            return await bot.aingest_document(text, doc_id=filename, filename=filename)
+        return await bot.aingest_chunks(ExtractionPool(workers=0).chunks(filename, path), doc_id=filename, filename=filename)
+
+    baseline = rss()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage == "split":
+            chunks = len(whole_chunks(filename, path)[1]) if mode == "whole" else sum(1 for _ in iter_chunks(iter_sections(filename, path)))
+        else:
+            chunks = asyncio.run(ingest())["chunks"]
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"chunks": chunks, "peak": max(peak - baseline, 0), "seconds": elapsed}))
+
+
+def measure(filename, path, mode, stage):
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.document_ingestion", "--child", filename, path, mode, stage],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def mib(n):
+    return f"{n / 2 ** 20:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", default="100,1000", help="comma-separated page counts")
+    parser.add_argument("--formats", default="pdf,txt")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child)
+
+    workdir = tempfile.mkdtemp()
+    print(f"{'file':<16}{'MiB':>6}{'mode':>11}{'chunks':>8}{'parse+split peak':>18}{'ingest peak':>13}{'ingest s':>10}")
+    for fmt, pages in itertools.product(args.formats.split(","), [int(p) for p in args.pages.split(",")]):
+        filename = f"report-{pages}.{fmt}"
+        path = os.path.join(workdir, filename)
+        (write_pdf if fmt == "pdf" else write_text)(path, pages)
+        for mode in ("whole", "streaming"):
+            split = measure(filename, path, mode, "split")
+            ingest = measure(filename, path, mode, "ingest")
+            print(f"{filename:<16}{mib(os.path.getsize(path)):>6}{mode:>11}{split['chunks']:>8}"
+                  f"{mib(split['peak']):>14} MiB{mib(ingest['peak']):>9} MiB{ingest['seconds']:>10.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
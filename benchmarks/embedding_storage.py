@@ -0,0 +1,87 @@
+"""
+Embedding storage formats: bytes per chunk, bytes per retrieval hit, migration, int8 recall.
+
+Chunks get 768-dimensional vectors from the fake embeddings. Reported:
+  storage    BSON size of a chunk document with its embedding as array / float32 / int8
+  transfer   BSON size of top_k search hits, whole documents vs the projected fields
+  migration  migrate_embeddings from arrays to float32 on the fake Mongo, and a round-trip check
+  recall     recall@k of exact search over int8-quantized vectors against float32
+
+    python -m benchmarks.embedding_storage --chunks 5000
+"""
+import argparse
+
+import bson
+import numpy as np
+
+from benchmarks import fakes
+
+
+def chunk_text(i):
+    return (f"Chunk {i}: revenue in region {i % 50} grew {i % 13} percent while costs in unit {i % 7} "
+            f"stayed flat, headcount moved by {i % 11} and the outlook for segment {i % 17} improved.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    fakes.install(mongo=0.0)
+    from llm import Gemini
+    from migrate_embeddings import migrate
+    from vector_codec import FORMATS, decode_vector, encode_vector
+    from vector_index import ExactIndex
+
+    embeddings = fakes.FakeEmbeddings(dim=args.dim)
+    texts = [chunk_text(i) for i in range(args.chunks)]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    # Dense noise on top of the bag-of-words vectors, so quantization has real values to round
+    vectors += np.random.default_rng(0).normal(0, 0.02, vectors.shape).astype(np.float32)
+
+    def document(i, fmt):
+        return {"_id": bson.ObjectId(), "doc_id": "report", "chunk_hash": "0" * 64, "chunk": texts[i],
+                "embedding": encode_vector(vectors[i], fmt), "metadata": {"chunk_index": i, "filename": "report.txt"}}
+
+    print(f"{args.chunks} chunks, {args.dim} dimensions")
+    print("\nstorage (bytes per chunk document)")
+    sizes = {fmt: np.mean([len(bson.encode(document(i, fmt))) for i in range(min(args.chunks, 500))]) for fmt in FORMATS}
+    for fmt in FORMATS:
+        print(f"  {fmt:<8}{sizes[fmt]:>10.0f}  ({sizes[fmt] / sizes['array']:.0%} of array)")
+
+    print(f"\ntransfer (bytes for {args.top_k} search hits)")
+    projection = Gemini.CHUNK_FIELDS
+    for fmt in FORMATS:
+        hits = [document(i, fmt) for i in range(args.top_k)]
+        whole = sum(len(bson.encode(hit)) for hit in hits)
+        projected = sum(len(bson.encode({"_id": hit["_id"], "chunk": hit["chunk"], "doc_id": hit["doc_id"],
+                                         "metadata": {"chunk_index": hit["metadata"]["chunk_index"]}})) for hit in hits)
+        print(f"  {fmt:<8}whole {whole:>8}   projected {projected:>6}  {sorted(projection)}")
+
+    collection = fakes.FakeMongoClient()["RAG-cluster"]["document_chunks"]
+    collection.insert_many([document(i, "array") for i in range(args.chunks)])
+    summary = migrate(collection, "float32")
+    again = migrate(collection, "float32")
+    stored = np.vstack([decode_vector(doc["embedding"]) for doc in collection.find({}, {"embedding": 1}).sort("metadata.chunk_index")])
+    print(f"\nmigration to float32: {summary}")
+    print(f"  second run converted {again['converted']}; max abs difference after round trip {np.abs(stored - vectors).max():.2e}")
+
+    exact = ExactIndex()
+    exact.add(list(range(args.chunks)), vectors)
+    quantized = ExactIndex()
+    quantized.add(list(range(args.chunks)), [decode_vector(encode_vector(v, "int8")) for v in vectors])
+    rng = np.random.default_rng(1)
+    recalls = []
+    for q in rng.choice(args.chunks, size=args.queries, replace=False):
+        query = embeddings.embed_query(f"how did revenue grow in region {q % 50} and segment {q % 17}")
+        truth = {doc_id for doc_id, _ in exact.search(query, args.top_k)}
+        found = {doc_id for doc_id, _ in quantized.search(query, args.top_k)}
+        recalls.append(len(truth & found) / len(truth))
+    print(f"\nint8 recall@{args.top_k} vs float32: mean {np.mean(recalls):.3f}, min {np.min(recalls):.3f} over {args.queries} queries")
+
+
+if __name__ == "__main__":
+    main()
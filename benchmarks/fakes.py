@@ -0,0 +1,404 @@
+"""
+Deterministic local stand-ins for Gemini, the Gemini embeddings, Tavily and MongoDB.
+
+Call install() BEFORE importing llm / Agent / api so the real modules pick the
+fakes up instead of talking to the network. Every fake sleeps for a configurable
+latency so benchmarks see realistic blocking (sync) and awaiting (async) behaviour.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from uuid import uuid4
+
+import mongomock
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel
+
+
+@dataclass
+class Latencies:
+    llm: float = 0.05
+    token: float = 0.005
+    embed: float = 0.02
+    mongo: float = 0.005
+    tavily: float = 0.1
+
+
+latencies = Latencies()
+
+
+class RateLimitError(Exception):
+    """What the fakes raise over quota, shaped like google.api_core's ResourceExhausted."""
+
+    code = 429
+
+
+class Quota:
+    """
+    Requests per second shared by the fake chat model and embeddings, like a
+    Gemini API key's quota: a call beyond `rps` in the last second raises
+    RateLimitError. 0 means unlimited.
+    """
+
+    def __init__(self, rps=0):
+        self.rps = rps
+        self.accepted = 0
+        self.rejected = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def charge(self):
+        if not self.rps:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rps:
+                self.rejected += 1
+                raise RateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            self._recent.append(now)
+            self.accepted += 1
+
+
+quota = Quota()
+
+
+def _tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+# User turns starting like this are answered from the conversation when it has an earlier answer
+FOLLOW_UPS = ("and ", "what about", "tell me more", "why")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Asks for rag_search on a user turn, answers from the tool output afterwards.
+    Follow-up questions are answered from the previous answer, and questions whose
+    prompt already carries retrieved documents from those, without a tool call.
+    """
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages):
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            return AIMessage(content="Based on what I found: " + " ".join(last.content.split()[:20]))
+        answers = [m for m in messages[:-1] if isinstance(m, AIMessage) and m.content]
+        if answers and last.content.lower().startswith(FOLLOW_UPS):
+            return AIMessage(content="As I said: " + " ".join(answers[-1].content.split()[:20]))
+        system = messages[0].content if isinstance(messages[0], SystemMessage) else ""
+        if "=== RELEVANT DOCUMENTS ===" in system:
+            found = system.split("=== RELEVANT DOCUMENTS ===", 1)[1]
+            return AIMessage(content="Based on what I found: " + " ".join(found.split()[:20]))
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": "rag_search", "args": {"query": last.content}, "id": str(uuid4())}],
+        )
+
+    def _generation_time(self, message):
+        """`latencies.llm` is the time to first token, `latencies.token` the gap between tokens."""
+        tokens = len(re.findall(r"\S+\s*", message.content))
+        return latencies.llm + latencies.token * max(tokens - 1, 0)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        quota.charge()
+        message = self._respond(messages)
+        time.sleep(self._generation_time(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        quota.charge()
+        message = self._respond(messages)
+        await asyncio.sleep(self._generation_time(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, messages):
+        message = self._respond(messages)
+        if message.tool_calls:
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ])
+            return
+        for token in re.findall(r"\S+\s*", message.content):
+            yield AIMessageChunk(content=token)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        quota.charge()
+        time.sleep(latencies.llm)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                time.sleep(latencies.token)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        quota.charge()
+        await asyncio.sleep(latencies.llm)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                await asyncio.sleep(latencies.token)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: similar texts get similar (unit-length) vectors."""
+
+    def __init__(self, model="models/fake-embedding", dim=256, **kwargs):
+        self.model = model
+        self.dim = dim
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = [0.0] * self.dim
+        for token in _tokens(text):
+            digest = hashlib.md5(token.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts, **kwargs):
+        quota.charge()
+        self.calls += 1
+        time.sleep(latencies.embed)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts, **kwargs):
+        quota.charge()
+        self.calls += 1
+        await asyncio.sleep(latencies.embed)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeTavilyInput(BaseModel):
+    query: str
+
+
+class FakeTavilySearch(BaseTool):
+    name: str = "tavily_search"
+    description: str = "A search engine optimized for comprehensive, accurate, and trusted results."
+    args_schema: type[BaseModel] = FakeTavilyInput
+    max_results: int = 5
+    calls: int = 0
+
+    def __init__(self, api_key=None, client=None, **kwargs):
+        super().__init__(**kwargs)
+
+    def _result(self, query):
+        self.calls += 1
+        return {
+            "query": query,
+            "results": [
+                {"title": f"Result {i} for {query}", "url": f"https://example.com/{i}", "content": f"About {query}."}
+                for i in range(self.max_results)
+            ],
+        }
+
+    def _run(self, query: str) -> dict:
+        time.sleep(latencies.tavily)
+        return self._result(query)
+
+    async def _arun(self, query: str) -> dict:
+        await asyncio.sleep(latencies.tavily)
+        return self._result(query)
+
+
+# === MongoDB ===
+# A single mongomock server backs both the sync and the async client, so writes from
+# one path are visible to the other, just like a real deployment.
+
+_server = mongomock.MongoClient()
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+        self.upserted_ids = {}
+
+
+def bulk_write(collection, requests, ordered=True, **kwargs):
+    """mongomock's bulk_write chokes on pymongo 4.13 operations, so apply them one by one."""
+    result = BulkWriteResult()
+    for i, op in enumerate(requests):
+        name = type(op).__name__
+        if name == "InsertOne":
+            collection.insert_one(op._doc)
+            result.inserted_count += 1
+        elif name in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+            method = {"UpdateOne": collection.update_one, "UpdateMany": collection.update_many,
+                      "ReplaceOne": collection.replace_one}[name]
+            r = method(op._filter, op._doc, upsert=op._upsert)
+            result.matched_count += r.matched_count
+            result.modified_count += r.modified_count
+            if r.upserted_id is not None:
+                result.upserted_count += 1
+                result.upserted_ids[i] = r.upserted_id
+        elif name in ("DeleteOne", "DeleteMany"):
+            method = collection.delete_one if name == "DeleteOne" else collection.delete_many
+            result.deleted_count += method(op._filter).deleted_count
+        else:
+            raise NotImplementedError(name)
+    return result
+
+
+class SlowCollection:
+    """Sync collection proxy that blocks for `latencies.mongo` on every call."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def bulk_write(self, requests, **kwargs):
+        time.sleep(latencies.mongo)
+        return bulk_write(self._collection, requests, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(latencies.mongo)
+            return attr(*args, **kwargs)
+        return call
+
+
+class FakeAsyncCursor:
+    def __init__(self, results):
+        self._results = results
+
+    def limit(self, n):
+        if n:
+            self._results = self._results.limit(n) if hasattr(self._results, "limit") else self._results[:n]
+        return self
+
+    def sort(self, *args, **kwargs):
+        self._results = self._results.sort(*args, **kwargs)
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(latencies.mongo)
+        results = list(self._results)
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list():
+            yield doc
+
+
+class FakeAsyncCollection:
+    """Async collection proxy mirroring pymongo's AsyncCollection call shapes."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return FakeAsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def bulk_write(self, requests, **kwargs):
+        await asyncio.sleep(latencies.mongo)
+        return bulk_write(self._collection, requests, **kwargs)
+
+    async def aggregate(self, pipeline, *args, **kwargs):
+        await asyncio.sleep(latencies.mongo)
+        return FakeAsyncCursor(list(self._collection.aggregate(pipeline, *args, **kwargs)))
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(latencies.mongo)
+            return attr(*args, **kwargs)
+        return call
+
+
+class _FakeDatabase:
+    def __init__(self, name, wrapper):
+        self._db = _server[name]
+        self._wrapper = wrapper
+
+    def __getitem__(self, name):
+        return self._wrapper(self._db[name])
+
+    __getattr__ = __getitem__
+
+
+class FakeMongoClient:
+    def __init__(self, *args, **kwargs):
+        self.admin = _server.admin
+
+    def __getitem__(self, name):
+        return _FakeDatabase(name, SlowCollection)
+
+
+class FakeAsyncMongoClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name):
+        return _FakeDatabase(name, FakeAsyncCollection)
+
+
+def reset_mongo():
+    for name in _server.list_database_names():
+        _server.drop_database(name)
+
+
+def install(llm=None, embed=None, mongo=None, tavily=None, token=None, rps=None):
+    """Patch the third-party entry points used by llm.py and Agent.py; `rps` sets the shared Gemini quota."""
+    if rps is not None:
+        quota.rps = rps
+    for field, value in (("llm", llm), ("embed", embed), ("mongo", mongo), ("tavily", tavily), ("token", token)):
+        if value is not None:
+            setattr(latencies, field, value)
+
+    os.environ.setdefault("GOOGLE_API_KEY", "fake")
+    os.environ.setdefault("TAVILY_API_KEY", "fake")
+    # Keep the chat write-behind journal out of the working tree
+    os.environ.setdefault("CHAT_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "chat_history.journal"))
+
+    import langchain_google_genai
+    import langchain_tavily
+    import pymongo
+
+    langchain_google_genai.ChatGoogleGenerativeAI = lambda *args, **kwargs: FakeChatModel()
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = FakeEmbeddings
+    langchain_tavily.TavilySearch = FakeTavilySearch
+    pymongo.MongoClient = FakeMongoClient
+    pymongo.AsyncMongoClient = FakeAsyncMongoClient
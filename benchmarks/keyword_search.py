@@ -0,0 +1,90 @@
+"""
+BM25Index vs the old regex fallback on a synthetic chunk corpus.
+
+The regex side reproduces `find({"chunk": {"$regex": query, "$options": "i"}}).limit(k)`
+as a compiled, case-insensitive scan over every chunk in Python, which is a lower
+bound for the same collection scan on the Mongo server.
+
+Two query sets are drawn from random source chunks: "phrase" queries are three
+consecutive words (the best case for a regex), "keywords" queries are three words
+from the chunk in arbitrary order (what users actually type). "found" is how often
+the source chunk comes back in the top k.
+
+    python -m benchmarks.keyword_search --chunks 100000
+"""
+import argparse
+import re
+import statistics
+import time
+
+import numpy as np
+
+from keyword_index import BM25Index
+
+
+def corpus(n, vocabulary, words_per_chunk, seed):
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    # Zipf-like term frequencies, like natural text
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+    ids = rng.choice(vocabulary, size=(n, words_per_chunk), p=weights)
+    return [" ".join(words[i] for i in row) for row in ids]
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--words", type=int, default=80)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    chunks = corpus(args.chunks, args.vocabulary, args.words, seed=0)
+    rng = np.random.default_rng(1)
+    sources = rng.integers(0, len(chunks), size=args.queries)
+    query_sets = {"phrase": [], "keywords": []}
+    for source in sources:
+        words = chunks[source].split()
+        start = rng.integers(0, len(words) - 3)
+        query_sets["phrase"].append(" ".join(words[start:start + 3]))
+        query_sets["keywords"].append(" ".join(rng.choice(words, size=3, replace=False)))
+
+    start = time.perf_counter()
+    index = BM25Index()
+    index.add_many(enumerate(chunks))
+    print(f"BM25 build: {time.perf_counter() - start:.1f}s for {len(index)} chunks, {len(index._postings)} terms")
+
+    def regex_search(query):
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+        hits = []
+        for i, chunk in enumerate(chunks):
+            if pattern.search(chunk):
+                hits.append(i)
+                if len(hits) == args.k:
+                    break
+        return hits
+
+    def bm25_search(query):
+        return [int(key) for key, _ in index.search(query, args.k)]
+
+    print(f"\n{'queries':<10}{'engine':<8}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'found':>8}")
+    for set_name, queries in query_sets.items():
+        for name, search in (("regex", regex_search), ("bm25", bm25_search)):
+            ms, found = [], 0
+            for query, source in zip(queries, sources):
+                t = time.perf_counter()
+                hits = search(query)
+                ms.append((time.perf_counter() - t) * 1000)
+                found += source in hits
+            print(f"{set_name:<10}{name:<8}{percentile(ms, 50):>10.2f}{percentile(ms, 95):>10.2f}"
+                  f"{statistics.mean(ms):>10.2f}{found / len(queries):>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Load test: concurrent /chat/ and /upload/ traffic against the real app.
+
+Chat requests and document uploads run at the same time through `api.app`
+(lifespan included) on the local fakes, with the injected latencies below.
+Per-stage samples are collected as the app reports them:
+
+  chat                  /chat/ request, client side
+  retrieval.<stage>     hybrid_search stages (embed, text, vector, chat, total)
+  chat_writer.flush     write-behind insert_many of chat turns
+  upload.accept         POST /upload/, client side
+  upload.ingest         aingest_chunks for one file
+  upload.job            queued -> completed, as reported by GET /upload/{job_id}
+
+and reported as count / mean / p50 / p95 / p99 / max, plus throughput. `--output`
+writes them as JSON; `--baseline` compares against an earlier file and exits 1
+when a stage's p50 or p95, or a throughput figure, is worse by more than
+`--tolerance` (and by at least `--min-delta-ms` for latencies; p95 only for
+stages with `--min-count` samples, since a p95 over a handful is noise), so CI
+can run:
+
+    python -m benchmarks.load --output load.json
+    python -m benchmarks.load --baseline load.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks import fakes
+
+
+QUANTILES = (50, 95, 99)
+
+
+def document(doc, sections):
+    return "\n\n".join(
+        f"Document {doc} section {i}: revenue in region {i % 7} grew {(doc + i) % 13} percent "
+        f"while costs in unit {i % 5} stayed flat and headcount moved by {(doc * i) % 11}."
+        for i in range(sections)
+    ).encode()
+
+
+def summarize(samples):
+    values = np.asarray(samples, dtype=float)
+    summary = {"count": len(values), "mean": round(float(values.mean()), 2)}
+    summary.update({f"p{q}": round(float(np.percentile(values, q)), 2) for q in QUANTILES})
+    summary["max"] = round(float(values.max()), 2)
+    return summary
+
+
+def record(stats, prefix, samples):
+    """Copy every value a LatencyStats observes into `samples[prefix + name]`."""
+    observe = stats.observe
+
+    def recorded(name, value):
+        samples[prefix + name].append(value)
+        observe(name, value)
+
+    stats.observe = recorded
+
+
+async def run(app, args, samples):
+    import httpx
+    from services import services
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await client.get("/ready")
+            await services.wait_ready()
+            bot = services.bot
+            record(bot.retrieval_stats, "retrieval.", samples)
+            record(bot.chat_writer.flush_stats, "chat_writer.", samples)
+
+            aingest = bot.aingest_chunks
+
+            async def timed_ingest(*a, **kw):
+                start = time.perf_counter()
+                try:
+                    return await aingest(*a, **kw)
+                finally:
+                    samples["upload.ingest"].append((time.perf_counter() - start) * 1000)
+
+            bot.aingest_chunks = timed_ingest
+            errors = defaultdict(int)
+            chunks = 0
+
+            chat_slots = asyncio.Semaphore(args.concurrency)
+
+            async def chat(i):
+                async with chat_slots:
+                    start = time.perf_counter()
+                    r = await client.post("/chat/", json={
+                        "message": f"what does document {i % max(args.uploads, 1)} say about region {i % 7} in section {i}",
+                        "user_id": f"load-{i}",
+                    })
+                    if r.status_code != 200:
+                        errors["chat"] += 1
+                        return
+                    samples["chat"].append((time.perf_counter() - start) * 1000)
+
+            upload_slots = asyncio.Semaphore(args.upload_concurrency)
+
+            async def upload(i):
+                nonlocal chunks
+                async with upload_slots:
+                    start = time.perf_counter()
+                    r = await client.post("/upload/", files={"file": (f"doc-{i}.txt", document(i, args.sections))})
+                    if r.status_code != 200 or r.json().get("status") != "accepted":
+                        errors["upload"] += 1
+                        return
+                    samples["upload.accept"].append((time.perf_counter() - start) * 1000)
+                    job_id = r.json()["job_id"]
+                    while True:
+                        job = (await client.get(f"/upload/{job_id}")).json()
+                        if job["status"] in ("completed", "failed"):
+                            break
+                        await asyncio.sleep(0.01)
+                    if job["status"] == "failed":
+                        errors["upload"] += 1
+                        return
+                    samples["upload.job"].append((job["finished_at"] - job["created_at"]) * 1000)
+                    chunks += job["chunks_total"] or 0
+
+            async def timed(coros):
+                start = time.perf_counter()
+                await asyncio.gather(*coros)
+                return time.perf_counter() - start
+
+            chat_wall, upload_wall = await asyncio.gather(
+                timed(chat(i) for i in range(args.requests)),
+                timed(upload(i) for i in range(args.uploads)),
+            )
+            # Let the writer drain so its flushes are part of the run
+            await bot.chat_writer.flush()
+
+    return {
+        "chat_rps": round(len(samples["chat"]) / chat_wall, 2) if args.requests else None,
+        "upload_docs_per_s": round(len(samples["upload.job"]) / upload_wall, 2) if args.uploads else None,
+        "upload_chunks_per_s": round(chunks / upload_wall, 2) if args.uploads else None,
+    }, dict(errors)
+
+
+def compare(result, baseline, tolerance, min_delta_ms, min_count):
+    """Return (lines, regressions) comparing `result` against `baseline`."""
+    lines, regressions = [], []
+    for name, stage in result["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None:
+            continue
+        for q in ("p50", "p95") if stage["count"] >= min_count else ("p50",):
+            old, new = before[q], stage[q]
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            if change > tolerance and new - old >= min_delta_ms:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {q}")
+            lines.append(f"{name + ' ' + q:<28}{old:>10.1f}{new:>10.1f}{change:>+9.0%}{flag}")
+    for name, new in result["throughput"].items():
+        old = baseline.get("throughput", {}).get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        lines.append(f"{name:<28}{old:>10.1f}{new:>10.1f}{change:>+9.0%}{flag}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200, help="/chat/ requests")
+    parser.add_argument("--concurrency", type=int, default=25, help="concurrent /chat/ requests")
+    parser.add_argument("--uploads", type=int, default=10, help="documents uploaded during the chat traffic")
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--sections", type=int, default=200, help="sections per uploaded document")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--mongo-latency", type=float, default=0.005)
+    parser.add_argument("--tavily-latency", type=float, default=0.1)
+    parser.add_argument("--response-cache", choices=("on", "off"), default="off")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore latency changes smaller than this")
+    parser.add_argument("--min-count", type=int, default=20, help="samples a stage needs before its p95 is compared")
+    args = parser.parse_args()
+
+    fakes.install(llm=args.llm_latency, token=args.token_latency, embed=args.embed_latency,
+                  mongo=args.mongo_latency, tavily=args.tavily_latency)
+    os.environ["RESPONSE_CACHE"] = args.response_cache
+
+    samples = defaultdict(list)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        logging.getLogger("app").setLevel(logging.WARNING)
+        started = time.perf_counter()
+        throughput, errors = asyncio.run(run(api.app, args, samples))
+        wall = time.perf_counter() - started
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("output", "baseline", "tolerance", "min_delta_ms", "min_count")}
+    result = {
+        "benchmark": "load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": config,
+        "wall_s": round(wall, 2),
+        "throughput": throughput,
+        "errors": errors,
+        "stages": {name: summarize(values) for name, values in sorted(samples.items()) if values},
+    }
+
+    print(f"chat requests={args.requests} (concurrency {args.concurrency}), uploads={args.uploads} "
+          f"x {args.sections} sections (concurrency {args.upload_concurrency}), wall {result['wall_s']}s")
+    print(f"{'stage':<22}{'count':>7}{'mean':>10}" + "".join(f"{'p' + str(q):>10}" for q in QUANTILES) + f"{'max':>10}")
+    for name, stage in result["stages"].items():
+        print(f"{name:<22}{stage['count']:>7}{stage['mean']:>10.1f}"
+              + "".join(f"{stage['p' + str(q)]:>10.1f}" for q in QUANTILES) + f"{stage['max']:>10.1f}")
+    print("throughput: " + ", ".join(f"{name}={value}" for name, value in throughput.items() if value is not None))
+    if errors:
+        print(f"errors: {errors}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(result, baseline, args.tolerance, args.min_delta_ms, args.min_count)
+        print(f"\n{'vs ' + args.baseline:<28}{'before':>10}{'after':>10}{'change':>9}")
+        print("\n".join(lines))
+        if regressions or errors:
+            print(f"\nFAILED: {', '.join(regressions) or 'requests failed'}")
+            sys.exit(1)
+        print(f"\nOK: no stage slower than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+The graph's tools node on a model turn that calls rag_search and tavily_search together.
+
+"serial" is the sum of the two tool latencies, i.e. what running them one after
+another paid. The second scenario makes Tavily hang and shows the turn finishing
+at the Tavily deadline with a timeout error in its place.
+
+    python -m benchmarks.parallel_tools --turns 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+from uuid import uuid4
+
+from langchain_core.messages import AIMessage
+
+from benchmarks import fakes
+
+
+def turn(query):
+    return {"messages": [AIMessage(content="", tool_calls=[
+        {"name": "rag_search", "args": {"query": query}, "id": str(uuid4())},
+        {"name": "tavily_search", "args": {"query": query}, "id": str(uuid4())},
+    ])]}
+
+
+async def run(node, turns):
+    rows = []
+    for i in range(turns):
+        inputs = turn(f"revenue question {i}")
+        start = time.perf_counter()
+        messages = (await node.acall(inputs))["messages"]
+        rows.append({"wall": (time.perf_counter() - start) * 1000, "messages": messages})
+        assert [m.tool_call_id for m in messages] == [call["id"] for call in inputs["messages"][-1].tool_calls]
+    return rows
+
+
+async def tool_latency(tool, turns):
+    samples = []
+    for i in range(turns):
+        start = time.perf_counter()
+        await tool.ainvoke({"query": f"revenue question {i}"})
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def report(title, rows):
+    print(f"\n{title}")
+    print(f"  turn      {statistics.median(row['wall'] for row in rows):8.1f} ms  (concurrent, median)")
+    for message in rows[-1]["messages"]:
+        detail = json.loads(message.content)["error"] if message.status == "error" else "ok"
+        print(f"  {message.name:<14}{detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--tavily-latency", type=float, default=0.3)
+    parser.add_argument("--tavily-timeout", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fakes.install(tavily=args.tavily_latency)
+    os.environ.setdefault("VECTOR_INDEX", "exact")
+    os.environ.setdefault("VECTOR_INDEX_PATH", os.path.join(tempfile.mkdtemp(), "vector_index.npz"))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from services import services
+        from Tools.BasicToolNode import BasicToolNode
+        services.bot.ingest_document("Quarterly revenue grew twelve percent on cloud sales.\n\n" * 20, doc_id="report")
+        tavily, rag = services.tools
+        node = BasicToolNode(services.tools, timeouts={"tavily_search": args.tavily_timeout})
+        rag_ms = asyncio.run(tool_latency(rag, args.turns))
+        tavily_ms = asyncio.run(tool_latency(tavily, args.turns))
+        healthy = asyncio.run(run(node, args.turns))
+        fakes.latencies.tavily = 30.0
+        hanging = asyncio.run(run(node, args.turns))
+
+    print(f"rag_search {rag_ms:.1f} ms, tavily_search {tavily_ms:.1f} ms, serial {rag_ms + tavily_ms:.1f} ms")
+    report("both tools healthy", healthy)
+    report(f"tavily hanging, {args.tavily_timeout}s deadline", hanging)
+
+
+if __name__ == "__main__":
+    main()
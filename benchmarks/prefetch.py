@@ -0,0 +1,91 @@
+"""
+Speculative retrieval on /chat/: latency with hybrid_search overlapping the first model call.
+
+Each mode runs in a fresh interpreter, since the prefetcher is built once per process:
+  off          model call, then rag_search, then the answering model call
+  speculative  SPECULATIVE_RETRIEVAL=on: hybrid_search starts with the first model call
+  routed       RETRIEVAL_ROUTER=on as well: document questions get the context in the
+               first prompt and skip the rag_search round trip
+
+Half the questions mention "the report" (routable), half do not.
+
+    python -m benchmarks.prefetch --questions 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+from benchmarks import fakes
+
+
+MODES = {
+    "off": {},
+    "speculative": {"SPECULATIVE_RETRIEVAL": "on"},
+    "routed": {"SPECULATIVE_RETRIEVAL": "on", "RETRIEVAL_ROUTER": "on"},
+}
+
+
+async def run(app, questions):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            latencies = []
+            for i in range(questions):
+                message = f"what does the report say about revenue in region {i}" if i % 2 else f"how did revenue grow in region {i}"
+                start = time.perf_counter()
+                r = await client.post("/chat/", json={"message": message, "user_id": str(uuid4())})
+                r.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+            stats = (await client.get("/stats/")).json()
+            return latencies, stats["prefetch"]
+
+
+def child(mode, questions):
+    fakes.install(llm=0.3, embed=0.05, mongo=0.02)
+    os.environ.update(MODES[mode])
+    os.environ["RESPONSE_CACHE"] = "off"
+    os.environ["VECTOR_INDEX"] = "exact"
+    os.environ["VECTOR_INDEX_PATH"] = os.path.join(tempfile.mkdtemp(), "vector_index.npz")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        from services import services
+        logging.getLogger("app").setLevel(logging.WARNING)
+        services.bot.ingest_document("Revenue grew twelve percent in every region.\n\n" * 20, doc_id="report")
+        latencies, stats = asyncio.run(run(api.app, questions))
+    print(json.dumps({"median": statistics.median(latencies), "p95": sorted(latencies)[int(len(latencies) * 0.95) - 1], "stats": stats}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--child", choices=tuple(MODES))
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.questions)
+        return
+
+    print(f"{'mode':<13}{'median':>10}{'p95':>10}   prefetch stats")
+    for mode in MODES:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.prefetch", "--child", mode, "--questions", str(args.questions)],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()
+        result = json.loads(out[-1])
+        print(f"{mode:<13}{result['median']:>8.1f}ms{result['p95']:>8.1f}ms   {result['stats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Re-ingestion cost: first upload, an unchanged re-upload and a lightly edited one.
+
+Each upload goes through `aingest_document` with the same doc_id, the way a
+re-uploaded file does. "full" is what every upload cost before chunks were
+keyed by content hash: embed every chunk and insert it again, so each
+re-upload also duplicated the whole document.
+
+    python -m benchmarks.reingest --sections 2000 --edits 10 --embed-latency 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from benchmarks import fakes
+
+
+def document(sections, edited=()):
+    return "\n\n".join(
+        f"Section {i}: revenue {'fell' if i in edited else 'grew'} by {i % 17} percent in region {i % 7}, "
+        f"driven by unit {i % 5} where costs stayed flat and headcount moved by {i % 11}."
+        for i in range(sections)
+    )
+
+
+async def upload(bot, text, embedded):
+    calls = bot.embedding_model.calls
+    texts = embedded[0]
+    start = time.perf_counter()
+    summary = await bot.aingest_document(text, doc_id="report.txt", filename="report.txt")
+    elapsed = time.perf_counter() - start
+    stored = bot.doc_collection.count_documents({"doc_id": "report.txt"})
+    return summary, bot.embedding_model.calls - calls, embedded[0] - texts, elapsed, stored
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, default=2000)
+    parser.add_argument("--edits", type=int, default=10)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    fakes.install(embed=args.embed_latency, mongo=0.0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from services import services
+        bot = services.bot
+
+        # Count the texts sent for embedding, not just the calls
+        embedded = [0]
+        aembed = bot.embedding_model.aembed_documents
+
+        async def counted(texts):
+            embedded[0] += len(texts)
+            return await aembed(texts)
+
+        bot.embedding_model.aembed_documents = counted
+
+        edited = set(range(0, args.sections, max(args.sections // max(args.edits, 1), 1))[:args.edits])
+        original, changed = document(args.sections), document(args.sections, edited)
+        runs = []
+        for name, text in (("first upload", original), ("unchanged", original), ("edited", changed)):
+            runs.append((name, asyncio.run(upload(bot, text, embedded))))
+
+    print(f"sections={args.sections}, edited sections={len(edited)}, embed latency={args.embed_latency * 1000:.0f} ms/call")
+    print(f"{'upload':<14}{'added':>8}{'reused':>8}{'removed':>9}{'embedded':>10}{'embed calls':>13}{'ms':>10}{'stored':>8}")
+    for name, (summary, calls, texts, elapsed, stored) in runs:
+        print(f"{name:<14}{summary['added']:>8}{summary['reused']:>8}{summary['removed']:>9}"
+              f"{texts:>10}{calls:>13}{elapsed * 1000:>10.1f}{stored:>8}")
+    chunks = runs[0][1][0]["chunks"]
+    print(f"full re-embed: {chunks} chunks embedded and {chunks} more stored on every re-upload")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Semantic response cache on /chat/: latency of cache hits vs full graph runs.
+
+Each question is asked several times with casing/punctuation variants, then a
+document upload invalidates the cache and the questions are asked again.
+
+The same questions are then asked by returning users: each has chatted before
+(a stored turn, found by rag_search) but starts a new thread, as after a restart
+or once MAX_THREADS evicted theirs, and may be answered from the cache like
+anyone else. Half of them once asked about the same topic, so a reply the graph
+builds for them draws on their own history and is not stored in the shared
+cache; the rest asked about something else, and their replies are stored.
+
+    python -m benchmarks.response_cache --questions 10 --repeats 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import statistics
+import time
+from uuid import uuid4
+
+from benchmarks import fakes
+
+
+VARIANTS = ("{q}?", "{q}", "{Q}?", "  {q} ?", "{q}!!")
+
+
+async def ask(client, message, user_id=None):
+    # Every ask opens a new conversation (follow-up turns bypass the cache): a new user, or a new thread
+    start = time.perf_counter()
+    r = await client.post("/chat/", json={"message": message, "user_id": user_id or str(uuid4())})
+    r.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+async def run(app, response_cache, questions, repeats):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            first, repeat = [], []
+            for i in range(questions):
+                q = f"what did the annual report say about topic {i}"
+                for j in range(repeats):
+                    ms = await ask(client, VARIANTS[j % len(VARIANTS)].format(q=q, Q=q.upper()))
+                    (first if j == 0 else repeat).append(ms)
+            before_upload = response_cache.stats()
+
+            r = await client.post("/upload/", files={"file": ("new.txt", b"Fresh numbers for every topic.")})
+            job_id = r.json()["job_id"]
+            while (await client.get(f"/upload/{job_id}")).json()["status"] not in ("completed", "failed"):
+                await asyncio.sleep(0.01)
+
+            after = [await ask(client, f"what did the annual report say about topic {i}?") for i in range(questions)]
+
+            returning = await ask_returning(client, response_cache, questions, repeats)
+            return first, repeat, after, before_upload, returning
+
+
+async def ask_returning(client, response_cache, questions, repeats):
+    from services import services
+
+    bot = services.bot
+    users = [f"returning-{n}" for n in range(questions * repeats)]
+    for n, user_id in enumerate(users):
+        if n % 2:
+            bot.ingest_response("any good pasta recipes?", "Try cacio e pepe.", user_id)
+        else:
+            i = n % questions
+            bot.ingest_response(f"tell me about topic {i} in the annual report", f"My notes on topic {i} say it grew.", user_id)
+    response_cache.clear()
+    before = response_cache.stats()
+    for n, user_id in enumerate(users):
+        await ask(client, f"what did the annual report say about topic {n % questions}?", user_id)
+        # The next visit starts over: the thread is gone, the stored turns are not
+        services.checkpointer.delete_thread(user_id)
+    after = response_cache.stats()
+    hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+    return {"hits": hits, "asks": hits + misses, "stores": after["stores"] - before["stores"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    fakes.install(llm=args.llm_latency)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        from services import services
+        logging.getLogger("app").setLevel(logging.WARNING)
+        first, repeat, after, before_upload, returning = asyncio.run(
+            run(api.app, services.response_cache, args.questions, args.repeats)
+        )
+
+    print(f"first ask (graph)        median {statistics.median(first):8.1f} ms")
+    print(f"repeat asks (cache)      median {statistics.median(repeat):8.1f} ms")
+    print(f"after upload (graph)     median {statistics.median(after):8.1f} ms")
+    print(f"hit rate before upload   {before_upload['hit_rate']:.0%}, saved {before_upload['saved_ms'] / 1000:.1f}s in total")
+    print(f"returning users          {returning['hits']}/{returning['asks']} answered from cache "
+          f"({returning['hits'] / returning['asks']:.0%}), {returning['stores']} answers stored")
+    print(f"final stats: {services.response_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
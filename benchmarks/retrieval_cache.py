@@ -0,0 +1,138 @@
+"""
+rag_search with and without the retrieval cache on a conversation-like workload.
+
+`--searches` hybrid_search calls from `--users` users, drawn from `--distinct`
+questions with a skew towards the popular ones and written with varying case
+and punctuation, as an agent re-asks within and across turns. Every
+`--chat-every` searches a chat turn of a random user is flushed (invalidating
+that user's results) and every `--document-every` searches a document is
+ingested (invalidating all of them). Each mode runs in its own process:
+  off     RETRIEVAL_CACHE=off
+  memory  the in-process cache
+  shared  RETRIEVAL_CACHE_PATH: a first worker runs the workload, then a second
+          process on the same SQLite file asks the same questions after the
+          first worker's last ingest (its fake Mongo is empty: only what the
+          first worker cached can answer it, so its results are not diffed)
+Reported: median and mean search latency, hit rate, searches that reached the
+sources, and results that differ from the uncached run.
+
+    python -m benchmarks.retrieval_cache --searches 600 --users 8
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes
+
+
+VARIANTS = ("{q}", "{q}?", "{Q}", "  {q} ?", "{q}.")
+
+
+def workload(args):
+    rng = random.Random(0)
+    questions = [f"what does the report say about region {i} revenue" for i in range(args.distinct)]
+    # Zipf-like popularity
+    weights = [1 / (i + 1) for i in range(args.distinct)]
+    steps = []
+    for n in range(args.searches):
+        if n and n % args.document_every == 0:
+            steps.append(("document", n))
+        if n and n % args.chat_every == 0:
+            steps.append(("chat", f"user-{rng.randrange(args.users)}", n))
+        q = rng.choices(questions, weights)[0]
+        steps.append(("search", f"user-{rng.randrange(args.users)}", rng.choice(VARIANTS).format(q=q, Q=q.upper())))
+    return steps
+
+
+def report_text(i):
+    return "\n\n".join(f"Region {r} revenue grew {(r * 7 + i) % 23} percent in update {i}." for r in range(12))
+
+
+async def run(bot, steps, writer):
+    if writer:
+        bot.ingest_document(report_text(0), doc_id="report-0", filename="report-0.txt")
+    latencies, digests = [], []
+    for step in steps:
+        if step[0] != "search" and not writer:
+            continue
+        if step[0] == "document":
+            await bot.aingest_document(report_text(step[1]), doc_id=f"report-{step[1]}", filename=f"report-{step[1]}.txt")
+        elif step[0] == "chat":
+            bot.ingest_response(f"any news at step {step[2]}?", f"Region {step[2] % 12} revenue news at step {step[2]}.", step[1])
+        else:
+            started = time.perf_counter()
+            result = await bot.ahybrid_search(step[2], user_id=step[1])
+            latencies.append((time.perf_counter() - started) * 1000)
+            digests.append(hashlib.sha256(result.encode("utf-8")).hexdigest()[:12])
+    return latencies, digests
+
+
+def child(args):
+    fakes.install(embed=args.embed_latency, mongo=args.mongo_latency)
+    os.environ["VECTOR_INDEX"] = "exact"
+    os.environ["VECTOR_INDEX_PATH"] = os.path.join(tempfile.mkdtemp(), "vector_index.npz")
+    if args.mode == "off":
+        os.environ["RETRIEVAL_CACHE"] = "off"
+    elif args.mode != "memory":
+        os.environ["RETRIEVAL_CACHE_PATH"] = args.cache_path
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from services import services
+        bot = services.bot
+        latencies, digests = asyncio.run(run(bot, workload(args), writer=args.mode != "shared-second"))
+    cache = bot.retrieval_cache.stats() if bot.retrieval_cache is not None else {}
+    print(json.dumps({
+        "p50": statistics.median(latencies),
+        "mean": statistics.fmean(latencies),
+        "hit_rate": cache.get("hit_rate", 0.0),
+        "searched": bot.retrieval_stats.snapshot().get("total", {}).get("count", 0),
+        "digests": digests,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--searches", type=int, default=600)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=30, help="distinct questions")
+    parser.add_argument("--chat-every", type=int, default=20, help="searches between flushed chat turns")
+    parser.add_argument("--document-every", type=int, default=200, help="searches between document ingests")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--mongo-latency", type=float, default=0.02)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return child(args)
+
+    cache_path = os.path.join(tempfile.mkdtemp(), "retrieval_cache.sqlite3")
+    print(f"{args.searches} searches, {args.distinct} questions, {args.users} users")
+    print(f"{'mode':<10}{'p50 ms':>9}{'mean ms':>9}{'hit rate':>10}{'searched':>10}{'differ':>8}")
+    reference = None
+    for mode in ("off", "memory", "shared-first", "shared-second"):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.retrieval_cache", *sys.argv[1:], "--mode", mode, "--cache-path", cache_path],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        reference = reference or r["digests"]
+        if mode == "shared-second":
+            differ = "-"
+        else:
+            differ = sum(a != b for a, b in zip(r["digests"], reference))
+        label = {"shared-first": "shared 1", "shared-second": "shared 2"}.get(mode, mode)
+        print(f"{label:<10}{r['p50']:>9.1f}{r['mean']:>9.1f}{r['hit_rate']:>10.0%}{r['searched']:>10}{differ:>8}")
+
+
+if __name__ == "__main__":
+    main()
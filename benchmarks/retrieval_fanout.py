@@ -0,0 +1,95 @@
+"""
+Per-stage latency of Gemini.ahybrid_search with concurrent retrieval fan-out.
+
+"serial" is the sum of the text, vector (embed + search) and chat stages, i.e.
+what the one-after-another implementation paid. The second scenario makes the
+chat-history source hang and shows the search returning at the source deadline.
+
+    python -m benchmarks.retrieval_fanout --queries 30
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks import fakes
+
+
+class HangingCollection:
+    def __init__(self, collection, delay):
+        self._collection = collection
+        self._delay = delay
+
+    async def aggregate(self, *args, **kwargs):
+        await asyncio.sleep(self._delay)
+        return await self._collection.aggregate(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        cursor = self._collection.find(*args, **kwargs)
+        to_list = cursor.to_list
+
+        async def slow_to_list(length=None):
+            await asyncio.sleep(self._delay)
+            return await to_list(length)
+        cursor.to_list = slow_to_list
+        return cursor
+
+
+async def run(bot, queries, tag):
+    rows = []
+    for i in range(queries):
+        before = {name: stage["count"] for name, stage in bot.retrieval_stats.snapshot().items()}
+        start = time.perf_counter()
+        result = await bot.ahybrid_search(f"{tag} revenue question {i}")
+        wall = (time.perf_counter() - start) * 1000
+        stats = bot.retrieval_stats.snapshot()
+        assert all(stats[name]["count"] == before.get(name, 0) + 1 for name in ("text", "vector", "chat"))
+        rows.append({name: stats[name]["last_ms"] for name in ("text", "embed", "vector", "chat", "total")})
+        rows[-1]["wall"] = wall
+        rows[-1]["documents"] = "NO RELEVANT DOCUMENTS" not in result
+    return rows
+
+
+def report(title, rows):
+    median = {key: statistics.median(row[key] for row in rows) for key in ("text", "embed", "vector", "chat", "total")}
+    serial = median["text"] + median["vector"] + median["chat"]
+    print(f"\n{title}")
+    for key in ("embed", "text", "vector", "chat"):
+        print(f"  {key:<8}{median[key]:8.1f} ms")
+    print(f"  {'serial':<8}{serial:8.1f} ms  (sum of sources)")
+    print(f"  {'total':<8}{median['total']:8.1f} ms  (concurrent)")
+    print(f"  documents found in {sum(row['documents'] for row in rows)}/{len(rows)} searches")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--embed-latency", type=float, default=0.08)
+    parser.add_argument("--mongo-latency", type=float, default=0.03)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fakes.install(embed=args.embed_latency, mongo=args.mongo_latency)
+    # mongomock has no Atlas $search, so serve the vector source from the in-process index
+    os.environ.setdefault("VECTOR_INDEX", "exact")
+    os.environ.setdefault("VECTOR_INDEX_PATH", os.path.join(tempfile.mkdtemp(), "vector_index.npz"))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from services import services
+        bot = services.bot
+        bot.retrieval_timeout = args.timeout
+        bot.ingest_document("Quarterly revenue grew twelve percent on cloud sales.\n\n" * 20, doc_id="report")
+        normal = asyncio.run(run(bot, args.queries, "normal"))
+        bot.async_chat_history_collection = HangingCollection(bot.async_chat_history_collection, 10.0)
+        degraded = asyncio.run(run(bot, args.queries, "degraded"))
+
+    report("all sources healthy", normal)
+    report(f"chat history hanging, {args.timeout}s source deadline", degraded)
+
+
+if __name__ == "__main__":
+    main()
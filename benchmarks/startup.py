@@ -0,0 +1,121 @@
+"""
+Cold start: import time, time to the first served request and first /chat/ latency.
+
+Each mode runs in a fresh interpreter against fakes seeded with `--chunks`
+document chunks, so the BM25 and vector index builds cost what they would on a
+real corpus. "eager" calls services.warm_up() right after the import, which is
+what importing api.py used to do; "lazy" is the current startup, where warm-up
+runs in the background from the app lifespan.
+
+All times are measured from before `import api`:
+  import       the import itself
+  first resp   first HTTP response of any kind (GET /ready)
+  ready        GET /ready first returns 200
+  first chat   first /chat/ reply, sent as soon as the app starts
+"next chat" is the following /chat/ on its own, i.e. the per-request cost
+(mostly mongomock scanning the seeded collection) without any warm-up.
+
+    python -m benchmarks.startup --chunks 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes
+
+
+def seed(chunks):
+    collection = fakes.FakeMongoClient()["RAG-cluster"]["document_chunks"]
+    embeddings = fakes.FakeEmbeddings()
+    texts = [f"Chunk {i}: revenue in region {i % 50} grew {i % 13} percent." for i in range(chunks)]
+    vectors = embeddings.embed_documents(texts)
+    collection.insert_many([
+        {"doc_id": "seed", "chunk": text, "embedding": vector, "metadata": {"chunk_index": i, "filename": "seed.txt"}}
+        for i, (text, vector) in enumerate(zip(texts, vectors))
+    ])
+
+
+async def serve(app, started):
+    import httpx
+
+    times = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def first_chat():
+                r = await client.post("/chat/", json={"message": "what about revenue in region 7", "user_id": "bench"})
+                r.raise_for_status()
+                times["first chat"] = time.perf_counter() - started
+                start = time.perf_counter()
+                r = await client.post("/chat/", json={"message": "what about revenue in region 8", "user_id": "bench-2"})
+                r.raise_for_status()
+                times["next chat"] = time.perf_counter() - start
+
+            async def readiness():
+                while True:
+                    r = await client.get("/ready")
+                    times.setdefault("first resp", time.perf_counter() - started)
+                    if r.status_code == 200:
+                        times["ready"] = time.perf_counter() - started
+                        return
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(first_chat(), readiness())
+    return times
+
+
+def child(mode, chunks):
+    fakes.install(mongo=0.0)
+    tmp = tempfile.mkdtemp()
+    os.environ["VECTOR_INDEX"] = "exact"
+    os.environ["VECTOR_INDEX_PATH"] = os.path.join(tmp, "vector_index.npz")
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed(chunks)
+        fakes.latencies.mongo = 0.005
+
+        started = time.perf_counter()
+        import api
+        from services import services
+        if mode == "eager":
+            services.warm_up()
+        imported = time.perf_counter() - started
+        logging.getLogger("app").setLevel(logging.WARNING)
+        times = asyncio.run(serve(api.app, started))
+    times["import"] = imported
+    print(json.dumps({name: round(seconds * 1000, 1) for name, seconds in times.items()}))
+    print(json.dumps(services.timings))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--child", choices=("lazy", "eager"))
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.chunks)
+        return
+
+    columns = ("import", "first resp", "ready", "first chat", "next chat")
+    print(f"chunks={args.chunks}, times in ms from before `import api`")
+    print(f"{'mode':<8}" + "".join(f"{name:>12}" for name in columns))
+    for mode in ("eager", "lazy"):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--child", mode, "--chunks", str(args.chunks)],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()
+        times, components = json.loads(out[-2]), json.loads(out[-1])
+        print(f"{mode:<8}" + "".join(f"{times[name]:>12.1f}" for name in columns))
+    print(f"component build times (ms): {components}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Time to first token on /chat/stream vs time to the full reply on /chat/.
+
+The TTFT figures are the ones /chat/stream reports in its `done` event, measured
+server side from request arrival to the first token.
+
+    python -m benchmarks.stream_ttft --requests 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import time
+
+from benchmarks import fakes
+
+
+async def run(app, total):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        blocking, ttft, stream_total = [], [], []
+        for i in range(total):
+            # Fresh users, so every turn starts an empty conversation
+            payload = {"message": "what does the report say", "user_id": f"bench-{i}"}
+
+            start = time.perf_counter()
+            r = await client.post("/chat/", json=payload)
+            r.raise_for_status()
+            blocking.append((time.perf_counter() - start) * 1000)
+
+            r = await client.post("/chat/stream", json=dict(payload, user_id=f"bench-stream-{i}"))
+            r.raise_for_status()
+            event = None
+            for line in r.text.splitlines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event == "done":
+                    done = json.loads(line[len("data: "):])
+                    ttft.append(done["ttft_ms"])
+                    stream_total.append(done["total_ms"])
+        return blocking, ttft, stream_total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    fakes.install(llm=args.llm_latency, token=args.token_latency)
+    # Both endpoints must run the graph every time
+    os.environ["RESPONSE_CACHE"] = "off"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        logging.getLogger("app").setLevel(logging.WARNING)
+        blocking, ttft, stream_total = asyncio.run(run(api.app, args.requests))
+
+    print(f"requests={args.requests}")
+    print(f"/chat/        median time to full reply : {statistics.median(blocking):7.1f} ms")
+    print(f"/chat/stream  median time to first token: {statistics.median(ttft):7.1f} ms")
+    print(f"/chat/stream  median time to full reply : {statistics.median(stream_total):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-stage tracing: the spans one /chat/ request produces and what they cost.
+
+Sends chat requests through the real app with TRACE_EXPORTER=local, then reads
+the spans of the last one back from GET /traces/{X-Request-ID} and the span
+series from GET /metrics. The cost of a span is measured on its own, since it
+is far below the noise of a whole request.
+
+    python -m benchmarks.tracing --requests 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import statistics
+import time
+from uuid import uuid4
+
+from benchmarks import fakes
+
+
+async def run(app, requests):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            r = await client.post("/upload/", files={"file": ("report.txt", b"Revenue grew nine percent in the north.")})
+            job_id = r.json()["job_id"]
+            while (await client.get(f"/upload/{job_id}")).json()["status"] not in ("completed", "failed"):
+                await asyncio.sleep(0.01)
+
+            latencies = []
+            for i in range(requests):
+                start = time.perf_counter()
+                r = await client.post("/chat/", json={"message": f"how did revenue do in region {i}", "user_id": str(uuid4())})
+                r.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            spans = (await client.get(f"/traces/{r.headers['X-Request-ID']}")).json()["spans"]
+            metrics = (await client.get("/metrics")).text
+            return latencies, spans, metrics
+
+
+def span_cost_us(n=20_000):
+    from tracing import span
+
+    start = time.perf_counter()
+    for _ in range(n):
+        with span("bench", "mongo"):
+            pass
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    fakes.install()
+    os.environ["TRACE_EXPORTER"] = "local"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+        logging.getLogger("app").setLevel(logging.WARNING)
+        latencies, spans, metrics = asyncio.run(run(api.app, args.requests))
+
+    print(f"/chat/ median {statistics.median(latencies):.1f} ms over {len(latencies)} requests")
+    print(f"spans for the last request ({len(spans)}):")
+    for s in spans:
+        error = f"  ERROR {s['error']}" if s["error"] else ""
+        print(f"  {s['kind']:<10} {s['name']:<22} {s['duration_ms']:8.2f} ms{error}")
+    series = [line for line in metrics.splitlines() if line.startswith(("span_duration_seconds_count", "span_errors_total"))]
+    print(f"/metrics span series ({len(series)}):")
+    for line in series:
+        print(f"  {line}")
+    print(f"cost of one span (metrics + local export): {span_cost_us():.1f} us")
+
+
+if __name__ == "__main__":
+    main()
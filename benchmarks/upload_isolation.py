@@ -0,0 +1,147 @@
+"""
+/chat/ latency while large PDFs are being ingested, with extraction in a thread vs in worker processes.
+
+Each mode runs in its own process against `api.app` on the local fakes. Chat
+clients send /chat/ requests back to back, first with nothing else running
+("idle"), then while `--uploads` PDFs of `--pages` pages go through /upload/
+("uploading"). "thread" is EXTRACT_WORKERS=0: PyPDF2 runs in a thread of the
+server process, where it holds the GIL the event loop needs. "process" hands
+page ranges to EXTRACT_WORKERS worker processes. Chunk and embedding cache
+writes are acknowledged and dropped, so the corpus chat searches does not grow
+while the uploads run and only the parsing competes with the chat requests.
+
+    python -m benchmarks.upload_isolation --pages 300 --uploads 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes
+from benchmarks.document_ingestion import Sink, write_pdf
+from benchmarks.load import QUANTILES, summarize
+
+
+class DiscardWrites:
+    """Reads go to `collection`; bulk writes are acknowledged and dropped."""
+
+    bulk_write = Sink.bulk_write
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+async def chat_until(client, done, samples, i):
+    while not done.is_set():
+        start = time.perf_counter()
+        r = await client.post("/chat/", json={"message": f"what grew in region {i % 7}", "user_id": f"bench-{i}"})
+        r.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+async def run(args, path):
+    import httpx
+    import api
+    from services import services
+
+    logging.getLogger("app").setLevel(logging.WARNING)
+    result = {}
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await client.get("/ready")
+            await services.wait_ready()
+            bot = services.bot
+            bot.async_doc_collection = DiscardWrites(bot.async_doc_collection)
+            bot.embedding_model.async_collection = Sink()
+            # Let the extraction workers finish starting up (a spawned process re-imports this module)
+            await asyncio.sleep(args.settle_seconds)
+
+            done = asyncio.Event()
+            idle = []
+            chats = [asyncio.create_task(chat_until(client, done, idle, i)) for i in range(args.clients)]
+            await asyncio.sleep(args.idle_seconds)
+            done.set()
+            await asyncio.gather(*chats)
+            result["idle"] = summarize(idle)
+
+            async def upload(i):
+                with open(path, "rb") as f:
+                    r = await client.post("/upload/", files={"file": (f"report-{i}.pdf", f)})
+                job_id = r.json()["job_id"]
+                while True:
+                    job = (await client.get(f"/upload/{job_id}")).json()
+                    if job["finished_at"] is not None:
+                        return job
+                    await asyncio.sleep(0.1)
+
+            done = asyncio.Event()
+            busy = []
+            chats = [asyncio.create_task(chat_until(client, done, busy, i)) for i in range(args.clients)]
+            started = time.perf_counter()
+            jobs = await asyncio.gather(*(upload(i) for i in range(args.uploads)))
+            result["upload_s"] = round(time.perf_counter() - started, 2)
+            done.set()
+            await asyncio.gather(*chats)
+            result["uploading"] = summarize(busy)
+            result["jobs"] = [job["status"] for job in jobs]
+    return result
+
+
+def child(args):
+    fakes.install(llm=args.llm_latency, embed=args.embed_latency, mongo=0.001, token=0.0)
+    os.environ["EXTRACT_WORKERS"] = str(0 if args.mode == "thread" else args.workers)
+    os.environ["RESPONSE_CACHE"] = "off"
+    os.environ["KEYWORD_INDEX"] = "off"
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run(args, args.path))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--uploads", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent /chat/ clients")
+    parser.add_argument("--workers", type=int, default=2, help="EXTRACT_WORKERS in process mode")
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--settle-seconds", type=float, default=5.0)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--mode", choices=("thread", "process"), help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return child(args)
+
+    path = os.path.join(tempfile.mkdtemp(), "report.pdf")
+    write_pdf(path, args.pages)
+    print(f"{args.uploads} uploads x {args.pages} pages, {args.clients} chat clients; /chat/ latency in ms")
+    print(f"{'mode':<9}{'phase':<11}{'count':>6}" + "".join(f"{'p' + str(q):>9}" for q in QUANTILES) + f"{'max':>9}{'upload s':>10}")
+    for mode in ("thread", "process"):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.upload_isolation", *sys.argv[1:], "--mode", mode, "--path", path],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        for phase in ("idle", "uploading"):
+            stage = result[phase]
+            upload_s = f"{result['upload_s']:>10.1f}" if phase == "uploading" else ""
+            print(f"{mode:<9}{phase:<11}{stage['count']:>6}" + "".join(f"{stage['p' + str(q)]:>9.1f}" for q in QUANTILES)
+                  + f"{stage['max']:>9.1f}{upload_s}")
+        if any(status != "completed" for status in result["jobs"]):
+            print(f"  upload jobs: {result['jobs']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Recall and latency of IVFIndex against the exact (brute-force) baseline.
+
+Vectors are drawn around random cluster centres, like real document embeddings,
+and recall@k is measured against ExactIndex results for the same queries.
+
+    python -m benchmarks.vector_index --vectors 100000 --dim 768
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from vector_index import ExactIndex, IVFIndex
+
+
+def synthetic(n, dim, clusters, noise, seed):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return (centres[labels] + noise * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    results = [[doc_id for doc_id, _ in index.search(q, k)] for q in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=5000)
+    parser.add_argument("--noise", type=float, default=1.0)
+    args = parser.parse_args()
+
+    data = synthetic(args.vectors + args.queries, args.dim, args.clusters, args.noise, seed=0)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    ids = list(range(args.vectors))
+
+    exact = ExactIndex()
+    start = time.perf_counter()
+    exact.add(ids, vectors)
+    print(f"exact build: {time.perf_counter() - start:.2f}s")
+
+    ivf = IVFIndex()
+    start = time.perf_counter()
+    ivf.add(ids, vectors)
+    print(f"ivf   build: {time.perf_counter() - start:.2f}s ({len(ivf._centroids)} lists)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.npz")
+        start = time.perf_counter()
+        ivf.save(path)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        IVFIndex.load(path)
+        print(f"ivf snapshot: save {saved:.2f}s, load {time.perf_counter() - start:.2f}s "
+              f"({os.path.getsize(path) / 2**20:.0f} MiB)")
+
+    truth, exact_ms = timed_search(exact, queries, args.k)
+    print(f"\n{'index':<16}{'ms/query':>10}{'recall@' + str(args.k):>12}")
+    print(f"{'exact':<16}{exact_ms:>10.2f}{1.0:>12.3f}")
+
+    for nprobe in (1, 4, 8, 16, 32):
+        ivf.nprobe = nprobe
+        found, ivf_ms = timed_search(ivf, queries, args.k)
+        recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{ivf_ms:>10.2f}{recall:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
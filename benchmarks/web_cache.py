@@ -0,0 +1,58 @@
+"""
+TTL + single-flight cache in front of TavilySearch: upstream calls and latency.
+
+A burst of concurrent users asks about the same few trending topics (with
+casing and spacing variants), first against the bare fake Tavily tool, then
+through CachedWebSearch. A second burst after the TTL shows entries expiring.
+
+    python -m benchmarks.web_cache --users 50 --topics 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks import fakes
+
+
+VARIANTS = ("{q}", "{Q}", "  {q} ")
+
+
+async def burst(tool, users, topics):
+    async def ask(i):
+        q = f"latest news on topic {i % topics}"
+        start = time.perf_counter()
+        await tool.ainvoke({"query": VARIANTS[i % len(VARIANTS)].format(q=q, Q=q.upper())})
+        return (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(ask(i) for i in range(users)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--topics", type=int, default=5)
+    parser.add_argument("--ttl", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fakes.install(tavily=0.2)
+    from Tools.CachedWebSearch import CachedWebSearch
+
+    bare = fakes.FakeTavilySearch(max_results=3)
+    uncached = asyncio.run(burst(bare, args.users, args.topics))
+    print(f"uncached   {bare.calls:4d} Tavily calls, median {statistics.median(uncached):7.1f} ms")
+
+    upstream = fakes.FakeTavilySearch(max_results=3)
+    cached = CachedWebSearch(upstream, ttl_seconds=args.ttl)
+    first = asyncio.run(burst(cached, args.users, args.topics))
+    print(f"cached     {upstream.calls:4d} Tavily calls, median {statistics.median(first):7.1f} ms  (cold burst)")
+    second = asyncio.run(burst(cached, args.users, args.topics))
+    print(f"           {upstream.calls:4d} Tavily calls, median {statistics.median(second):7.1f} ms  (warm burst)")
+    time.sleep(args.ttl)
+    asyncio.run(burst(cached, args.users, args.topics))
+    print(f"           {upstream.calls:4d} Tavily calls after the {args.ttl}s TTL")
+    print(f"stats: {cached.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import asyncio
+import glob
+import logging
+import os
+import time
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from metrics import LatencyStats
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger("app")
+
+
+class BacklogFullError(Exception):
+    pass
+
+
+def _lock(path):
+    """
+    The open lock file of journal `path`, held exclusively, or None if a live
+    writer holds it. The OS releases the lock when its process dies, which is
+    how a journal left by a crashed worker is told from a running one's.
+    """
+    handle = open(f"{path}.lock", "a")
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind buffer for chat turns.
+
+    `submit` appends the turn to an fsync'ed JSONL journal and returns; a
+    background task flushes the buffer with one `insert_many` once it holds
+    `max_batch` turns or `flush_interval` seconds have passed. The journal is
+    truncated only after Mongo acknowledged the batch, and is replayed on start,
+    so a crash loses nothing. Turns carry their `_id` from submit time, which
+    makes a replay of an already-inserted batch a no-op instead of a duplicate.
+
+    Journal writes run on a thread, and turns submitted while one fsync is in
+    progress share the next (group commit). Each process journals to its own
+    `<journal_path root>.<pid><ext>`, so workers never rewrite each other's
+    file, and `start` also replays the journals of writers that are gone.
+
+    While Mongo is unreachable failed batches stay buffered, up to `max_pending`
+    turns. Past that `submit` waits up to `full_timeout` seconds for a flush to
+    make room and then raises BacklogFullError, so an outage cannot grow the
+    buffer and the journal rewrite without bound.
+    """
+
+    def __init__(self, collection, journal_path, max_batch=50, flush_interval=1.0, embed=None, on_flushed=None,
+                 max_pending=10000, full_timeout=5.0):
+        self.collection = collection
+        self.base_path = journal_path
+        self.journal_path = None
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.embed = embed
+        self.on_flushed = on_flushed
+        self.max_pending = max_pending
+        self.full_timeout = full_timeout
+
+        self._buffer = []
+        self._journal = None
+        self._owner = None
+        self._journal_lock = None
+        self._lines = []
+        self._wakeup = None
+        self._drained = None
+        self._task = None
+        self._flush_lock = None
+        self._stopping = False
+        self.flush_stats = LatencyStats()
+        self._stats = {"submitted": 0, "flushed": 0, "flushes": 0, "failures": 0, "replayed": 0, "rejected": 0}
+
+    def pending(self):
+        return len(self._buffer)
+
+    def stats(self):
+        return dict(self._stats, pending=len(self._buffer), flush_ms=self.flush_stats.snapshot().get("flush"))
+
+    # === Lifecycle ===
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._journal_lock = asyncio.Lock()
+        self._stopping = False
+        replay = await asyncio.to_thread(self._recover)
+        if replay:
+            logger.info(f"Replaying {len(replay)} unflushed chat turns into {self.journal_path}")
+            self._buffer = replay + self._buffer
+            self._stats["replayed"] += len(replay)
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still buffered; called on app shutdown."""
+        if self._task is None:
+            return
+        # Let the loop finish its current flush rather than cancelling it mid-insert
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        async with self._journal_lock:
+            await asyncio.to_thread(self._close)
+
+    def _close(self):
+        self._journal.close()
+        self._journal = None
+        if not self._buffer:
+            # Nothing left to replay: a clean shutdown leaves no file behind
+            os.remove(self.journal_path)
+            os.remove(f"{self.journal_path}.lock")
+        self._owner.close()
+        self._owner = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # === Journal ===
+
+    def _recover(self):
+        """
+        Take this process's journal and adopt the ones whose writer is gone;
+        returns their entries. Without fcntl a live writer cannot be told from
+        a dead one, so only this process's journal and the shared legacy
+        `journal_path` are replayed.
+        """
+        root, ext = os.path.splitext(self.base_path)
+        self.journal_path = f"{root}.{os.getpid()}{ext}"
+        self._owner = _lock(self.journal_path)
+        if self._owner is None:
+            raise RuntimeError(f"{self.journal_path} is in use by another chat writer")
+
+        orphans = []
+        for path in sorted(set(glob.glob(f"{glob.escape(root)}.*{ext}")) | {self.base_path}):
+            if path == self.journal_path or not os.path.exists(path):
+                continue
+            if fcntl is None and path != self.base_path:
+                continue
+            lock = _lock(path)
+            if lock is not None:
+                orphans.append((path, lock))
+
+        replay = {}
+        for path in [self.journal_path, *(path for path, _ in orphans)]:
+            for entry in self._read_journal(path):
+                replay.setdefault(entry["_id"], entry)
+        replay = list(replay.values())
+        # Recovered turns are durable in this journal before the orphaned ones are deleted
+        self._rewrite_journal(replay)
+        for path, lock in orphans:
+            os.remove(path)
+            os.remove(f"{path}.lock")
+            lock.close()
+        return replay
+
+    @staticmethod
+    def _read_journal(path):
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json_util.loads(line))
+                    except ValueError:
+                        # A torn last line from a crash mid-write; everything before it is intact
+                        logger.warning(f"Skipping unreadable chat journal line: {line[:80]}")
+        return entries
+
+    def _rewrite_journal(self, entries):
+        tmp = f"{self.journal_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json_util.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self._journal is not None:
+            self._journal.close()
+        os.replace(tmp, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _append_lines(self, lines):
+        self._journal.write("".join(lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    async def _append(self, line):
+        """Make `line` durable. Lines queued while another append holds the lock go out with the next fsync."""
+        self._lines.append(line)
+        async with self._journal_lock:
+            # Empty when an earlier append (or a journal rewrite) already covered this line
+            if not self._lines:
+                return
+            lines, self._lines = self._lines, []
+            try:
+                await asyncio.to_thread(self._append_lines, lines)
+            except BaseException:
+                self._lines = lines + self._lines
+                raise
+
+    # === Writes ===
+
+    async def _wait_for_room(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.full_timeout
+        while len(self._buffer) >= self.max_pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self._stats["rejected"] += 1
+                raise BacklogFullError(
+                    f"{len(self._buffer)} chat turns are waiting for MongoDB; not accepting more until they are written."
+                )
+            self._drained.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._drained.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def submit(self, entry):
+        if self._task is None:
+            await self.start()
+        if len(self._buffer) >= self.max_pending:
+            await self._wait_for_room()
+        entry.setdefault("_id", ObjectId())
+        self._buffer.append(entry)
+        self._stats["submitted"] += 1
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+        await self._append(json_util.dumps(entry) + "\n")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            start = time.perf_counter()
+            if self.embed is not None:
+                await self._embed(batch)
+            try:
+                try:
+                    await self.collection.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Duplicate _ids mean a replayed batch was already stored
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+            except BaseException as e:
+                # Keep the batch (it is still in the journal) and retry on the next cycle
+                self._buffer = batch + self._buffer
+                if not isinstance(e, Exception):
+                    raise
+                logger.warning(f"Chat history flush failed, will retry: {e}")
+                self._stats["failures"] += 1
+                return
+
+            async with self._journal_lock:
+                # The rewrite holds every buffered turn, including any whose append is still queued
+                self._lines = []
+                await asyncio.to_thread(self._rewrite_journal, list(self._buffer))
+            self._drained.set()
+            self.flush_stats.observe("flush", (time.perf_counter() - start) * 1000)
+            self._stats["flushes"] += 1
+            self._stats["flushed"] += len(batch)
+            if self.on_flushed is not None:
+                await self.on_flushed(batch)
+
+    async def _embed(self, batch):
+        missing = [entry for entry in batch if "embedding" not in entry]
+        if not missing:
+            return
+        try:
+            vectors = await self.embed([f"{e['user_query']}\n{e['response_text']}" for e in missing])
+        except Exception as e:
+            # Persisting the turn matters more than its vector
+            logger.warning(f"Chat history embedding failed, storing turns without vectors: {e}")
+            return
+        for entry, vector in zip(missing, vectors):
+            entry["embedding"] = vector
@@ -0,0 +1,81 @@
+import logging
+import os
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+
+logger = logging.getLogger("app")
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    In-process checkpointer for per-user conversation threads.
+
+    MemorySaver keeps every step of every thread forever. A chat only ever
+    resumes from the latest checkpoint, so each `put` drops the thread's older
+    checkpoints, their pending writes and the channel blobs they alone used,
+    and the least recently active threads are forgotten past `max_threads`.
+    """
+
+    def __init__(self, max_threads=10000):
+        super().__init__()
+        self.max_threads = max_threads
+        # thread_id -> blob keys stored for it, most recently active last
+        self._threads = OrderedDict()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = saved["configurable"]["thread_id"]
+        checkpoint_ns = saved["configurable"]["checkpoint_ns"]
+
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [cid for cid in checkpoints if cid != checkpoint["id"]]:
+            self._drop_checkpoint(thread_id, checkpoint_ns, checkpoint_id, checkpoints.pop(checkpoint_id))
+
+        live = {(thread_id, checkpoint_ns, channel, version) for channel, version in checkpoint["channel_versions"].items()}
+        blob_keys = self._threads.pop(thread_id, set())
+        blob_keys.update((thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items())
+        for key in [key for key in blob_keys if key[1] == checkpoint_ns and key not in live]:
+            self.blobs.pop(key, None)
+            blob_keys.discard(key)
+        self._threads[thread_id] = blob_keys
+
+        while len(self._threads) > self.max_threads:
+            self._forget(*self._threads.popitem(last=False))
+        return saved
+
+    def _drop_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id, saved):
+        self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        # get_tuple leaves an empty writes entry behind for the parent it looked up
+        self.writes.pop((thread_id, checkpoint_ns, saved[2]), None)
+
+    def _forget(self, thread_id, blob_keys):
+        for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id, saved in checkpoints.items():
+                self._drop_checkpoint(thread_id, checkpoint_ns, checkpoint_id, saved)
+        for key in blob_keys:
+            self.blobs.pop(key, None)
+
+    def delete_thread(self, thread_id):
+        self._threads.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def thread_count(self):
+        return len(self._threads)
+
+
+def build_checkpointer(client=None):
+    """
+    CHECKPOINTER=mongo stores threads in MongoDB through langgraph-checkpoint-mongodb
+    (optional dependency); otherwise threads live in a BoundedMemorySaver and are
+    lost on restart.
+    """
+    if os.getenv("CHECKPOINTER", "memory").lower() == "mongo":
+        try:
+            from langgraph.checkpoint.mongodb import MongoDBSaver
+        except ImportError:
+            logger.warning("langgraph-checkpoint-mongodb is not installed, keeping conversation threads in memory.")
+        else:
+            return MongoDBSaver(client, db_name="RAG-cluster")
+    return BoundedMemorySaver(max_threads=int(os.getenv("MAX_THREADS", "10000")))
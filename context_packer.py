@@ -0,0 +1,127 @@
+import math
+import re
+
+from metrics import LatencyStats
+
+
+def approx_tokens(text):
+    # Same 4-characters-per-token estimate as langchain's count_tokens_approximately
+    return math.ceil(len(text) / 4)
+
+
+def _terms(text):
+    return frozenset(re.findall(r"\w+", text.lower()))
+
+
+def _similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _join(first, second, max_overlap=200):
+    """Concatenate neighbouring chunks, dropping the text the splitter repeated across their boundary."""
+    for size in range(min(len(first), len(second), max_overlap), 9, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+class ContextPacker:
+    """
+    Turns hybrid_search candidates into the rag_search result under a token budget.
+
+    Neighbouring chunks of the same document are merged (their overlap dropped),
+    then items are picked by maximal marginal relevance: each pick maximises
+    `mmr_lambda * relevance - (1 - mmr_lambda) * max similarity to the picks so far`,
+    with relevance falling with the retrieval rank and similarity measured on word
+    sets. Items at least `duplicate_threshold` similar to a pick are dropped, at
+    most `top_k` documents and `top_k` conversations are kept, and the last item
+    that does not fit the budget is cut short. `stats` records the estimated
+    tokens of the candidates ("input") and of the packed result ("output").
+    """
+
+    def __init__(self, token_budget=1200, mmr_lambda=0.7, duplicate_threshold=0.8, min_fragment_tokens=32):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.min_fragment_tokens = min_fragment_tokens
+        self.stats = LatencyStats(unit="tokens")
+
+    @staticmethod
+    def _merge_neighbours(docs):
+        """[(text, rank)] with runs of consecutive chunk_index per doc_id joined; keeps the best rank."""
+        groups = {}
+        loose = []
+        for rank, doc in enumerate(docs):
+            index = doc.get("metadata", {}).get("chunk_index")
+            if doc.get("doc_id") is None or index is None:
+                loose.append((doc["chunk"], rank))
+            else:
+                groups.setdefault(doc["doc_id"], {}).setdefault(index, (doc["chunk"], rank))
+
+        merged = list(loose)
+        for chunks in groups.values():
+            run_text, run_rank, previous = None, None, None
+            for index in sorted(chunks):
+                text, rank = chunks[index]
+                if previous is not None and index == previous + 1:
+                    run_text, run_rank = _join(run_text, text), min(run_rank, rank)
+                else:
+                    if run_text is not None:
+                        merged.append((run_text, run_rank))
+                    run_text, run_rank = text, rank
+                previous = index
+            merged.append((run_text, run_rank))
+        return sorted(merged, key=lambda item: item[1])
+
+    @staticmethod
+    def _candidates(kind, texts):
+        n = len(texts)
+        return [
+            {"kind": kind, "text": text, "terms": _terms(text), "relevance": 1.0 - i / n}
+            for i, text in enumerate(texts)
+        ]
+
+    def _mmr(self, item, chosen_terms):
+        """(MMR score, highest similarity to an already picked item)."""
+        redundancy = max((_similarity(item["terms"], terms) for terms in chosen_terms), default=0.0)
+        return self.mmr_lambda * item["relevance"] - (1 - self.mmr_lambda) * redundancy, redundancy
+
+    @staticmethod
+    def _cut(text, tokens):
+        cut = text[:tokens * 4]
+        space = cut.rfind(" ")
+        return (cut[:space] if space > 0 else cut) + " …"
+
+    def select(self, doc_texts, chat_texts, top_k):
+        """MMR-pick documents and conversations under the budget; returns the kept texts of each."""
+        pool = self._candidates("doc", doc_texts) + self._candidates("chat", chat_texts)
+        picked = {"doc": [], "chat": []}
+        chosen_terms = []
+        # Room for the section headers and numbering _format_results adds
+        budget = self.token_budget - 32
+        while pool and budget > 0:
+            (_, redundancy), best = max(
+                ((self._mmr(item, chosen_terms), item) for item in pool), key=lambda scored: scored[0][0]
+            )
+            pool.remove(best)
+            if redundancy >= self.duplicate_threshold or len(picked[best["kind"]]) >= top_k:
+                continue
+            tokens = approx_tokens(best["text"]) + 8
+            text = best["text"]
+            if tokens > budget:
+                if budget < self.min_fragment_tokens:
+                    break
+                text, tokens = self._cut(text, budget - 8), budget
+            picked[best["kind"]].append(text)
+            chosen_terms.append(best["terms"])
+            budget -= tokens
+        return picked["doc"], picked["chat"]
+
+    def pack(self, docs, chat_texts, top_k, format_results):
+        """`docs` are fused chunk documents, `chat_texts` formatted turns; returns the rag_search text."""
+        doc_texts = [text for text, _ in self._merge_neighbours(docs)]
+        unpacked = format_results([doc["chunk"] for doc in docs], chat_texts, len(docs) + len(chat_texts))
+        packed = format_results(*self.select(doc_texts, chat_texts, top_k), top_k)
+        self.stats.observe("input", approx_tokens(unpacked))
+        self.stats.observe("output", approx_tokens(packed))
+        return packed
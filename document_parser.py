@@ -0,0 +1,189 @@
+import codecs
+import itertools
+import os
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+
+# Plain text and docx are split in blocks of about this many characters, cut at a paragraph break
+TEXT_BLOCK_CHARS = 64 * 1024
+
+_PDF_INHERITED = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def is_supported(filename):
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def text_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500,
+        chunk_overlap=50,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+
+def _pdf_pages(reader, node=None, inherited=None, reference=None):
+    """
+    Leaf pages of the page tree, one at a time. `reader.pages` builds a page
+    object for every page up front, and the reader caches every object it
+    resolves; here each page is built when it is reached and the cache is
+    emptied after it, so only the current page is held.
+    """
+    from PyPDF2 import PageObject
+    from PyPDF2.generic import IndirectObject
+
+    if node is None:
+        node, inherited = reader.trailer["/Root"]["/Pages"], {}
+    if node.get("/Type", "/Pages") == "/Pages":
+        inherited = {**inherited, **{attr: node[attr] for attr in _PDF_INHERITED if attr in node}}
+        for kid in node["/Kids"]:
+            reference = kid if isinstance(kid, IndirectObject) else None
+            yield from _pdf_pages(reader, kid.get_object(), inherited, reference)
+    else:
+        page = PageObject(reader, reference)
+        page.update(inherited)
+        page.update(node)
+        yield page
+        reader.resolved_objects.clear()
+
+
+def _read_text(path, start=0, end=None, size=TEXT_BLOCK_CHARS):
+    """Decoded text of bytes [start, end) of a UTF-8 file, `size` bytes at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    with open(path, "rb") as f:
+        f.seek(start)
+        while data := f.read(size if end is None else min(size, end - f.tell())):
+            yield decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+
+def _text_blocks(pieces):
+    """Contiguous blocks of the text in `pieces`, each cut at its last paragraph break (else line or word break)."""
+    tail = ""
+    for data in pieces:
+        if not data:
+            continue
+        text = tail + data
+        for sep in ("\n\n", "\n", " "):
+            cut = text.rfind(sep, len(text) // 2)
+            if cut > 0:
+                break
+        else:
+            cut = len(text)
+        yield text[:cut]
+        tail = text[cut:]
+    if tail:
+        yield tail
+
+
+def _paragraph_blocks(paragraphs, size=TEXT_BLOCK_CHARS):
+    block, length = [], 0
+    for paragraph in paragraphs:
+        block.append(paragraph)
+        length += len(paragraph) + 1
+        if length >= size:
+            yield "\n".join(block) + "\n"
+            block, length = [], 0
+    if block:
+        yield "\n".join(block)
+
+
+def iter_sections(filename, path, part=None):
+    """
+    The text of the file at `path`, one section at a time: (page number, text)
+    for every PDF page, (None, block of paragraphs) for plain text and docx.
+    `part` limits it to one of the ranges `plan_parts` returns.
+    """
+    filename_lower = filename.lower()
+
+    if filename_lower.endswith(".txt"):
+        start, end = part or (0, None)
+        for block in _text_blocks(_read_text(path, start, end)):
+            yield None, block
+    elif filename_lower.endswith(".pdf"):
+        from PyPDF2 import PdfReader
+        start, stop = part or (0, None)
+        with open(path, "rb") as f:
+            pages = itertools.islice(enumerate(_pdf_pages(PdfReader(f)), start=1), start, stop)
+            for number, page in pages:
+                yield number, page.extract_text() or ""
+    elif filename_lower.endswith(".docx"):
+        # python-docx parses the whole document; only its text is passed on in blocks
+        from docx import Document
+        for block in _paragraph_blocks(para.text for para in Document(path).paragraphs):
+            yield None, block
+    else:
+        raise ValueError("Unsupported file type.")
+
+
+def _text_parts(path, part_bytes):
+    """Byte ranges of about `part_bytes`, each ending at a paragraph (else line or word) break."""
+    size = os.path.getsize(path)
+    parts = []
+    start = 0
+    with open(path, "rb") as f:
+        while size - start > part_bytes:
+            f.seek(start + part_bytes)
+            window = f.read(TEXT_BLOCK_CHARS)
+            # The separators are ASCII, so cutting after one never splits a UTF-8 sequence
+            cuts = [window.find(sep) + len(sep) for sep in (b"\n\n", b"\n", b" ") if sep in window]
+            if not cuts:
+                break
+            end = start + part_bytes + cuts[0]
+            parts.append((start, end))
+            start = end
+    parts.append((start, size))
+    return parts
+
+
+def plan_parts(filename, path, pages_per_part=25, part_bytes=1024 * 1024):
+    """
+    (page count, parts) for extracting the file at `path` in independent pieces:
+    page ranges for a PDF, byte ranges cut at paragraph breaks for plain text,
+    and the whole document for docx. The page count is None except for PDFs.
+    """
+    filename_lower = filename.lower()
+    if filename_lower.endswith(".pdf"):
+        from PyPDF2 import PdfReader
+        with open(path, "rb") as f:
+            pages = int(PdfReader(f).trailer["/Root"]["/Pages"]["/Count"])
+        return pages, [(start, min(start + pages_per_part, pages)) for start in range(0, pages, pages_per_part)]
+    if filename_lower.endswith(".txt"):
+        return None, _text_parts(path, part_bytes)
+    return None, [None]
+
+
+def part_chunks(filename, path, part=None):
+    """Chunks of one part of the file, as a list (what extraction worker processes return)."""
+    return list(iter_chunks(iter_sections(filename, path, part)))
+
+
+def iter_chunks(sections, splitter=None):
+    """
+    Split sections into chunks as they are read. A PDF page is split on its own,
+    so no chunk runs across a page break. Blocks of plain text follow on from
+    each other: the last chunk of a block is held back and split again with the
+    start of the next one, so block boundaries do not cut chunks short.
+    """
+    splitter = splitter or text_splitter()
+    carry = ""
+    for page, text in sections:
+        if page is not None:
+            yield from splitter.split_text(text)
+            continue
+        text = carry + text
+        chunks = splitter.split_text(text)
+        carry = ""
+        if chunks:
+            # The held-back chunk keeps its original text, separators included, unless
+            # the splitter changed its whitespace so it is no longer found verbatim
+            start = text.rfind(chunks[-1])
+            carry = text[start:] if start != -1 else chunks[-1]
+            yield from chunks[:-1]
+    if carry:
+        yield from splitter.split_text(carry)
+
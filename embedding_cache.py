@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from langchain_core.embeddings import Embeddings
+from pymongo import UpdateOne
+
+from tracing import span
+from vector_codec import decode_vector, encode_vector
+
+
+logger = logging.getLogger("app")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an embedding model.
+
+    Vectors are keyed by sha256(model name, task, text): Gemini embeds queries and
+    documents with different task types, so the same text yields a different vector
+    for each. Lookups go to an in-process LRU first, then to a Mongo collection shared
+    by every worker, and only the remaining texts are sent to the wrapped model.
+    """
+
+    def __init__(self, embeddings, collection=None, async_collection=None,
+                 max_entries=10_000, ttl_seconds=30 * 24 * 3600, model_name=None):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", type(embeddings).__name__)
+        self.collection = collection
+        self.async_collection = async_collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_ready = False
+        self._async_index_ready = False
+        self._pending_writes = set()
+        self._stats = {"memory_hits": 0, "store_hits": 0, "misses": 0, "evictions": 0, "store_errors": 0}
+
+    def __getattr__(self, name):
+        # Behave like the wrapped model for anything we don't override (model, task_type, ...)
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def key(self, text, task="document"):
+        return hashlib.sha256(f"{self.model_name}\0{task}\0{text}".encode("utf-8")).hexdigest()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._memory), max_entries=self.max_entries)
+        lookups = stats["memory_hits"] + stats["store_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["store_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    # === In-process LRU tier ===
+
+    def _memory_get(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self._stats["memory_hits"] += len(found)
+        return found
+
+    def _memory_put(self, items):
+        with self._lock:
+            for key, vector in items.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    # === Persistent Mongo tier ===
+    # Vectors are stored as packed float32; entries written as arrays are still read.
+
+    def _store_ops(self, items):
+        now = datetime.utcnow()
+        return [
+            UpdateOne(
+                {"_id": key},
+                {"$setOnInsert": {"model": self.model_name, "embedding": encode_vector(vector), "created_at": now}},
+                upsert=True,
+            )
+            for key, vector in items.items()
+        ]
+
+    def _store_get(self, keys):
+        if self.collection is None or not keys:
+            return {}
+        try:
+            found = {doc["_id"]: decode_vector(doc["embedding"]).tolist() for doc in self.collection.find({"_id": {"$in": keys}})}
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            self._stats["store_errors"] += 1
+            return {}
+        with self._lock:
+            self._stats["store_hits"] += len(found)
+        return found
+
+    def _store_put(self, items):
+        if self.collection is None or not items:
+            return
+        try:
+            if not self._index_ready:
+                # Mongo's TTL monitor evicts entries once they are older than ttl_seconds
+                self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+                self._index_ready = True
+            self.collection.bulk_write(self._store_ops(items), ordered=False)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+            self._stats["store_errors"] += 1
+
+    async def _astore_get(self, keys):
+        if self.async_collection is None or not keys:
+            return {}
+        try:
+            docs = await self.async_collection.find({"_id": {"$in": keys}}).to_list()
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            self._stats["store_errors"] += 1
+            return {}
+        with self._lock:
+            self._stats["store_hits"] += len(docs)
+        return {doc["_id"]: decode_vector(doc["embedding"]).tolist() for doc in docs}
+
+    async def _astore_put(self, items):
+        if self.async_collection is None or not items:
+            return
+        try:
+            if not self._async_index_ready:
+                await self.async_collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+                self._async_index_ready = True
+            await self.async_collection.bulk_write(self._store_ops(items), ordered=False)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+            self._stats["store_errors"] += 1
+
+    # === Embeddings interface ===
+
+    def _plan(self, texts, task):
+        keys = [self.key(text, task) for text in texts]
+        found = self._memory_get(list(dict.fromkeys(keys)))
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        return keys, found, missing
+
+    def _texts_for(self, texts, keys, missing):
+        by_key = dict(zip(keys, texts))
+        return [by_key[key] for key in missing]
+
+    def _finish(self, keys, found, stored, computed):
+        with self._lock:
+            self._stats["misses"] += len(computed)
+        self._memory_put(stored)
+        self._memory_put(computed)
+        found.update(stored)
+        found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    async def aembed_documents(self, texts):
+        return await self._aembed(texts, "document", self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text):
+        async def embed(texts):
+            return [await self.embeddings.aembed_query(texts[0])]
+        return (await self._aembed([text], "query", embed))[0]
+
+    def embed_queries(self, texts):
+        """embed_query for many texts, with the cache misses sent to the model in one embed_documents call."""
+        return self._embed(texts, "query", lambda missing: self.embeddings.embed_documents(missing, task_type="RETRIEVAL_QUERY"))
+
+    async def aembed_queries(self, texts):
+        # The Gemini embeddings have no async batch call that takes a task type
+        async def embed(missing):
+            return await asyncio.to_thread(self.embeddings.embed_documents, missing, task_type="RETRIEVAL_QUERY")
+        return await self._aembed(texts, "query", embed)
+
+    def _embed(self, texts, task, embed):
+        keys, found, missing = self._plan(texts, task)
+        stored = self._store_get(missing)
+        missing = [key for key in missing if key not in stored]
+        computed = {}
+        if missing:
+            with span(f"embed_{task}", "embedding", model=self.model_name, texts=len(missing)):
+                computed = dict(zip(missing, embed(self._texts_for(texts, keys, missing))))
+            self._store_put(computed)
+        return self._finish(keys, found, stored, computed)
+
+    async def _aembed(self, texts, task, embed):
+        keys, found, missing = self._plan(texts, task)
+        stored = await self._astore_get(missing)
+        missing = [key for key in missing if key not in stored]
+        computed = {}
+        if missing:
+            with span(f"embed_{task}", "embedding", model=self.model_name, texts=len(missing)):
+                computed = dict(zip(missing, await embed(self._texts_for(texts, keys, missing))))
+            # Write-back is off the request path; the vectors are already in the LRU
+            write = asyncio.create_task(self._astore_put(computed))
+            self._pending_writes.add(write)
+            write.add_done_callback(self._pending_writes.discard)
+        return self._finish(keys, found, stored, computed)
@@ -0,0 +1,183 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from metrics import LatencyStats, registry
+
+
+extraction_kills = registry.counter(
+    "extraction_worker_kills_total", "Extraction worker processes killed on a timeout or a cancelled upload."
+)
+
+
+WORKER_EXITED = "the extraction worker exited"
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def _serve(conn, nice):
+    """Worker process loop: run (function, args) requests until the pipe closes."""
+    # Background work: where cores are scarce the server process is scheduled first
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, fn(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+def _receive(conn, timeout):
+    """(ok, result) from the worker, or None if it has not answered within `timeout` seconds."""
+    try:
+        if not conn.poll(timeout):
+            return None
+        return conn.recv()
+    except (EOFError, OSError):
+        return False, WORKER_EXITED
+
+
+class _Worker:
+    def __init__(self, context, nice):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, nice), daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """
+    Parses and splits uploads in worker processes, so PyPDF2 and python-docx
+    never hold the GIL the event loop needs.
+
+    A PDF is extracted in page ranges of `pages_per_part` and a text file in byte
+    ranges of about `part_bytes` cut at paragraph breaks; up to `workers` parts
+    of a file run at once and their chunks are yielded in order, with no part
+    started further ahead than that while the caller is busy. A PDF of more than
+    `max_pages` pages is refused. Each file gets `timeout` seconds of worker time:
+    a part still running when that is spent, or whose upload is cancelled, has
+    its process killed and replaced. Workers run at `nice` lower priority.
+    `workers=0` extracts in a thread instead, where the timeout can only be
+    noticed between parts.
+    """
+
+    def __init__(self, workers=2, timeout=300.0, max_pages=2000, pages_per_part=25, part_bytes=256 * 1024, nice=10):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.pages_per_part = pages_per_part
+        self.part_bytes = part_bytes
+        self.nice = nice
+        self.stats = LatencyStats()
+        # spawn, not fork: the parent has Mongo clients and executor threads a fork would copy mid-flight
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = []
+        self._slots = asyncio.Semaphore(max(workers, 1))
+
+    async def start(self):
+        self._idle = [await self._spawn() for _ in range(self.workers)]
+
+    async def stop(self):
+        for worker in self._idle:
+            worker.kill()
+        self._idle = []
+
+    async def _spawn(self):
+        return await asyncio.to_thread(_Worker, self._context, self.nice)
+
+    async def _send(self, request):
+        """
+        A worker that took `request`. An idle worker that died since its last job
+        (killed, OOM) had nothing in flight, so it is replaced and the request is
+        sent once more, to a fresh worker.
+        """
+        worker = self._idle.pop() if self._idle else await self._spawn()
+        for retry in (True, False):
+            error = "not running"
+            if worker.process.is_alive():
+                try:
+                    worker.conn.send(request)
+                    return worker
+                except OSError as e:
+                    # BrokenPipeError and the like: it exited after the check
+                    error = type(e).__name__
+            worker.kill()
+            if not retry:
+                raise ExtractionError(f"{WORKER_EXITED} ({error})")
+            worker = await self._spawn()
+
+    async def _run(self, budget, fn, *args):
+        """Run fn(*args) on a worker within what is left of the file's `budget` ([seconds])."""
+        async with self._slots:
+            if budget[0] <= 0:
+                raise ExtractionError(f"Extraction took longer than {self.timeout:g}s.")
+            started = time.perf_counter()
+            if not self.workers:
+                reply = True, await asyncio.to_thread(fn, *args)
+            else:
+                worker = await self._send((fn, args))
+                reply = None
+                answered = False
+                try:
+                    reply = await asyncio.to_thread(_receive, worker.conn, budget[0])
+                    answered = reply is not None and reply[1] != WORKER_EXITED
+                finally:
+                    if answered and worker.process.is_alive():
+                        self._idle.append(worker)
+                    else:
+                        # Out of time, cancelled or exited: the process may be stuck mid-parse
+                        # or already gone, so it is replaced rather than handed the next part
+                        if reply is None:
+                            extraction_kills.inc()
+                        worker.kill()
+            elapsed = time.perf_counter() - started
+            budget[0] -= elapsed
+            self.stats.observe(fn.__name__, elapsed * 1000)
+        if reply is None:
+            raise ExtractionError(f"Extraction took longer than {self.timeout:g}s.")
+        ok, result = reply
+        if not ok:
+            raise ExtractionError(result)
+        return result
+
+    async def chunks(self, filename, path):
+        """Chunks of the file at `path`, in order, extracted part by part in the worker processes."""
+        # Imported here so a worker process only loads the parsers once it runs at its lower priority
+        from document_parser import part_chunks, plan_parts
+
+        budget = [self.timeout]
+        pages, parts = await self._run(budget, plan_parts, filename, path, self.pages_per_part, self.part_bytes)
+        if pages is not None and self.max_pages and pages > self.max_pages:
+            raise ExtractionError(f"{filename} has {pages} pages, the limit is {self.max_pages}.")
+
+        parts = iter(parts)
+        ahead = deque()
+
+        def start_more():
+            for part in itertools.islice(parts, max(self.workers, 1) - len(ahead)):
+                ahead.append(asyncio.create_task(self._run(budget, part_chunks, filename, path, part)))
+
+        try:
+            start_more()
+            while ahead:
+                chunks = await ahead.popleft()
+                start_more()
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            for task in ahead:
+                task.cancel()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from uuid import uuid4
+
+from extraction import ExtractionPool
+
+
+logger = logging.getLogger("app")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class IngestionJobs:
+    """
+    Bounded pool of asyncio workers that parse, embed and store uploads in the
+    background. Job state lives in memory and is polled through /upload/{job_id}.
+
+    Uploads are spooled to files in `spool_dir` while they wait, and parsed and
+    split by `extraction` (an ExtractionPool) a part at a time, so neither a queued
+    nor a running upload is held in memory and parsing stays off the event loop.
+
+    `get_bot` is awaited for the Gemini wrapper when a job starts, so uploads
+    can be accepted while the services are still warming up.
+    """
+
+    def __init__(self, get_bot, workers=2, max_queued=100, max_finished=1000, spool_dir=None, extraction=None):
+        self.get_bot = get_bot
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self.spool_dir = spool_dir
+        self.extraction = extraction or ExtractionPool()
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+        self._running = {}
+
+    async def start(self):
+        await self.extraction.start()
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Uploads still queued are lost with the in-memory job table; drop their spool files too
+        while not self._queue.empty():
+            _, path = self._queue.get_nowait()
+            os.remove(path)
+        await self.extraction.stop()
+
+    async def submit(self, filename, upload):
+        """Spool the binary file object `upload` to disk and queue it."""
+        if self._queue.full():
+            raise QueueFullError("Ingestion queue is full, retry later.")
+        path = await asyncio.to_thread(self._spool, filename, upload)
+        job = {
+            "job_id": str(uuid4()),
+            "filename": filename,
+            "status": "queued",
+            "chunks_total": None,
+            "chunks_done": 0,
+            "added": None,
+            "reused": None,
+            "removed": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        try:
+            self._queue.put_nowait((job, path))
+        except asyncio.QueueFull:
+            os.remove(path)
+            raise QueueFullError("Ingestion queue is full, retry later.")
+        self.jobs[job["job_id"]] = job
+        return job
+
+    def _spool(self, filename, upload):
+        with tempfile.NamedTemporaryFile(dir=self.spool_dir, suffix=os.path.splitext(filename)[1], delete=False) as f:
+            shutil.copyfileobj(upload, f, 1024 * 1024)
+        return f.name
+
+    def status(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job (killing its extraction); returns the job, or None if unknown."""
+        job = self.jobs.get(job_id)
+        if job is None or job["finished_at"] is not None:
+            return job
+        job["status"] = "cancelled"
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            # Still queued: the worker that picks it up only drops its spool file
+            job["finished_at"] = time.time()
+        return job
+
+    async def _worker(self):
+        while True:
+            job, path = await self._queue.get()
+            try:
+                if job["status"] == "queued":
+                    task = self._running[job["job_id"]] = asyncio.create_task(self._process(job, path))
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        # A cancelled job is over; a cancelled worker (stop) is not
+                        if job["status"] != "cancelled" or not task.cancelled():
+                            raise
+                    finally:
+                        del self._running[job["job_id"]]
+            finally:
+                os.remove(path)
+                self._queue.task_done()
+                self._prune()
+
+    async def _process(self, job, path):
+        job["status"] = "processing"
+
+        def progress(done, total):
+            job["chunks_done"] = done
+            job["chunks_total"] = total
+
+        try:
+            bot = await self.get_bot()
+            chunks = self.extraction.chunks(job["filename"], path)
+            try:
+                # Use original filename, not lowercased
+                summary = await bot.aingest_chunks(chunks, doc_id=job["filename"], filename=job["filename"], progress=progress)
+            finally:
+                await chunks.aclose()
+            job.update({name: summary[name] for name in ("added", "reused", "removed")})
+            job["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Upload error: {e}")
+            job["status"] = "failed"
+            job["error"] = f"Error processing file: {str(e)}"
+        finally:
+            job["finished_at"] = time.time()
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job["finished_at"] is not None]
+        excess = len(finished) - self.max_finished
+        if excess > 0:
+            for job in sorted(finished, key=lambda job: job["finished_at"])[:excess]:
+                del self.jobs[job["job_id"]]
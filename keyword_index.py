@@ -0,0 +1,117 @@
+import heapq
+import math
+import re
+import threading
+
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in is it its me my of on or our she
+so that the their them they this to was we were what when where which who will with you your
+""".split())
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring.
+
+    A query only touches the posting lists of its own terms. Terms are scored
+    rarest first (MaxScore): once the k-th best score beats the most the
+    remaining terms could add, common terms only update documents that are
+    already candidates instead of walking their whole posting list.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_len = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, key, text):
+        key = str(key)
+        terms = tokenize(text)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            if key in self._doc_len:
+                self._remove(key)
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[key] = tf
+            self._doc_terms[key] = tuple(counts)
+            self._doc_len[key] = len(terms)
+            self._total_len += len(terms)
+
+    def add_many(self, items):
+        for key, text in items:
+            self.add(key, text)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(str(key))
+
+    def _remove(self, key):
+        if key not in self._doc_len:
+            return
+        for term in self._doc_terms.pop(key):
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(key)
+
+    def search(self, query, k=3):
+        """Return up to k (key, score) pairs, best first."""
+        with self._lock:
+            n = len(self._doc_len)
+            if not n:
+                return []
+            avgdl = self._total_len / n
+            k1, b = self.k1, self.b
+
+            terms = []
+            for term in dict.fromkeys(tokenize(query)):
+                postings = self._postings.get(term)
+                if postings:
+                    idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                    terms.append((idf, postings))
+            # Rarest (highest idf) first; idf * (k1 + 1) bounds what a term can add to any document
+            terms.sort(key=lambda t: -t[0])
+            remaining = [0.0] * (len(terms) + 1)
+            for i in range(len(terms) - 1, -1, -1):
+                remaining[i] = remaining[i + 1] + terms[i][0] * (k1 + 1)
+
+            scores = {}
+            doc_len = self._doc_len
+            for i, (idf, postings) in enumerate(terms):
+                if len(scores) >= k and heapq.nlargest(k, scores.values())[-1] > remaining[i] and len(scores) < len(postings):
+                    # No unseen document can reach the top k any more
+                    for key in scores:
+                        tf = postings.get(key)
+                        if tf:
+                            scores[key] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[key] / avgdl))
+                    continue
+                for key, tf in postings.items():
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[key] / avgdl))
+
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def build_keyword_index(collection, fields, batch_size=5000):
+    """Index every document in `collection`, joining the text of `fields`."""
+    index = BM25Index()
+    projection = {field: 1 for field in fields}
+    for doc in collection.find({}, projection).batch_size(batch_size):
+        index.add(doc["_id"], " ".join(str(doc.get(field, "")) for field in fields))
+    return index
@@ -1,14 +1,32 @@
 import os
+import re
+import asyncio
+import logging
+import hashlib
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from bson import ObjectId
+from pymongo import UpdateOne, DeleteMany
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from tavily import TavilyClient
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from uuid import uuid4
 from langchain_core.messages import SystemMessage
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.messages import SystemMessage
-from datetime import datetime
+from datetime import datetime, timedelta
+from admission import AdmittedEmbeddings
+from embedding_cache import CachedEmbeddings
+from vector_index import INDEX_TYPES, load_vector_index
+from retrieval_cache import RetrievalCache
+from keyword_index import BM25Index, build_keyword_index
+from metrics import LatencyStats
+from chat_writer import ChatHistoryWriter
+from context_packer import ContextPacker
+from document_parser import text_splitter
+from vector_codec import FORMATS as EMBEDDING_FORMATS, decode_vector, encode_vector
+from tracing import span, submit
 
 
 
@@ -16,17 +34,13 @@ from datetime import datetime
 
 load_dotenv()
 
-uri = os.getenv("MONGODB_URI")
-client = MongoClient(uri)
-db = client["RAG-cluster"]
-document_collection = db["document_chunks"]
-chat_history = db["chat_history"]
+# Heads the user's own past turns in rag_search output; a reply built on them is not shared between users
+CHAT_HISTORY_FOUND = "=== RELEVANT CHAT HISTORY ==="
 
-try:
-    client.admin.command("ping")
-    print("Connected to MongoDB!")
-except Exception as e:
-    print("MongoDB connection failed:", e)
+logger = logging.getLogger("app")
+
+# Runs the retrieval stages of the sync hybrid_search side by side
+retrieval_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
 
 system_prompt = """
 You are a smart assistant with access to two tools:
@@ -44,11 +58,22 @@ Always try rag_search FIRST if the user is asking about uploaded documents or pr
 Only use TavilySearch if rag_search doesn't find relevant information and you need external data.
 
 When you find relevant information from rag_search, use it to answer the user's question directly.
+
+The recent turns of this conversation are included above. Answer follow-up questions about them
+directly, without calling a tool; use rag_search for conversations that are not shown.
 """
 
 
 class Gemini:
-    def __init__(self):
+    # Chunk fields retrieval reads: the text, plus what the context packer needs to merge neighbours
+    CHUNK_FIELDS = {"chunk": 1, "doc_id": 1, "metadata.chunk_index": 1}
+
+    def __init__(self, db=None, async_db=None, admission=None):
+        # `db` / `async_db` are the "RAG-cluster" databases; default to the shared service clients
+        if db is None or async_db is None:
+            from services import services
+            db, async_db = services.db, services.async_db
+
         google_api = os.getenv("GOOGLE_API_KEY")
 
         self.model = ChatGoogleGenerativeAI(
@@ -56,169 +81,891 @@ class Gemini:
             google_api_key=google_api
             )
         
-        self.embedding_model = GoogleGenerativeAIEmbeddings(
+        embeddings = GoogleGenerativeAIEmbeddings(
             model="models/embedding-001",  
             google_api_key=google_api
         )
+        # Cache misses queue for Gemini with the chat model's calls: queries ahead of upload batches
+        if admission is not None:
+            embeddings = AdmittedEmbeddings(embeddings, admission)
+
+        # Identical questions and re-uploaded text reuse their stored vectors
+        self.embedding_model = CachedEmbeddings(
+            embeddings,
+            collection=db["embedding_cache"],
+            async_collection=async_db["embedding_cache"],
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+            ttl_seconds=int(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600))),
+        )
+
+        self.doc_collection = db["document_chunks"]
+        self.chat_history_collection = db["chat_history"]
+        self.async_doc_collection = async_db["document_chunks"]
+        self.async_chat_history_collection = async_db["chat_history"]
+
+        # Chunks are upserted by (doc_id, chunk_hash); the index keeps re-ingestion a keyed lookup
+        try:
+            self.doc_collection.create_index(
+                [("doc_id", 1), ("chunk_hash", 1)],
+                unique=True,
+                partialFilterExpression={"chunk_hash": {"$exists": True}},
+            )
+        except Exception as e:
+            logger.warning(f"Could not create the chunk hash index: {e}")
 
-        self.doc_collection = document_collection
-        self.chat_history_collection = chat_history
+        # Chat-history search only looks at the asking user's turns of the last CHAT_HISTORY_WINDOW_DAYS
+        # days (0: all of them); this index serves that pre-filter, newest first
+        self.chat_window_days = float(os.getenv("CHAT_HISTORY_WINDOW_DAYS", "30"))
+        self.chat_window_turns = int(os.getenv("CHAT_HISTORY_WINDOW_TURNS", "500"))
+        try:
+            self.chat_history_collection.create_index([("user_id", 1), ("timestamp", -1)])
+        except Exception as e:
+            logger.warning(f"Could not create the chat history index: {e}")
+
+        # VECTOR_INDEX=exact|ivf serves vector search from an in-process index
+        # instead of the Atlas knnBeta operator (self-hosted or local Mongo)
+        self.vector_index = None
+        self.vector_index_path = os.getenv("VECTOR_INDEX_PATH", "vector_index.npz")
+        vector_index = os.getenv("VECTOR_INDEX", "atlas").lower()
+        if vector_index != "atlas" and vector_index not in INDEX_TYPES:
+            raise ValueError(f"VECTOR_INDEX must be one of {('atlas', *INDEX_TYPES)}, got {vector_index!r}")
+        if vector_index != "atlas":
+            self.vector_index = load_vector_index(vector_index, self.vector_index_path, self.doc_collection)
+
+        # Chunk embeddings are written as packed float32 (or int8) BSON vectors; Atlas knnBeta
+        # only reads arrays, so that stays the default there. migrate_embeddings converts stored chunks.
+        self.embedding_format = os.getenv("EMBEDDING_FORMAT", "array" if vector_index == "atlas" else "float32").lower()
+        if self.embedding_format not in EMBEDDING_FORMATS:
+            raise ValueError(f"EMBEDDING_FORMAT must be one of {EMBEDDING_FORMATS}, got {self.embedding_format!r}")
+
+        # CHAT_EMBEDDINGS=on embeds chat turns when they are flushed, so past
+        # conversations are found by meaning and not only by shared words
+        self.embed_chat_history = os.getenv("CHAT_EMBEDDINGS", "off").lower() == "on"
+
+        # A BM25 index over chunk text serves keyword search when Atlas Search is unavailable
+        # (KEYWORD_INDEX=off falls back to an escaped regex scan). Chat history needs no kept
+        # index: a search only reads the asking user's window of turns, ranked per query.
+        self.keyword_index = None
+        self.rank_chat_windows = os.getenv("KEYWORD_INDEX", "on").lower() != "off"
+        if self.rank_chat_windows:
+            self.keyword_index = build_keyword_index(self.doc_collection, ["chunk"])
+            logger.info(f"Keyword index built: {len(self.keyword_index)} chunks.")
+
+        # Bumped whenever document chunks change, so answer caches can drop stale entries
+        self.documents_version = 0
+
+        # The indexes above and documents_version only follow this process's ingests
+        if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            logger.warning(
+                "WEB_CONCURRENCY > 1: the in-process keyword and vector indexes and the response cache only see"
+                " this worker's ingests; run one worker or turn them off (see 'Running Several Workers' in README.md)."
+            )
+
+        # hybrid_search results, dropped as soon as the chunks or chat turns they searched change
+        # (RETRIEVAL_CACHE=off disables; RETRIEVAL_CACHE_PATH shares them between workers on a host)
+        self.retrieval_cache = None
+        if os.getenv("RETRIEVAL_CACHE", "on").lower() != "off":
+            self.retrieval_cache = RetrievalCache(
+                path=os.getenv("RETRIEVAL_CACHE_PATH") or None,
+                ttl_seconds=float(os.getenv("RETRIEVAL_CACHE_TTL", "600")),
+                max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000")),
+            )
+
+        # Per-source deadline for hybrid_search: a slow source is dropped, not waited on
+        self.retrieval_timeout = float(os.getenv("RETRIEVAL_TIMEOUT", "3.0"))
+        self.retrieval_stats = LatencyStats()
+
+        # rag_search output is deduplicated, merged and cut to CONTEXT_TOKEN_BUDGET (CONTEXT_PACKING=off
+        # returns the top_k chunks and conversations verbatim)
+        self.context_packer = None
+        self.context_candidates = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+        if os.getenv("CONTEXT_PACKING", "on").lower() != "off":
+            self.context_packer = ContextPacker(
+                token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200")),
+                mmr_lambda=float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7")),
+            )
+
+        # Background ingestion sends chunks to the embedding API in capped batches
+        self.embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+        self.embed_concurrency = int(os.getenv("EMBED_CONCURRENCY", "4"))
+        self.embed_retries = int(os.getenv("EMBED_RETRIES", "3"))
+
+        # Chat turns are journaled and written in batches instead of one insert per reply
+        self.chat_writer = ChatHistoryWriter(
+            self.async_chat_history_collection,
+            journal_path=os.getenv("CHAT_JOURNAL_PATH", "chat_history.journal"),
+            max_batch=int(os.getenv("CHAT_FLUSH_BATCH", "50")),
+            flush_interval=float(os.getenv("CHAT_FLUSH_INTERVAL", "1.0")),
+            embed=self.embedding_model.aembed_documents if self.embed_chat_history else None,
+            on_flushed=self._achats_flushed,
+            max_pending=int(os.getenv("CHAT_MAX_PENDING", "10000")),
+            full_timeout=float(os.getenv("CHAT_FULL_TIMEOUT", "5.0")),
+        )
     
 
+    @staticmethod
+    def _split(text):
+        return text_splitter().split_text(text)
+
+    @staticmethod
+    def _chunk_hash(chunk):
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def _index_stored(self, stored):
+        """Stored chunks of a document by content hash, and the _ids of extra copies of a hash."""
+        by_hash = {}
+        duplicates = []
+        for doc in stored:
+            # Chunks stored before hashing get their hash computed (and saved) here
+            chunk_hash = doc.get("chunk_hash") or self._chunk_hash(doc.get("chunk", ""))
+            if chunk_hash in by_hash:
+                duplicates.append(doc["_id"])
+            else:
+                by_hash[chunk_hash] = doc
+        return by_hash, duplicates
+
+    @staticmethod
+    def _reuse_update(doc, chunk_hash, idx, filename):
+        """UpdateOne for a kept chunk whose hash field, position or filename changed; None if nothing did."""
+        metadata = doc.get("metadata", {})
+        if doc.get("chunk_hash") == chunk_hash and metadata.get("chunk_index") == idx and metadata.get("filename") == filename:
+            return None
+        return UpdateOne({"_id": doc["_id"]}, {"$set": {
+            "chunk_hash": chunk_hash,
+            "metadata.chunk_index": idx,
+            "metadata.filename": filename,
+        }})
+
+    def _plan_ingest(self, filename, chunks, stored):
+        """
+        Diff a document's new chunks against its stored ones, by content hash.
+
+        Returns (new, updates, removed, reused): the (index, chunk, hash) triples
+        that need embedding, UpdateOne ops for kept chunks whose position or
+        filename changed, the _ids of stored chunks that are gone (or duplicates),
+        and how many stored chunks are kept as they are.
+        """
+        wanted = {}
+        for idx, chunk in enumerate(chunks):
+            wanted.setdefault(self._chunk_hash(chunk), (idx, chunk))
+
+        by_hash, removed = self._index_stored(stored)
+        removed += [doc["_id"] for chunk_hash, doc in by_hash.items() if chunk_hash not in wanted]
+        kept = {chunk_hash: doc for chunk_hash, doc in by_hash.items() if chunk_hash in wanted}
+        updates = [
+            update for chunk_hash, doc in kept.items()
+            if (update := self._reuse_update(doc, chunk_hash, wanted[chunk_hash][0], filename)) is not None
+        ]
+
+        new = [(idx, chunk, chunk_hash) for chunk_hash, (idx, chunk) in wanted.items() if chunk_hash not in kept]
+        return new, updates, removed, len(kept)
+
+    def _chunk_upserts(self, doc_id, filename, new, vectors):
+        return [
+            UpdateOne(
+                {"doc_id": doc_id, "chunk_hash": chunk_hash},
+                {"$set": {
+                    "chunk": chunk,
+                    "embedding": encode_vector(vector, self.embedding_format),
+                    "metadata": {
+                        "chunk_index": idx,
+                        "filename": filename,
+                    }
+                }},
+                upsert=True,
+            )
+            for (idx, chunk, chunk_hash), vector in zip(new, vectors)
+        ]
+
+    @staticmethod
+    def _stored_chunks_queries(doc_id):
+        """(filter, projection) pairs for a document's stored chunks; the text is only read for chunks without a hash."""
+        return [
+            ({"doc_id": doc_id, "chunk_hash": {"$exists": True}}, {"chunk_hash": 1, "metadata": 1}),
+            ({"doc_id": doc_id, "chunk_hash": {"$exists": False}}, {"chunk": 1, "metadata": 1}),
+        ]
+
     def ingest_document(self, text, doc_id=None, filename=None):
+        """
+        Bring the stored chunks of `doc_id` in line with `text`: only new or changed
+        chunks are embedded, vanished ones are deleted, and everything is applied
+        as one bulk write. Returns the added / reused / removed chunk counts.
+        """
         if not doc_id:
             doc_id = str(uuid4())
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-    
-        
-        chunks = text_splitter.split_text(text)
-        vectors = self.embedding_model.embed_documents(chunks)
-
-        documents = [
-            {   
-                "doc_id": doc_id,
-                "chunk": chunk,
-                "embedding": vector,
-                "metadata": {
-                    "chunk_index": idx,
-                    "filename": filename,
-                }
-            }
-            for idx, (chunk, vector) in enumerate(zip(chunks, vectors))
-        ]
+        chunks = self._split(text)
+        stored = [doc for query, projection in self._stored_chunks_queries(doc_id) for doc in self.doc_collection.find(query, projection)]
+        new, updates, removed, reused = self._plan_ingest(filename, chunks, stored)
 
-        self.doc_collection.insert_many(documents)
-        print(f"Document '{filename or doc_id}' ingested successfully with {len(documents)} chunks.")
+        vectors = self.embedding_model.embed_documents([chunk for _, chunk, _ in new]) if new else []
+        upserts = self._chunk_upserts(doc_id, filename, new, vectors)
+        ops = upserts + updates + ([DeleteMany({"_id": {"$in": removed}})] if removed else [])
+        if ops:
+            result = self.doc_collection.bulk_write(ops, ordered=False)
+            self._chunks_changed(result.upserted_ids, new, vectors, removed)
+            if self.vector_index is not None:
+                self.vector_index.save(self.vector_index_path)
 
+        summary = {"chunks": len(chunks), "added": len(new), "reused": reused, "removed": len(removed)}
+        logger.info(f"Document '{filename or doc_id}' ingested: {summary}")
+        return summary
 
-    def ingest_response(self, user_query, response_text, user_id):
-        chat_entry = {
+    def _chunks_changed(self, upserted_ids, new, vectors, removed=()):
+        """Apply a chunk bulk write to the in-process indexes; `upserted_ids` maps op index -> _id."""
+        ids, rows = self._index_chunk_text(upserted_ids, new, removed)
+        self._index_chunk_vectors(ids, rows, vectors, removed)
+        if (ids or removed) and self.retrieval_cache is not None:
+            self.retrieval_cache.documents_changed()
+
+    async def _achunks_changed(self, upserted_ids, new, vectors, removed=()):
+        """
+        `_chunks_changed` for the event loop: the vector index update (an IVF
+        retrain is a full k-means) and the retrieval cache's version bump run on threads.
+        """
+        ids, rows = self._index_chunk_text(upserted_ids, new, removed)
+        if self.vector_index is not None and (ids or removed):
+            await asyncio.to_thread(self._index_chunk_vectors, ids, rows, vectors, removed)
+        if (ids or removed) and self.retrieval_cache is not None:
+            await self.retrieval_cache.adocuments_changed()
+
+    def _index_chunk_text(self, upserted_ids, new, removed):
+        """Update the keyword index and the documents version; returns the upserted _ids and their rows in `new`."""
+        rows = sorted(i for i in upserted_ids if i < len(new))
+        ids = [upserted_ids[i] for i in rows]
+        if self.keyword_index is not None:
+            for chunk_id in removed:
+                self.keyword_index.remove(chunk_id)
+            self.keyword_index.add_many((chunk_id, new[i][1]) for chunk_id, i in zip(ids, rows))
+        if ids or removed:
+            self.documents_version += 1
+        return ids, rows
+
+    def _index_chunk_vectors(self, ids, rows, vectors, removed):
+        if self.vector_index is not None:
+            if removed:
+                self.vector_index.remove(removed)
+            if ids:
+                self.vector_index.add(ids, [vectors[i] for i in rows])
+
+    async def _aembed_batch(self, texts):
+        """embed_documents with exponential backoff, so one flaky call doesn't fail the upload."""
+        for attempt in range(self.embed_retries):
+            try:
+                return await self.embedding_model.aembed_documents(texts)
+            except Exception as e:
+                if attempt == self.embed_retries - 1:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Embedding batch failed ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def aingest_document(self, text, doc_id=None, filename=None, progress=None):
+        """`aingest_chunks` for a text that is already in memory."""
+        chunks = await asyncio.to_thread(self._split, text)
+
+        async def aiter_chunks():
+            for chunk in chunks:
+                yield chunk
+
+        return await self.aingest_chunks(aiter_chunks(), doc_id=doc_id, filename=filename, progress=progress)
+
+    async def aingest_chunks(self, chunks, doc_id=None, filename=None, progress=None):
+        """
+        Async ingestion for background jobs, incremental like `ingest_document`,
+        reading the chunks from the async iterator `chunks` as they are produced.
+        New chunks are embedded in batches of `embed_batch_size`, at most
+        `embed_concurrency` at a time, and every batch is upserted as soon as it is
+        embedded so partial progress survives a failure. No more chunks are read
+        while that many batches are in flight, so memory stays bounded by the
+        batches and not by the document. Stored chunks that did not come up are
+        only deleted once every new one is stored. `progress(done, total)` is
+        called after each upserted batch, with reused chunks counted as done;
+        `total` is None until the last chunk has been read.
+        """
+        if not doc_id:
+            doc_id = str(uuid4())
+
+        stored = []
+        for query, projection in self._stored_chunks_queries(doc_id):
+            stored += await self.async_doc_collection.find(query, projection).to_list(None)
+        by_hash, removed = self._index_stored(stored)
+
+        seen = set()
+        updates = []
+        batch = []
+        pending = set()
+        count = done = 0
+        total = None
+        changed = False
+
+        def report():
+            if progress:
+                progress(done, total)
+
+        async def ingest_batch(batch):
+            nonlocal done, changed
+            vectors = await self._aembed_batch([chunk for _, chunk, _ in batch])
+            result = await self.async_doc_collection.bulk_write(
+                self._chunk_upserts(doc_id, filename, batch, vectors), ordered=False
+            )
+            await self._achunks_changed(result.upserted_ids, batch, vectors)
+            changed = True
+            done += len(batch)
+            report()
+
+        async def wait(return_when):
+            nonlocal pending
+            finished, pending = await asyncio.wait(pending, return_when=return_when)
+            for task in finished:
+                task.result()
+
+        try:
+            try:
+                async for chunk in chunks:
+                    idx, count = count, count + 1
+                    chunk_hash = self._chunk_hash(chunk)
+                    if chunk_hash in seen:
+                        continue
+                    seen.add(chunk_hash)
+                    if chunk_hash in by_hash:
+                        update = self._reuse_update(by_hash[chunk_hash], chunk_hash, idx, filename)
+                        if update is not None:
+                            updates.append(update)
+                        done += 1
+                        continue
+                    batch.append((idx, chunk, chunk_hash))
+                    if len(batch) >= self.embed_batch_size:
+                        if len(pending) >= self.embed_concurrency:
+                            await wait(asyncio.FIRST_COMPLETED)
+                        pending.add(asyncio.create_task(ingest_batch(batch)))
+                        batch = []
+                if batch:
+                    pending.add(asyncio.create_task(ingest_batch(batch)))
+                total = len(seen)
+                report()
+                if pending:
+                    await wait(asyncio.ALL_COMPLETED)
+            except BaseException:
+                for task in pending:
+                    task.cancel()
+                raise
+
+            removed += [doc["_id"] for chunk_hash, doc in by_hash.items() if chunk_hash not in seen]
+            ops = updates + ([DeleteMany({"_id": {"$in": removed}})] if removed else [])
+            if ops:
+                await self.async_doc_collection.bulk_write(ops, ordered=False)
+                await self._achunks_changed({}, [], [], removed)
+                changed = True
+        finally:
+            if self.vector_index is not None and changed:
+                await asyncio.to_thread(self.vector_index.save, self.vector_index_path)
+
+        reused = sum(chunk_hash in seen for chunk_hash in by_hash)
+        summary = {"chunks": count, "added": len(seen) - reused, "reused": reused, "removed": len(removed)}
+        logger.info(f"Document '{filename or doc_id}' ingested: {summary}")
+        return summary
+
+    def _chat_entry(self, user_query, response_text, user_id):
+        return {
             "user_id": user_id,
             "timestamp": datetime.utcnow(),
             "user_query": user_query,
             "response_text": response_text
         }
-        self.chat_history_collection.insert_one(chat_entry)
-        print("Chat saved to chat_history.")
 
-    def hybrid_search(self, query, top_k=3):
+    @staticmethod
+    def _chat_text(chat_entry):
+        return f"{chat_entry['user_query']}\n{chat_entry['response_text']}"
+
+    def _chats_flushed(self, chat_entries):
+        if self.retrieval_cache is not None and chat_entries:
+            self.retrieval_cache.chats_changed(chat_entry["user_id"] for chat_entry in chat_entries)
+
+    async def _achats_flushed(self, chat_entries):
+        """`_chats_flushed` for the chat writer: the retrieval cache's version bump runs on a thread."""
+        if self.retrieval_cache is not None and chat_entries:
+            await self.retrieval_cache.achats_changed(chat_entry["user_id"] for chat_entry in chat_entries)
+
+    def ingest_response(self, user_query, response_text, user_id):
+        chat_entry = self._chat_entry(user_query, response_text, user_id)
+        if self.embed_chat_history:
+            # Stored turns are documents, embedded like the chat writer's batches
+            chat_entry["embedding"] = self.embedding_model.embed_documents([self._chat_text(chat_entry)])[0]
+        result = self.chat_history_collection.insert_one(chat_entry)
+        chat_entry["_id"] = result.inserted_id
+        self._chats_flushed([chat_entry])
+        logger.info("Chat saved to chat_history.")
+
+    async def aingest_response(self, user_query, response_text, user_id):
+        """Queue the turn on the write-behind journal; it reaches Mongo with the next batch."""
+        chat_entry = self._chat_entry(user_query, response_text, user_id)
+        await self.chat_writer.submit(chat_entry)
+
+    async def aclose(self):
+        """Flush buffered chat turns; called on shutdown."""
+        await self.chat_writer.stop()
+
+    @classmethod
+    def _text_pipeline(cls, query, top_k):
+        return [
+            {
+                "$search": {
+                    "text": {
+                        "query": query,
+                        "path": "chunk"
+                    }
+                }
+            },
+            {"$limit": top_k},
+            # Hits would otherwise carry their whole embedding over the wire
+            {"$project": cls.CHUNK_FIELDS}
+        ]
+
+    @classmethod
+    def _vector_pipeline(cls, embedding, top_k):
+        return [
+            {
+                "$search": {
+                    "knnBeta": {
+                        "vector": embedding,
+                        "path": "embedding",
+                        "k": top_k
+                    }
+                }
+            },
+            {"$limit": top_k},
+            {"$project": cls.CHUNK_FIELDS}
+        ]
+
+    @staticmethod
+    def _chat_pipeline(query, top_k, filters=()):
+        text = {
+            "query": query,
+            "path": ["user_query", "response_text"]
+        }
+        # The user / recency filter is applied inside the search, before scoring and $limit
+        operator = {"compound": {"must": [{"text": text}], "filter": list(filters)}} if filters else {"text": text}
+        return [
+            {
+                "$search": {
+                    "index": "chat-history",
+                    **operator
+                }
+            },
+            {"$limit": top_k},
+            {"$project": {"user_query": 1, "response_text": 1}}
+        ]
+
+    @staticmethod
+    def _chat_vector_pipeline(embedding, top_k, filters=()):
+        knn = {
+            "vector": embedding,
+            "path": "embedding",
+            "k": top_k
+        }
+        if filters:
+            knn["filter"] = {"compound": {"filter": list(filters)}}
+        return [
+            {
+                "$search": {
+                    "index": "chat-history",
+                    "knnBeta": knn
+                }
+            },
+            {"$limit": top_k},
+            {"$project": {"user_query": 1, "response_text": 1}}
+        ]
+
+    # === Chat-history scope ===
+    # With a user_id, chat-history search sees only that user's turns within the recency window:
+    # Atlas Search applies it as a filter clause (user_id indexed as a token, timestamp as a date),
+    # and the fallbacks rank the window's newest `chat_window_turns` turns, read through the
+    # (user_id, timestamp) index, in process. Without one, every user's turns are searched.
+
+    def _chat_since(self):
+        return datetime.utcnow() - timedelta(days=self.chat_window_days) if self.chat_window_days else None
+
+    def _chat_scope(self, user_id):
+        """Mongo filter for the turns a chat-history search for `user_id` may return."""
+        scope = {"user_id": user_id}
+        since = self._chat_since()
+        if since is not None:
+            scope["timestamp"] = {"$gte": since}
+        return scope
+
+    def _chat_search_filters(self, user_id):
+        """`_chat_scope` as Atlas Search filter clauses."""
+        if user_id is None:
+            return []
+        filters = [{"equals": {"path": "user_id", "value": user_id}}]
+        since = self._chat_since()
+        if since is not None:
+            filters.append({"range": {"path": "timestamp", "gte": since}})
+        return filters
+
+    def _chat_window_query(self, user_id, embeddings=False):
+        projection = {"user_query": 1, "response_text": 1, "embedding": 1} if embeddings else {"user_query": 1, "response_text": 1}
+        return self._chat_scope(user_id), projection
+
+    @staticmethod
+    def _rank_chats(query, chats, top_k):
+        """BM25 over one user's window of turns, built per query: the window is small, the index is not kept."""
+        index = BM25Index()
+        index.add_many((chat["_id"], f"{chat['user_query']} {chat['response_text']}") for chat in chats)
+        by_id = {str(chat["_id"]): chat for chat in chats}
+        return [by_id[key] for key, _ in index.search(query, top_k)]
+
+    @staticmethod
+    def _nearest_chats(embedding, chats, top_k):
+        """Exact cosine ranking of the window's embedded turns."""
+        chats = [chat for chat in chats if "embedding" in chat]
+        if not chats:
+            return []
+        matrix = np.vstack([decode_vector(chat["embedding"]) for chat in chats])
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        return [{key: chats[i][key] for key in ("_id", "user_query", "response_text")} for i in np.argsort(-scores)[:top_k]]
+
+    @staticmethod
+    def _regex_filters(query):
+        pattern = re.escape(query)
+        doc_filter = {"chunk": {"$regex": pattern, "$options": "i"}}
+        chat_filter = {"$or": [
+            {"user_query": {"$regex": pattern, "$options": "i"}},
+            {"response_text": {"$regex": pattern, "$options": "i"}}
+        ]}
+        return doc_filter, chat_filter
+
+    @staticmethod
+    def _keyword_ids(index, query, top_k):
+        return [ObjectId(key) for key, _ in index.search(query, top_k)]
+
+    @staticmethod
+    def _chat_chunks(chat_results):
+        return [
+            f"User: {entry['user_query']}\nBot: {entry['response_text']}"
+            for entry in chat_results if "user_query" in entry and "response_text" in entry
+        ]
+
+    @staticmethod
+    def _format_results(doc_chunks, chat_chunks, top_k):
+        # Format the results as a string for the LLM
+        result_parts = []
+
+        if doc_chunks:
+            result_parts.append("=== RELEVANT DOCUMENTS ===")
+            for i, chunk in enumerate(doc_chunks[:top_k], 1):
+                result_parts.append(f"Document {i}:\n{chunk}\n")
+        else:
+            result_parts.append("=== NO RELEVANT DOCUMENTS FOUND ===")
+
+        if chat_chunks:
+            result_parts.append(CHAT_HISTORY_FOUND)
+            for i, chat in enumerate(chat_chunks[:top_k], 1):
+                result_parts.append(f"Conversation {i}:\n{chat}\n")
+
+        return "\n".join(result_parts)
+
+    def _local_vector_ids(self, embedding, top_k):
+        return [ObjectId(doc_id) for doc_id, _ in self.vector_index.search(embedding, top_k)]
+
+    @staticmethod
+    def _order_by_ids(docs, ids):
+        by_id = {doc["_id"]: doc for doc in docs}
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+    @staticmethod
+    def _fuse(*ranked_lists, key="chunk", k=60):
+        """Reciprocal-rank fusion: each doc scores sum(1 / (k + rank)) over the lists it appears in."""
+        scores = {}
+        docs = {}
+        for results in ranked_lists:
+            for rank, doc in enumerate(results, 1):
+                if key in doc:
+                    scores[doc[key]] = scores.get(doc[key], 0.0) + 1.0 / (k + rank)
+                    docs.setdefault(doc[key], doc)
+        return [docs[value] for value in sorted(scores, key=scores.get, reverse=True)]
+
+    def _fetch_k(self, top_k):
+        # The context packer chooses among more candidates than it keeps
+        return max(top_k, self.context_candidates) if self.context_packer is not None else top_k
+
+    def _finish_search(self, text_results, vector_results, chat_results, timings, top_k):
+        self.retrieval_stats.observe_all(timings)
+
+        docs = self._fuse(text_results, vector_results)
+        chat_chunks = self._chat_chunks(chat_results)
+        if self.context_packer is not None:
+            return self.context_packer.pack(docs, chat_chunks, top_k, self._format_results)
+
+        return self._format_results([doc["chunk"] for doc in docs], chat_chunks, top_k)
+
+    # === Retrieval stages ===
+    # Every source falls back on its own, so a missing Atlas index only downgrades that source.
+    # Each Atlas aggregation is a "mongo" span, so fallbacks show up as span errors in /metrics.
+
+    @staticmethod
+    def _aggregate(collection, name, pipeline):
+        with span(name, "mongo"):
+            return list(collection.aggregate(pipeline))
+
+    @staticmethod
+    async def _aaggregate(collection, name, pipeline):
+        with span(name, "mongo"):
+            cursor = await collection.aggregate(pipeline)
+            return await cursor.to_list()
+
+    def _search_text(self, query, top_k):
         try:
-            # Get embedding for vector search
-            embedding = self.embedding_model.embed_query(query)
-            
-            doc_chunks = []
-            chat_chunks = []
+            return self._aggregate(self.doc_collection, "text_search", self._text_pipeline(query, top_k))
+        except Exception as search_error:
+            logger.debug(f"MongoDB Atlas text search failed, using fallback: {search_error}")
+            if self.keyword_index is not None:
+                ids = self._keyword_ids(self.keyword_index, query, top_k)
+                return self._order_by_ids(list(self.doc_collection.find({"_id": {"$in": ids}}, self.CHUNK_FIELDS)), ids)
+            doc_filter, _ = self._regex_filters(query)
+            return list(self.doc_collection.find(doc_filter, self.CHUNK_FIELDS).limit(top_k))
+
+    def _search_vector(self, embedding, top_k):
+        if self.vector_index is not None:
+            ids = self._local_vector_ids(embedding, top_k)
+            return self._order_by_ids(list(self.doc_collection.find({"_id": {"$in": ids}}, self.CHUNK_FIELDS)), ids)
+        try:
+            return self._aggregate(self.doc_collection, "vector_search", self._vector_pipeline(embedding, top_k))
+        except Exception as search_error:
+            logger.debug(f"MongoDB Atlas vector search failed: {search_error}")
+            return []
 
-            # === Try MongoDB Atlas Search first ===
+    def _search_chat(self, query, top_k, user_id=None):
+        try:
+            pipeline = self._chat_pipeline(query, top_k, self._chat_search_filters(user_id))
+            return self._aggregate(self.chat_history_collection, "chat_search", pipeline)
+        except Exception as search_error:
+            logger.debug(f"MongoDB Atlas chat-history search failed, using fallback: {search_error}")
+            projection = {"user_query": 1, "response_text": 1}
+            if user_id is not None:
+                scope, projection = self._chat_window_query(user_id)
+                if not self.rank_chat_windows:
+                    _, chat_filter = self._regex_filters(query)
+                    return list(self.chat_history_collection.find({**scope, **chat_filter}, projection).sort("timestamp", -1).limit(top_k))
+                window = self.chat_history_collection.find(scope, projection).sort("timestamp", -1).limit(self.chat_window_turns)
+                return self._rank_chats(query, list(window), top_k)
+            _, chat_filter = self._regex_filters(query)
+            return list(self.chat_history_collection.find(chat_filter, projection).limit(top_k))
+
+    def _search_chat_vector(self, embedding, top_k, user_id=None):
+        # With an in-process vector index there is no Atlas vector search to try
+        if self.vector_index is None:
             try:
-                # Document text search
-                text_pipeline = [
-                    {
-                        "$search": {
-                            "text": {
-                                "query": query,
-                                "path": "chunk"
-                            }
-                        }
-                    },
-                    {"$limit": top_k}
-                ]
-
-                # Document vector search
-                vector_pipeline = [
-                    {
-                        "$search": {
-                            "knnBeta": {
-                                "vector": embedding,
-                                "path": "embedding",
-                                "k": top_k
-                            }
-                        }
-                    },
-                    {"$limit": top_k}
-                ]
-
-                doc_results_text = list(self.doc_collection.aggregate(text_pipeline))
-                doc_results_vec = list(self.doc_collection.aggregate(vector_pipeline))
-                
-                doc_chunks = list(set(
-                    doc["chunk"] for doc in doc_results_text + doc_results_vec if "chunk" in doc
-                ))
-                
-                # Chat history search
-                chat_pipeline = [
-                    {
-                        "$search": {
-                            "index": "chat-history",
-                            "text": {
-                                "query": query,
-                                "path": ["user_query", "response_text"]
-                            }
-                        }
-                    },
-                    {"$limit": top_k}
-                ]
-
-                chat_results = list(self.chat_history_collection.aggregate(chat_pipeline))
-                chat_chunks = [
-                    f"User: {entry['user_query']}\nBot: {entry['response_text']}"
-                    for entry in chat_results if "user_query" in entry and "response_text" in entry
-                ]
-                
+                pipeline = self._chat_vector_pipeline(embedding, top_k, self._chat_search_filters(user_id))
+                return self._aggregate(self.chat_history_collection, "chat_vector_search", pipeline)
             except Exception as search_error:
-                print(f"MongoDB Atlas Search failed, using fallback: {search_error}")
-                
-                # === Fallback to basic MongoDB queries ===
-                # Simple text matching for documents
-                doc_results = list(self.doc_collection.find(
-                    {"chunk": {"$regex": query, "$options": "i"}},
-                    {"chunk": 1}
-                ).limit(top_k))
-                
-                doc_chunks = [doc["chunk"] for doc in doc_results if "chunk" in doc]
-                
-                # Simple text matching for chat history
-                chat_results = list(self.chat_history_collection.find(
-                    {"$or": [
-                        {"user_query": {"$regex": query, "$options": "i"}},
-                        {"response_text": {"$regex": query, "$options": "i"}}
-                    ]},
-                    {"user_query": 1, "response_text": 1}
-                ).limit(top_k))
-                
-                chat_chunks = [
-                    f"User: {entry['user_query']}\nBot: {entry['response_text']}"
-                    for entry in chat_results if "user_query" in entry and "response_text" in entry
-                ]
+                logger.debug(f"MongoDB Atlas chat-history vector search failed: {search_error}")
+        if user_id is None:
+            return []
+        scope, projection = self._chat_window_query(user_id, embeddings=True)
+        window = self.chat_history_collection.find(scope, projection).sort("timestamp", -1).limit(self.chat_window_turns)
+        return self._nearest_chats(embedding, list(window), top_k)
 
-            # Format the results as a string for the LLM
-            result_parts = []
-            
-            if doc_chunks:
-                result_parts.append("=== RELEVANT DOCUMENTS ===")
-                for i, chunk in enumerate(doc_chunks[:top_k], 1):
-                    result_parts.append(f"Document {i}:\n{chunk}\n")
-            else:
-                result_parts.append("=== NO RELEVANT DOCUMENTS FOUND ===")
-                
-            if chat_chunks:
-                result_parts.append("=== RELEVANT CHAT HISTORY ===")
-                for i, chat in enumerate(chat_chunks[:top_k], 1):
-                    result_parts.append(f"Conversation {i}:\n{chat}\n")
-            
-            final_result = "\n".join(result_parts)
-            print(f"RAG Search Results:\n{final_result}")
-            return final_result
+    async def _asearch_text(self, query, top_k):
+        try:
+            return await self._aaggregate(self.async_doc_collection, "text_search", self._text_pipeline(query, top_k))
+        except Exception as search_error:
+            logger.debug(f"MongoDB Atlas text search failed, using fallback: {search_error}")
+            if self.keyword_index is not None:
+                ids = await asyncio.to_thread(self._keyword_ids, self.keyword_index, query, top_k)
+                docs = await self.async_doc_collection.find({"_id": {"$in": ids}}, self.CHUNK_FIELDS).to_list()
+                return self._order_by_ids(docs, ids)
+            doc_filter, _ = self._regex_filters(query)
+            return await self.async_doc_collection.find(doc_filter, self.CHUNK_FIELDS).limit(top_k).to_list()
+
+    async def _asearch_vector(self, embedding, top_k):
+        if self.vector_index is not None:
+            ids = await asyncio.to_thread(self._local_vector_ids, embedding, top_k)
+            docs = await self.async_doc_collection.find({"_id": {"$in": ids}}, self.CHUNK_FIELDS).to_list()
+            return self._order_by_ids(docs, ids)
+        try:
+            return await self._aaggregate(self.async_doc_collection, "vector_search", self._vector_pipeline(embedding, top_k))
+        except Exception as search_error:
+            logger.debug(f"MongoDB Atlas vector search failed: {search_error}")
+            return []
+
+    async def _asearch_chat(self, query, top_k, user_id=None):
+        try:
+            pipeline = self._chat_pipeline(query, top_k, self._chat_search_filters(user_id))
+            return await self._aaggregate(self.async_chat_history_collection, "chat_search", pipeline)
+        except Exception as search_error:
+            logger.debug(f"MongoDB Atlas chat-history search failed, using fallback: {search_error}")
+            projection = {"user_query": 1, "response_text": 1}
+            if user_id is not None:
+                scope, projection = self._chat_window_query(user_id)
+                if not self.rank_chat_windows:
+                    _, chat_filter = self._regex_filters(query)
+                    cursor = self.async_chat_history_collection.find({**scope, **chat_filter}, projection)
+                    return await cursor.sort("timestamp", -1).limit(top_k).to_list()
+                cursor = self.async_chat_history_collection.find(scope, projection)
+                window = await cursor.sort("timestamp", -1).limit(self.chat_window_turns).to_list()
+                return await asyncio.to_thread(self._rank_chats, query, window, top_k)
+            _, chat_filter = self._regex_filters(query)
+            return await self.async_chat_history_collection.find(chat_filter, projection).limit(top_k).to_list()
+
+    async def _asearch_chat_vector(self, embedding, top_k, user_id=None):
+        # With an in-process vector index there is no Atlas vector search to try
+        if self.vector_index is None:
+            try:
+                pipeline = self._chat_vector_pipeline(embedding, top_k, self._chat_search_filters(user_id))
+                return await self._aaggregate(self.async_chat_history_collection, "chat_vector_search", pipeline)
+            except Exception as search_error:
+                logger.debug(f"MongoDB Atlas chat-history vector search failed: {search_error}")
+        if user_id is None:
+            return []
+        scope, projection = self._chat_window_query(user_id, embeddings=True)
+        cursor = self.async_chat_history_collection.find(scope, projection)
+        window = await cursor.sort("timestamp", -1).limit(self.chat_window_turns).to_list()
+        return await asyncio.to_thread(self._nearest_chats, embedding, window, top_k)
+
+    def hybrid_search(self, query, top_k=3, user_id=None):
+        """
+        Text, vector and chat-history retrieval run side by side on a thread pool;
+        the text and chat lookups overlap the embedding call. Each source gets
+        `retrieval_timeout` seconds, after which it contributes nothing. With chat
+        embeddings on, chat history is searched by text and by vector and fused.
+        With a `user_id`, chat history is that user's recent turns only.
+
+        Results are served from the retrieval cache while the chunks and chat
+        turns they searched are unchanged; a search that lost a source is not cached.
+        """
+        if self.retrieval_cache is None:
+            return self._hybrid_search(query, top_k, user_id)[0]
+        context, ticket = self.retrieval_cache.lookup(query, top_k, user_id)
+        if context is None:
+            context, complete = self._hybrid_search(query, top_k, user_id)
+            if complete:
+                self.retrieval_cache.store(ticket, context)
+        return context
+
+    async def ahybrid_search(self, query, top_k=3, user_id=None):
+        """Async twin of hybrid_search used by the FastAPI path."""
+        if self.retrieval_cache is None:
+            return (await self._ahybrid_search(query, top_k, user_id))[0]
+        context, ticket = await self.retrieval_cache.alookup(query, top_k, user_id)
+        if context is None:
+            context, complete = await self._ahybrid_search(query, top_k, user_id)
+            if complete:
+                await self.retrieval_cache.astore(ticket, context)
+        return context
+
+    def _hybrid_search(self, query, top_k, user_id):
+        """(context, whether every source answered)"""
+        try:
+            timings = {}
+            start = time.perf_counter()
+            fetch_k = self._fetch_k(top_k)
+
+            def timed(name, fn, *args):
+                stage_start = time.perf_counter()
+                try:
+                    return fn(*args)
+                finally:
+                    timings[name] = (time.perf_counter() - stage_start) * 1000
+
+            # Submitted first, so stages waiting on it never hold the pool ahead of it
+            embedding = submit(retrieval_executor, timed, "embed", self.embedding_model.embed_query, query)
+
+            def vector_search():
+                return self._search_vector(embedding.result(), fetch_k)
+
+            def chat_search():
+                chat_results = self._search_chat(query, fetch_k, user_id)
+                if not self.embed_chat_history:
+                    return chat_results
+                return self._fuse(chat_results, self._search_chat_vector(embedding.result(), fetch_k, user_id), key="_id")
+
+            futures = {
+                "text": submit(retrieval_executor, timed, "text", self._search_text, query, fetch_k),
+                "vector": submit(retrieval_executor, timed, "vector", vector_search),
+                "chat": submit(retrieval_executor, timed, "chat", chat_search),
+            }
+            deadline = start + self.retrieval_timeout
+            results = {}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+                except FutureTimeoutError:
+                    logger.warning(f"Retrieval source '{name}' timed out after {self.retrieval_timeout}s")
+                    results[name] = None
+                except Exception as e:
+                    logger.warning(f"Retrieval source '{name}' failed: {e}")
+                    results[name] = None
+            timings["total"] = (time.perf_counter() - start) * 1000
+
+            complete = None not in results.values()
+            results = {name: found or [] for name, found in results.items()}
+            context = self._finish_search(results["text"], results["vector"], results["chat"], dict(timings), top_k)
+            return context, complete
             
         except Exception as e:
-            print(f"Error in hybrid_search: {e}")
-            return f"Error retrieving documents: {str(e)}"
+            logger.error(f"Error in hybrid_search: {e}")
+            return f"Error retrieving documents: {str(e)}", False
+
+    async def _ahybrid_search(self, query, top_k, user_id):
+        try:
+            timings = {}
+            failed = []
+            start = time.perf_counter()
+            fetch_k = self._fetch_k(top_k)
+
+            async def stage(name, coro):
+                stage_start = time.perf_counter()
+                try:
+                    return await asyncio.wait_for(coro, self.retrieval_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Retrieval source '{name}' timed out after {self.retrieval_timeout}s")
+                    failed.append(name)
+                    return []
+                except Exception as e:
+                    logger.warning(f"Retrieval source '{name}' failed: {e}")
+                    failed.append(name)
+                    return []
+                finally:
+                    timings[name] = (time.perf_counter() - stage_start) * 1000
+
+            async def embed():
+                embed_start = time.perf_counter()
+                embedding = await self.embedding_model.aembed_query(query)
+                timings["embed"] = (time.perf_counter() - embed_start) * 1000
+                return embedding
+
+            # Shared by the vector stages; shielded so one stage timing out doesn't cancel it for the other
+            embedding = asyncio.ensure_future(embed())
+
+            async def vector_search():
+                return await self._asearch_vector(await asyncio.shield(embedding), fetch_k)
+
+            async def chat_search():
+                if not self.embed_chat_history:
+                    return await self._asearch_chat(query, fetch_k, user_id)
+
+                async def chat_vector_search():
+                    return await self._asearch_chat_vector(await asyncio.shield(embedding), fetch_k, user_id)
+
+                text_chats, vector_chats = await asyncio.gather(self._asearch_chat(query, fetch_k, user_id), chat_vector_search())
+                return self._fuse(text_chats, vector_chats, key="_id")
+
+            text_results, vector_results, chat_results = await asyncio.gather(
+                stage("text", self._asearch_text(query, fetch_k)),
+                stage("vector", vector_search()),
+                stage("chat", chat_search()),
+            )
+            timings["total"] = (time.perf_counter() - start) * 1000
+
+            context = self._finish_search(text_results, vector_results, chat_results, timings, top_k)
+            return context, not failed
+
+        except Exception as e:
+            logger.error(f"Error in hybrid_search: {e}")
+            return f"Error retrieving documents: {str(e)}", False
     
     def test_document_search(self, query=""):
         """Test function to check if documents exist in the database"""
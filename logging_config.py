@@ -2,12 +2,13 @@ import logging
 from uuid import uuid4
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
+from tracing import request_id as current_request_id
 
 
 class SafeFormatter(logging.Formatter):
     def format(self, record):
         if not hasattr(record, "request_id"):
-            record.request_id = "-"
+            record.request_id = current_request_id.get()
         return super().format(record)
 
 
@@ -16,6 +17,8 @@ class RequestIDMiddleware(BaseHTTPMiddleware):
         request_id = str(uuid4())
         request.state.request_id = request_id
         request.state.logger = logging.LoggerAdapter(logging.getLogger("app"), {"request_id": request_id})
+        # Seen by everything the request runs, down to the graph nodes and tools, for span tagging
+        current_request_id.set(request_id)
 
         response = await call_next(request)
         response.headers["X-Request-ID"] = request_id
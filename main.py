@@ -37,8 +37,8 @@ def upload_file(file):
         with open(file.name, "rb") as f:
             files = {"file": (file.name, f)}
             r = requests.post(f"{API_URL}/upload/", files=files)
-            if r.status_code == 200:
-                return "File uploaded and processed successfully!"
+            if r.status_code == 200 and r.json().get("status") == "accepted":
+                return f"File uploaded, processing in the background (job {r.json()['job_id']})."
             else:
                 return "Error uploading file."
     except Exception as e:
@@ -0,0 +1,160 @@
+import threading
+
+
+class LatencyStats:
+    """
+    Running count / mean / max per named stage, cheap enough for the hot path.
+    Values are latencies in ms unless another `unit` is given (e.g. "tokens").
+    """
+
+    def __init__(self, unit="ms"):
+        self.unit = unit
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value):
+        with self._lock:
+            stage = self._stages.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+            stage["count"] += 1
+            stage["total"] += value
+            stage["max"] = max(stage["max"], value)
+            stage["last"] = value
+
+    def observe_all(self, timings):
+        for name, ms in timings.items():
+            self.observe(name, ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    "count": stage["count"],
+                    f"avg_{self.unit}": round(stage["total"] / stage["count"], 2),
+                    f"max_{self.unit}": round(stage["max"], 2),
+                    f"last_{self.unit}": round(stage["last"], 2),
+                }
+                for name, stage in self._stages.items()
+            }
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter per label set, rendered in the Prometheus text format."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labels, labels)} {value}"
+
+
+class Gauge:
+    """Current value per label set (a queue depth, a pool size), rendered in the Prometheus text format."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labels, labels)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set (observations in seconds unless named otherwise)."""
+
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {labels: dict(s, buckets=list(s["buckets"])) for labels, s in self._series.items()}
+        for labels, s in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, s["buckets"]):
+                cumulative += count
+                yield f"{self.name}_bucket{_label_text(self.labels, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_label_text(self.labels, labels, [('le', '+Inf')])} {s['count']}"
+            yield f"{self.name}_sum{_label_text(self.labels, labels)} {round(s['sum'], 6)}"
+            yield f"{self.name}_count{_label_text(self.labels, labels)} {s['count']}"
+
+
+class MetricsRegistry:
+    """The metrics served on GET /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,58 @@
+"""
+Convert the embeddings stored in document_chunks to another EMBEDDING_FORMAT.
+
+    python -m migrate_embeddings --format float32
+    python -m migrate_embeddings --format int8 --dry-run
+
+Chunks already in the target format are left alone, so an interrupted run can
+simply be started again. Converting to int8 is lossy; going back to float32
+afterwards keeps the quantized values.
+"""
+import argparse
+
+import bson
+from pymongo import UpdateOne
+
+from vector_codec import FORMATS, decode_vector, encode_vector, vector_format
+
+
+def migrate(collection, fmt, batch_size=500, dry_run=False):
+    """Re-encode every embedding in `collection` as `fmt`; returns counts and BSON sizes before and after."""
+    summary = {"scanned": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0}
+    ops = []
+    for doc in collection.find({"embedding": {"$exists": True}}, {"embedding": 1}).batch_size(batch_size):
+        summary["scanned"] += 1
+        before = len(bson.encode({"embedding": doc["embedding"]}))
+        summary["bytes_before"] += before
+        if vector_format(doc["embedding"]) == fmt:
+            summary["bytes_after"] += before
+            continue
+        encoded = encode_vector(decode_vector(doc["embedding"]), fmt)
+        summary["bytes_after"] += len(bson.encode({"embedding": encoded}))
+        summary["converted"] += 1
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": encoded}}))
+        if len(ops) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops and not dry_run:
+        collection.bulk_write(ops, ordered=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=FORMATS, default="float32")
+    parser.add_argument("--collection", default="document_chunks")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    from services import services
+    summary = migrate(services.db[args.collection], args.format, args.batch_size, args.dry_run)
+    print(f"{'Would convert' if args.dry_run else 'Converted'} {summary['converted']} of {summary['scanned']} embeddings "
+          f"to {args.format}: {summary['bytes_before']:,} -> {summary['bytes_after']:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+import re
+import threading
+import time
+
+
+# Questions that plainly ask about the uploaded material
+DOCUMENT_QUERY = re.compile(
+    r"\b(documents?|files?|uploads?|uploaded|pdfs?|reports?|resumes?|cv|attachments?|my notes)\b"
+    r"|\.(pdf|docx?|txt)\b",
+    re.IGNORECASE,
+)
+
+NO_DOCUMENTS = "=== NO RELEVANT DOCUMENTS FOUND ==="
+
+
+def _terms(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class Prefetch:
+    """A hybrid_search started for one chat turn before the model asked for it."""
+
+    def __init__(self, query, task):
+        self.query = query
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished = None
+        self.used = False
+        # Retrieved context put into the first prompt by the router, if it fired
+        self.context = None
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self.finished = time.perf_counter()
+
+
+class RetrievalPrefetcher:
+    """
+    Speculative retrieval: `start` runs hybrid_search on the user message while
+    the first model call is in flight, and `take` hands the result to rag_search
+    when the model asks for a query close enough to that message (Jaccard
+    similarity of their word sets >= `similarity`).
+
+    With `route`, questions that plainly concern the uploaded documents wait for
+    the prefetch instead, and its result goes straight into the first prompt, so
+    the model can answer without a rag_search round trip.
+    """
+
+    def __init__(self, search, similarity=0.5, route=False):
+        self.search = search
+        self.similarity = similarity
+        self.route_enabled = route
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "hits": 0, "misses": 0, "unused": 0, "routed": 0, "saved_ms": 0.0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def start(self, query, user_id=None):
+        self._count("started")
+        return Prefetch(query, asyncio.ensure_future(self.search(query, user_id=user_id)))
+
+    def matches(self, prefetch, query):
+        if query.strip().lower() == prefetch.query.strip().lower():
+            return True
+        a, b = _terms(query), _terms(prefetch.query)
+        return bool(a | b) and len(a & b) / len(a | b) >= self.similarity
+
+    async def route(self, prefetch):
+        """Put the prefetched context into the first prompt when the question is about the documents."""
+        if not self.route_enabled or not DOCUMENT_QUERY.search(prefetch.query):
+            return False
+        try:
+            context = await asyncio.shield(prefetch.task)
+        except Exception:
+            return False
+        if NO_DOCUMENTS in context:
+            return False
+        prefetch.context = context
+        prefetch.used = True
+        self._count("routed")
+        return True
+
+    async def take(self, prefetch, query):
+        """The prefetched result for a rag_search `query`, or None when it is for a different question."""
+        if prefetch is None:
+            return None
+        if not self.matches(prefetch, query):
+            self._count("misses")
+            return None
+        first_use = not prefetch.used
+        prefetch.used = True
+        asked = time.perf_counter()
+        try:
+            result = await asyncio.shield(prefetch.task)
+        except Exception:
+            return None
+        if first_use:
+            self._count("hits")
+            # The retrieval time that overlapped the model call instead of following it
+            self._count("saved_ms", (min(prefetch.finished, asked) - prefetch.started) * 1000)
+        return result
+
+    def finish(self, prefetch):
+        """End of the turn: cancel a prefetch nobody used."""
+        if prefetch is None or prefetch.used:
+            return
+        self._count("unused")
+        prefetch.task.cancel()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, similarity=self.similarity, route=self.route_enabled)
+        # A routed prefetch was used as well, just by the first prompt instead of rag_search
+        stats["hit_rate"] = round((stats["hits"] + stats["routed"]) / stats["started"], 4) if stats["started"] else 0.0
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
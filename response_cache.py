@@ -0,0 +1,111 @@
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticResponseCache:
+    """
+    Answers keyed by query embedding. A new question whose embedding has cosine
+    similarity >= `threshold` with a cached one gets the stored answer back
+    without running the agent graph.
+
+    Entries expire after `ttl_seconds`, the oldest are evicted past `max_entries`,
+    and an entry is dropped once documents were ingested after it was stored
+    (`version` is the bot's documents_version at store time).
+    """
+
+    def __init__(self, embeddings, version=lambda: 0, threshold=0.95, ttl_seconds=3600, max_entries=1000):
+        self.embeddings = embeddings
+        self.version = version
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._entries = []
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "saved_ms": 0.0}
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sweep(self):
+        now = time.time()
+        version = self.version()
+        live = [e for e in self._entries if now - e["created_at"] < self.ttl_seconds and e["version"] == version]
+        live = live[-self.max_entries:]
+        if len(live) != len(self._entries):
+            self._entries = live
+            self._matrix = None
+
+    def _lookup(self, vector):
+        with self._lock:
+            self._sweep()
+            if not self._entries:
+                return None, 0.0
+            if self._matrix is None:
+                self._matrix = np.vstack([e["vector"] for e in self._entries])
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            return self._entries[best], float(scores[best])
+
+    def _record(self, entry, similarity, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            if entry is not None and similarity >= self.threshold:
+                self._stats["hits"] += 1
+                self._stats["saved_ms"] += max(entry["latency_ms"] - elapsed_ms, 0.0)
+                return entry["answer"]
+            self._stats["misses"] += 1
+            return None
+
+    async def alookup(self, query):
+        """Return a cached answer for a near-duplicate question, or None."""
+        started = time.perf_counter()
+        vector = self._normalize(await self.embeddings.aembed_query(query))
+        entry, similarity = self._lookup(vector)
+        return self._record(entry, similarity, started)
+
+    def lookup(self, query):
+        started = time.perf_counter()
+        vector = self._normalize(self.embeddings.embed_query(query))
+        entry, similarity = self._lookup(vector)
+        return self._record(entry, similarity, started)
+
+    def _store(self, query, vector, answer, latency_ms):
+        with self._lock:
+            self._entries.append({
+                "query": query,
+                "answer": answer,
+                "vector": vector,
+                "latency_ms": latency_ms,
+                "created_at": time.time(),
+                "version": self.version(),
+            })
+            self._matrix = None
+            self._stats["stores"] += 1
+            self._sweep()
+
+    async def astore(self, query, answer, latency_ms):
+        # The query embedding is already in the embedding cache from alookup
+        self._store(query, self._normalize(await self.embeddings.aembed_query(query)), answer, latency_ms)
+
+    def store(self, query, answer, latency_ms):
+        self._store(query, self._normalize(self.embeddings.embed_query(query)), answer, latency_ms)
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), threshold=self.threshold)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
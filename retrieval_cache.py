@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import registry
+
+
+logger = logging.getLogger("app")
+
+
+lookups = registry.counter(
+    "retrieval_cache_lookups_total", "hybrid_search calls answered by the retrieval cache, by outcome.", ["result"]
+)
+
+
+class RetrievalCache:
+    """
+    hybrid_search results keyed by normalized query, top_k and user.
+
+    Every result is stored with the versions of what it searched: the document
+    chunks and the chat history it could see (the user's own turns, or every
+    user's for an unscoped search). `documents_changed` and `chats_changed`
+    advance those versions, so a result computed before a change is never
+    served after it. Entries also expire after `ttl_seconds`, and the least
+    recently used are evicted past `max_entries`.
+
+    With `path`, entries and versions are kept in a SQLite file as well, which
+    every worker on the host opens: one worker's search serves the others, and
+    an ingest in any of them invalidates the entries of all. Without it the
+    versions only count this process's changes.
+    """
+
+    def __init__(self, path=None, ttl_seconds=600, max_entries=2000, disk_entries=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.disk_entries = disk_entries or 10 * max_entries
+
+        self._memory = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk = self._open(path) if path else None
+        self._stores_since_trim = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stale": 0, "stores": 0, "evictions": 0,
+                       "disk_errors": 0}
+
+    @staticmethod
+    def _open(path):
+        conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        # WAL lets the other workers read while one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS versions (scope TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, versions TEXT NOT NULL, created REAL NOT NULL, result TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+        return conn
+
+    @staticmethod
+    def key(query, top_k, user_id=None):
+        # Case, spacing and a trailing "?" do not change what the sources return
+        return json.dumps([" ".join(query.lower().split()).rstrip("?!. "), top_k, user_id])
+
+    @staticmethod
+    def _scopes(user_id):
+        return ("documents", "chat" if user_id is None else f"chat:{user_id}")
+
+    def _failed(self, action, error):
+        logger.warning(f"Retrieval cache {action} failed: {error}")
+        with self._lock:
+            self._stats["disk_errors"] += 1
+
+    # === Corpus versions ===
+
+    def _bump(self, scopes):
+        if self._disk is None:
+            with self._lock:
+                for scope in scopes:
+                    self._versions[scope] = self._versions.get(scope, 0) + 1
+            return
+        try:
+            with self._disk_lock:
+                self._disk.executemany(
+                    "INSERT INTO versions VALUES (?, 1) ON CONFLICT(scope) DO UPDATE SET version = version + 1",
+                    [(scope,) for scope in scopes],
+                )
+        except sqlite3.Error as e:
+            # Entries stored before the change could now be served stale, so they go
+            self._failed("version bump", e)
+            self.clear()
+
+    def documents_changed(self):
+        self._bump(["documents"])
+
+    def chats_changed(self, user_ids):
+        """Turns of `user_ids` became searchable: their scoped results and every unscoped one are out of date."""
+        self._bump(["chat", *(f"chat:{user_id}" for user_id in set(user_ids))])
+
+    def _current(self, scopes):
+        if self._disk is None:
+            with self._lock:
+                return [self._versions.get(scope, 0) for scope in scopes]
+        with self._disk_lock:
+            rows = dict(self._disk.execute(
+                f"SELECT scope, version FROM versions WHERE scope IN ({', '.join('?' * len(scopes))})", scopes
+            ).fetchall())
+        return [rows.get(scope, 0) for scope in scopes]
+
+    # === Lookups ===
+
+    def lookup(self, query, top_k, user_id=None):
+        """
+        (result or None, ticket). Pass the ticket to `store` with the result of
+        the search: it carries the versions read before the search began, so a
+        change made while it ran leaves the stored result already out of date.
+        """
+        key = self.key(query, top_k, user_id)
+        try:
+            versions = self._current(self._scopes(user_id))
+        except sqlite3.Error as e:
+            # Without the versions nothing can be served or stored safely
+            self._failed("version read", e)
+            return None, None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            stale = False
+            if entry is not None:
+                if entry[1] == versions and now - entry[0] < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    lookups.inc("memory_hit")
+                    return entry[2], (key, versions)
+                del self._memory[key]
+                stale = True
+
+        if self._disk is not None:
+            try:
+                with self._disk_lock:
+                    row = self._disk.execute("SELECT versions, created, result FROM entries WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                self._failed("lookup", e)
+                row = None
+            if row is not None:
+                if json.loads(row[0]) == versions and now - row[1] < self.ttl_seconds:
+                    self._remember(key, (row[1], versions, row[2]))
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    lookups.inc("disk_hit")
+                    return row[2], (key, versions)
+                stale = True
+
+        with self._lock:
+            self._stats["stale" if stale else "misses"] += 1
+        lookups.inc("stale" if stale else "miss")
+        return None, (key, versions)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def store(self, ticket, result):
+        if ticket is None:
+            return
+        key, versions = ticket
+        created = time.time()
+        self._remember(key, (created, versions, result))
+        with self._lock:
+            self._stats["stores"] += 1
+        if self._disk is None:
+            return
+        try:
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, json.dumps(versions), created, result)
+                )
+                self._stores_since_trim += 1
+                if self._stores_since_trim >= 100:
+                    self._trim(created)
+        except sqlite3.Error as e:
+            self._failed("write", e)
+
+    def _trim(self, now):
+        self._stores_since_trim = 0
+        self._disk.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_seconds,))
+        self._disk.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,),
+        )
+
+    # SQLite calls block, so the async path runs them on a thread; memory-only calls stay inline
+
+    async def adocuments_changed(self):
+        if self._disk is None:
+            return self.documents_changed()
+        await asyncio.to_thread(self.documents_changed)
+
+    async def achats_changed(self, user_ids):
+        user_ids = list(user_ids)
+        if self._disk is None:
+            return self.chats_changed(user_ids)
+        await asyncio.to_thread(self.chats_changed, user_ids)
+
+    async def alookup(self, query, top_k, user_id=None):
+        if self._disk is None:
+            return self.lookup(query, top_k, user_id)
+        return await asyncio.to_thread(self.lookup, query, top_k, user_id)
+
+    async def astore(self, ticket, result):
+        if self._disk is None:
+            return self.store(ticket, result)
+        await asyncio.to_thread(self.store, ticket, result)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._disk is not None:
+            try:
+                with self._disk_lock:
+                    self._disk.execute("DELETE FROM entries")
+            except sqlite3.Error as e:
+                self._failed("clear", e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._memory), ttl_seconds=self.ttl_seconds,
+                         shared=self.path is not None)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"] + stats["stale"]
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        return stats
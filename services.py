@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, AsyncMongoClient
+
+
+logger = logging.getLogger("app")
+
+
+load_dotenv()
+
+
+def mongo_options():
+    """Connection pool settings shared by the sync and async Mongo clients."""
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    }
+
+
+class Services:
+    """
+    Lazily built, shared application objects: the Mongo clients, the Gemini
+    wrapper (model, embeddings, search indexes), the tools, the response cache
+    and the compiled graph.
+
+    Importing this module builds nothing. Each component is created on first
+    access, exactly once even under concurrent access, and `warm_up` builds all
+    of them ahead of the first request. `timings` records how long each took.
+    """
+
+    COMPONENTS = ("trace_exporter", "admission", "mongo_client", "async_mongo_client", "bot", "response_cache", "tools", "bot_with_tools", "graph")
+
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.RLock()
+        self._warm_up_task = None
+        self.timings = {}
+        self.ready = False
+        self.error = None
+
+    def _get(self, name, factory):
+        component = self._components.get(name)
+        if component is None:
+            with self._lock:
+                component = self._components.get(name)
+                if component is None:
+                    start = time.perf_counter()
+                    component = factory()
+                    self.timings[name] = round((time.perf_counter() - start) * 1000, 1)
+                    self._components[name] = component
+        return component
+
+    def built(self, name):
+        return name in self._components
+
+    # === Components ===
+
+    @property
+    def mongo_client(self):
+        return self._get("mongo_client", lambda: MongoClient(os.getenv("MONGODB_URI"), **mongo_options()))
+
+    @property
+    def async_mongo_client(self):
+        # Async client for the FastAPI path, so Mongo round trips never block the event loop
+        return self._get("async_mongo_client", lambda: AsyncMongoClient(os.getenv("MONGODB_URI"), **mongo_options()))
+
+    @property
+    def db(self):
+        return self.mongo_client["RAG-cluster"]
+
+    @property
+    def async_db(self):
+        return self.async_mongo_client["RAG-cluster"]
+
+    @property
+    def bot(self):
+        def build():
+            from llm import Gemini
+            return Gemini(self.db, self.async_db, admission=self.admission)
+        return self._get("bot", build)
+
+    @property
+    def admission(self):
+        """Admission control shared by every Gemini call, or None with GEMINI_ADMISSION=off."""
+        def build():
+            if os.getenv("GEMINI_ADMISSION", "on").lower() == "off":
+                return False
+            from admission import AdmissionController
+            return AdmissionController(
+                rate=float(os.getenv("GEMINI_RPS", "0")),
+                burst=float(os.getenv("GEMINI_BURST", "0")) or None,
+                concurrency=int(os.getenv("GEMINI_CONCURRENCY", "32")),
+                queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10")),
+                retries=int(os.getenv("GEMINI_RETRIES", "4")),
+            )
+        return self._get("admission", build) or None
+
+    @property
+    def response_cache(self):
+        """The semantic response cache, or None with RESPONSE_CACHE=off."""
+        def build():
+            if os.getenv("RESPONSE_CACHE", "on").lower() == "off":
+                return False
+            from response_cache import SemanticResponseCache
+            bot = self.bot
+            return SemanticResponseCache(
+                bot.embedding_model,
+                version=lambda: bot.documents_version,
+                threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95")),
+                ttl_seconds=int(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+            )
+        return self._get("response_cache", build) or None
+
+    @property
+    def langfuse(self):
+        def build():
+            from langfuse import Langfuse
+            return Langfuse(
+                public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
+                host=os.getenv("LANGFUSE_HOST")
+            )
+        return self._get("langfuse", build)
+
+    @property
+    def trace_exporter(self):
+        """
+        Where spans go: TRACE_EXPORTER=langfuse, local (kept in memory for
+        GET /traces/{request_id}) or off. Defaults to Langfuse when its keys are set.
+        """
+        def build():
+            from tracing import LangfuseExporter, RecentSpans
+            default = "langfuse" if os.getenv("LANGFUSE_PUBLIC_KEY") else "local"
+            kind = os.getenv("TRACE_EXPORTER", default).lower()
+            if kind == "off":
+                return False
+            if kind == "langfuse":
+                return LangfuseExporter(self.langfuse)
+            return RecentSpans(max_spans=int(os.getenv("TRACE_MAX_SPANS", "10000")))
+        return self._get("trace_exporter", build) or None
+
+    @property
+    def prefetcher(self):
+        """Speculative retrieval for chat turns, or None unless SPECULATIVE_RETRIEVAL=on."""
+        def build():
+            if os.getenv("SPECULATIVE_RETRIEVAL", "off").lower() != "on":
+                return False
+            from prefetch import RetrievalPrefetcher
+            return RetrievalPrefetcher(
+                self.bot.ahybrid_search,
+                similarity=float(os.getenv("PREFETCH_SIMILARITY", "0.5")),
+                route=os.getenv("RETRIEVAL_ROUTER", "off").lower() == "on",
+            )
+        return self._get("prefetcher", build) or None
+
+    @property
+    def tools(self):
+        def build():
+            from langchain_tavily import TavilySearch
+            from Tools.RagTool import RAGTool
+            tavily_client = TavilySearch(api_key=os.getenv("TAVILY_API_KEY"))
+            web_search = TavilySearch(max_results=3, client=tavily_client)
+            # Repeated and concurrent identical web searches share one Tavily call (WEB_CACHE=off disables)
+            if os.getenv("WEB_CACHE", "on").lower() != "off":
+                from Agent import tool_timeout, tool_timeouts
+                from Tools.CachedWebSearch import CachedWebSearch
+                web_search = CachedWebSearch(
+                    web_search,
+                    ttl_seconds=float(os.getenv("WEB_CACHE_TTL", "300")),
+                    max_entries=int(os.getenv("WEB_CACHE_SIZE", "1000")),
+                    timeout=tool_timeouts.get(web_search.name, tool_timeout),
+                )
+            return [web_search, RAGTool(gemini_instance=self.bot, prefetcher=self.prefetcher)]
+        return self._get("tools", build)
+
+    @property
+    def web_search(self):
+        return self.tools[0]
+
+    @property
+    def rag_tool(self):
+        return self.tools[1]
+
+    @property
+    def bot_with_tools(self):
+        return self._get("bot_with_tools", lambda: self.bot.model.bind_tools(self.tools))
+
+    @property
+    def checkpointer(self):
+        def build():
+            from checkpointer import build_checkpointer
+            return build_checkpointer(self.mongo_client)
+        return self._get("checkpointer", build)
+
+    @property
+    def graph(self):
+        def build():
+            from Agent import build_graph
+            return build_graph(self.checkpointer)
+        return self._get("graph", build)
+
+    # === Warm-up and readiness ===
+
+    def warm_up(self):
+        """Build every component and check Mongo is reachable; blocking, safe to repeat."""
+        start = time.perf_counter()
+        for name in self.COMPONENTS:
+            getattr(self, name)
+        self.mongo_client.admin.command("ping")
+        self.timings["warm_up"] = round((time.perf_counter() - start) * 1000, 1)
+
+    async def _awarm_up(self):
+        try:
+            await asyncio.to_thread(self.warm_up)
+            # Replays chat turns that a crash left in the write-behind journal,
+            # so they are back in the buffer before any request reads history
+            await self.bot.chat_writer.start()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"Service warm-up failed: {self.error}")
+            raise
+        self.error = None
+        self.ready = True
+        logger.info(f"Services ready in {self.timings['warm_up']} ms.")
+
+    def start_warm_up(self):
+        """Start warm_up on a worker thread (once; again only after a failure) and return its task."""
+        task = self._warm_up_task
+        if task is None or (task.done() and not self.ready):
+            task = self._warm_up_task = asyncio.ensure_future(self._awarm_up())
+            # Failures are reported through `error` and to whoever awaits the task
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def wait_ready(self):
+        """Wait for warm-up without blocking the event loop; raises if it failed."""
+        if not self.ready:
+            await asyncio.shield(self.start_warm_up())
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "warming_up": self._warm_up_task is not None and not self._warm_up_task.done(),
+            "error": self.error,
+            "timings_ms": dict(self.timings),
+        }
+
+    async def aclose(self):
+        if self.built("bot"):
+            await self.bot.aclose()
+        exporter = self.trace_exporter
+        if hasattr(exporter, "flush"):
+            await asyncio.to_thread(exporter.flush)
+
+
+services = Services()
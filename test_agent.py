@@ -0,0 +1,25 @@
+"""
+Reading a turn's graph events back into the reply and its tool results.
+
+    python -m pytest -q test_agent.py
+"""
+from langchain_core.messages import AIMessage, ToolMessage
+
+from Agent import collect_event, final_response, used_chat_history
+from llm import CHAT_HISTORY_FOUND
+
+
+def test_parallel_tool_calls_all_count_for_chat_history():
+    chunks, tool_results, prompt_tokens = [], [], []
+    # rag_search and tavily_search ran in the same tools step; rag_search's output is not the last message
+    collect_event({"tools": {"messages": [
+        ToolMessage(content=f"{CHAT_HISTORY_FOUND}\nUser: my order number is 4417", name="rag_search", tool_call_id="call-1"),
+        ToolMessage(content="Order tracking help from the web", name="tavily_search", tool_call_id="call-2"),
+    ]}}, chunks, tool_results, prompt_tokens)
+    collect_event({"chatbot": {"messages": [AIMessage(content="Your order is 4417.")], "prompt_tokens": 120}},
+                  chunks, tool_results, prompt_tokens)
+
+    assert len(tool_results) == 2
+    assert used_chat_history(tool_results, None)
+    assert final_response(chunks) == "Your order is 4417."
+    assert prompt_tokens == [120]
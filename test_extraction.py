@@ -0,0 +1,51 @@
+"""
+ExtractionPool recovery when a worker process dies.
+
+    python -m pytest -q test_extraction.py
+"""
+import asyncio
+import os
+
+import pytest
+
+from extraction import ExtractionError, ExtractionPool
+
+
+def exit_mid_parse():
+    # What a parser crashing the interpreter (or the OOM killer) looks like to the pool
+    os._exit(1)
+
+
+async def upload(pool, tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Revenue grew twelve percent.\n\nCosts were flat.\n")
+    return [chunk async for chunk in pool.chunks("notes.txt", str(path))]
+
+
+def test_worker_exiting_mid_job_is_replaced(tmp_path):
+    async def run():
+        pool = ExtractionPool(workers=1, timeout=30)
+        await pool.start()
+        try:
+            with pytest.raises(ExtractionError):
+                await pool._run([30.0], exit_mid_parse)
+            assert await upload(pool, tmp_path)
+        finally:
+            await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_idle_worker_killed_between_uploads(tmp_path):
+    async def run():
+        pool = ExtractionPool(workers=1, timeout=30)
+        await pool.start()
+        try:
+            # Nothing was in flight, so the upload goes to a fresh worker instead of failing
+            pool._idle[0].kill()
+            assert await upload(pool, tmp_path)
+            assert len(pool._idle) == 1 and pool._idle[0].process.is_alive()
+        finally:
+            await pool.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,196 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import registry
+
+
+# Set by RequestIDMiddleware; every span opened while serving the request carries it
+request_id = contextvars.ContextVar("request_id", default="-")
+
+span_seconds = registry.histogram(
+    "span_duration_seconds", "Duration of LLM, tool, embedding and Mongo calls.", labels=("kind", "name")
+)
+span_errors = registry.counter(
+    "span_errors_total", "LLM, tool, embedding and Mongo calls that raised.", labels=("kind", "name")
+)
+llm_tokens = registry.counter("llm_tokens_total", "Tokens reported by the model, by direction.", labels=("type",))
+
+logger = logging.getLogger("app.trace")
+
+
+class Span:
+    """One timed call: kind is "llm", "tool", "embedding" or "mongo"."""
+
+    __slots__ = ("name", "kind", "request_id", "attributes", "started_at", "duration", "error", "_start")
+
+    def __init__(self, name, kind, attributes):
+        self.name = name
+        self.kind = kind
+        self.request_id = request_id.get()
+        self.attributes = attributes
+        self.started_at = datetime.now(timezone.utc)
+        self.duration = None
+        self.error = None
+        self._start = time.perf_counter()
+
+    @property
+    def ended_at(self):
+        return datetime.fromtimestamp(self.started_at.timestamp() + (self.duration or 0.0), timezone.utc)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "request_id": self.request_id,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round((self.duration or 0.0) * 1000, 2),
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+def start_span(name, kind, **attributes):
+    return Span(name, kind, attributes)
+
+
+def end_span(span, error=None):
+    """Record the span in /metrics and hand it to the configured exporter."""
+    span.duration = time.perf_counter() - span._start
+    span_seconds.observe(span.duration, span.kind, span.name)
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+        span_errors.inc(span.kind, span.name)
+    from services import services
+    exporter = services.trace_exporter
+    if exporter is not None:
+        try:
+            exporter.export(span)
+        except Exception as e:
+            logger.warning(f"Span export failed: {e}")
+
+
+@contextmanager
+def span(name, kind, **attributes):
+    """Time the enclosed block as a span; works in sync and async code alike."""
+    current = start_span(name, kind, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        end_span(current, e)
+        raise
+    end_span(current)
+
+
+def submit(executor, fn, *args):
+    """executor.submit in a copy of the current context, so pool threads keep the request id."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+# === Exporters ===
+
+class RecentSpans:
+    """Local exporter: the last `max_spans` spans in memory, served at GET /traces/{request_id}."""
+
+    def __init__(self, max_spans=10_000):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def for_request(self, request_id):
+        with self._lock:
+            return [span.to_dict() for span in self._spans if span.request_id == request_id]
+
+
+class LangfuseExporter:
+    """Sends spans to Langfuse, one trace per request id; the SDK batches uploads on its own thread."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def export(self, span):
+        kwargs = {
+            "trace_id": span.request_id if span.request_id != "-" else None,
+            "name": span.name,
+            "start_time": span.started_at,
+            "end_time": span.ended_at,
+            "metadata": dict(span.attributes, kind=span.kind),
+        }
+        if span.error:
+            kwargs.update(level="ERROR", status_message=span.error)
+        if span.kind == "llm":
+            usage = {k: span.attributes[k] for k in ("input", "output") if k in span.attributes}
+            self.client.generation(model=span.attributes.get("model"), usage=usage or None, **kwargs)
+        else:
+            self.client.span(**kwargs)
+
+    def flush(self):
+        self.client.flush()
+
+
+# === LangChain callbacks ===
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    """
+    Opens a span for every chat model and tool run inside the graph and
+    counts the model's reported tokens. Attached through the graph config,
+    so it reaches every node without the nodes knowing about it.
+    """
+
+    # Called on the event loop, not a worker thread, so the request id is visible
+    run_inline = True
+
+    def __init__(self):
+        self._spans = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("metadata") or {}).get("ls_model_name") or (serialized or {}).get("name") or "chat_model"
+        self._spans[run_id] = start_span("chat_model", "llm", model=model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is None:
+            return
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                for key, value in (getattr(message, "usage_metadata", None) or {}).items():
+                    if key in ("input_tokens", "output_tokens"):
+                        usage[key] = usage.get(key, 0) + value
+        if usage:
+            current.attributes["input"] = usage.get("input_tokens", 0)
+            current.attributes["output"] = usage.get("output_tokens", 0)
+            llm_tokens.inc("input", amount=current.attributes["input"])
+            llm_tokens.inc("output", amount=current.attributes["output"])
+        end_span(current)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            end_span(current, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._spans[run_id] = start_span((serialized or {}).get("name") or "tool", "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            end_span(current)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            end_span(current, error)
+
+
+span_callbacks = SpanCallbackHandler()
@@ -0,0 +1,43 @@
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype, VECTOR_SUBTYPE
+
+
+# How embeddings are stored in Mongo:
+#   array    BSON array of doubles (~9 bytes per dimension), what Atlas knnBeta reads
+#   float32  packed little-endian float32 BSON vector (4 bytes per dimension)
+#   int8     scalar-quantized int8 BSON vector (1 byte per dimension); cosine
+#            similarity ignores the per-vector scale, so it is not stored
+FORMATS = ("array", "float32", "int8")
+
+_NUMPY_DTYPES = {BinaryVectorDtype.FLOAT32.value: np.dtype("<f4"), BinaryVectorDtype.INT8.value: np.dtype(np.int8)}
+
+
+def encode_vector(vector, fmt="float32"):
+    if fmt == "array":
+        return [float(v) for v in vector]
+    vector = np.asarray(vector, dtype=np.float32)
+    if fmt == "float32":
+        return Binary(BinaryVectorDtype.FLOAT32.value + b"\x00" + vector.astype("<f4").tobytes(), VECTOR_SUBTYPE)
+    if fmt == "int8":
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        quantized = np.rint(vector * (127.0 / peak)) if peak else np.zeros_like(vector)
+        return Binary(BinaryVectorDtype.INT8.value + b"\x00" + quantized.astype(np.int8).tobytes(), VECTOR_SUBTYPE)
+    raise ValueError(f"Unknown embedding format {fmt!r}, expected one of {FORMATS}")
+
+
+def vector_format(value):
+    """The format a stored embedding is in, or None for anything else."""
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        return {BinaryVectorDtype.FLOAT32.value: "float32", BinaryVectorDtype.INT8.value: "int8"}.get(bytes(value[:1]))
+    if isinstance(value, list):
+        return "array"
+    return None
+
+
+def decode_vector(value):
+    """A stored embedding in any of FORMATS as a float32 numpy array (a view, no copy, for packed vectors)."""
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        dtype = _NUMPY_DTYPES[bytes(value[:1])]
+        vector = np.frombuffer(value, dtype=dtype, offset=2)
+        return vector if dtype == np.float32 else vector.astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
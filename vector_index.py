@@ -0,0 +1,268 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+from vector_codec import decode_vector
+
+
+logger = logging.getLogger("app")
+
+
+class ExactIndex:
+    """
+    Brute-force cosine-similarity index over a contiguous float32 matrix.
+
+    Rows are L2-normalised on insert so a search is one matrix-vector product.
+    The matrix grows geometrically, so incremental adds are amortised O(1) copies.
+    """
+
+    kind = "exact"
+
+    def __init__(self, dim=None):
+        self.dim = dim
+        self._vectors = np.empty((0, dim or 0), dtype=np.float32)
+        self._ids = []
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._size]
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(vectors / norms)
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= self._vectors.shape[0]:
+            return
+        grown = np.empty((max(needed, 2 * self._vectors.shape[0], 1024), self.dim), dtype=np.float32)
+        grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+
+    def add(self, ids, vectors):
+        if not len(ids):
+            return
+        vectors = self._normalize(vectors)
+        with self._lock:
+            if self.dim is None or self._size == 0 and self.dim != vectors.shape[1]:
+                self.dim = vectors.shape[1]
+                self._vectors = np.empty((0, self.dim), dtype=np.float32)
+            self._reserve(len(ids))
+            start = self._size
+            self._vectors[start:start + len(ids)] = vectors
+            self._ids.extend(str(i) for i in ids)
+            self._size += len(ids)
+            self._added(start, vectors)
+
+    def _added(self, start, vectors):
+        pass
+
+    def remove(self, ids):
+        """Drop the rows of `ids` (unknown ids are ignored) and compact the matrix."""
+        ids = {str(i) for i in ids}
+        with self._lock:
+            keep = np.array([i not in ids for i in self._ids], dtype=bool)
+            if keep.all():
+                return
+            kept = self.vectors[keep]
+            self._vectors[:len(kept)] = kept
+            self._ids = [i for i, k in zip(self._ids, keep) if k]
+            self._size = len(self._ids)
+            self._removed(keep)
+
+    def _removed(self, keep):
+        pass
+
+    def _candidates(self, query):
+        return None
+
+    def search(self, vector, k=3):
+        """Return up to k (id, cosine similarity) pairs, best first."""
+        with self._lock:
+            if not self._size:
+                return []
+            query = self._normalize(vector)[0]
+            rows = self._candidates(query)
+            matrix = self.vectors if rows is None else self.vectors[rows]
+            scores = matrix @ query
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            if rows is not None:
+                return [(self._ids[rows[i]], float(scores[i])) for i in top]
+            return [(self._ids[i], float(scores[i])) for i in top]
+
+    # === Snapshots ===
+
+    def _state(self):
+        return {}
+
+    def _load_state(self, data):
+        pass
+
+    def save(self, path):
+        with self._lock:
+            # Per process, so workers saving the same snapshot never write into each other's tmp file
+            tmp = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                tmp,
+                kind=np.array(self.kind),
+                vectors=self.vectors,
+                ids=np.array(self._ids, dtype=str),
+                **self._state(),
+            )
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(dim=data["vectors"].shape[1], **kwargs)
+            index._vectors = np.ascontiguousarray(data["vectors"], dtype=np.float32)
+            index._ids = data["ids"].tolist()
+            index._size = len(index._ids)
+            index._load_state(data)
+        return index
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index: k-means centroids partition the rows, and a query only
+    scores the rows of its `nprobe` nearest partitions.
+
+    Below `min_train_size` rows it behaves exactly like ExactIndex. It retrains
+    once the index has doubled since the last training, new rows in between are
+    assigned to their nearest existing centroid.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim=None, nlist=None, nprobe=16, min_train_size=1024, iterations=10, seed=0):
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self.seed = seed
+        self._centroids = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists = []
+        self._trained_size = 0
+
+    def _kmeans(self, data, nlist):
+        rng = np.random.default_rng(self.seed)
+        sample = data[rng.choice(len(data), size=min(len(data), nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = self._normalize(centroids)
+        return centroids
+
+    def _assign(self, vectors, batch=8192):
+        return np.concatenate([
+            np.argmax(vectors[i:i + batch] @ self._centroids.T, axis=1).astype(np.int32)
+            for i in range(0, len(vectors), batch)
+        ]) if len(vectors) else np.empty(0, dtype=np.int32)
+
+    def _build_lists(self):
+        order = np.argsort(self._assignments, kind="stable")
+        bounds = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self._centroids))]
+
+    def train(self):
+        with self._lock:
+            data = self.vectors
+            nlist = self.nlist or max(1, int(np.sqrt(len(data))))
+            self._centroids = self._kmeans(data, min(nlist, len(data)))
+            self._assignments = self._assign(data)
+            self._build_lists()
+            self._trained_size = len(data)
+
+    def _added(self, start, vectors):
+        if self._size >= self.min_train_size and self._size >= 2 * self._trained_size:
+            self.train()
+        elif self._centroids is not None:
+            assign = self._assign(vectors)
+            self._assignments = np.concatenate([self._assignments, assign])
+            for offset, c in enumerate(assign):
+                self._lists[c] = np.append(self._lists[c], start + offset)
+
+    def _removed(self, keep):
+        if self._centroids is not None:
+            self._assignments = self._assignments[keep]
+            self._build_lists()
+
+    def _candidates(self, query):
+        if self._centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self._centroids))
+        probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([self._lists[c] for c in probe])
+        return rows if len(rows) else None
+
+    def _state(self):
+        if self._centroids is None:
+            return {}
+        return {"centroids": self._centroids, "assignments": self._assignments,
+                "trained_size": np.array(self._trained_size)}
+
+    def _load_state(self, data):
+        if "centroids" in data:
+            self._centroids = np.ascontiguousarray(data["centroids"], dtype=np.float32)
+            self._assignments = data["assignments"].astype(np.int32)
+            self._trained_size = int(data["trained_size"])
+            self._build_lists()
+
+
+INDEX_TYPES = {ExactIndex.kind: ExactIndex, IVFIndex.kind: IVFIndex}
+
+
+def build_vector_index(kind, collection, batch_size=5000):
+    """Build an index from every embedding stored in `collection`."""
+    index = INDEX_TYPES[kind]()
+    ids, vectors = [], []
+    for doc in collection.find({"embedding": {"$exists": True}}, {"embedding": 1}).batch_size(batch_size):
+        ids.append(doc["_id"])
+        vectors.append(decode_vector(doc["embedding"]))
+        if len(ids) >= batch_size:
+            index.add(ids, vectors)
+            ids, vectors = [], []
+    index.add(ids, vectors)
+    return index
+
+
+def load_vector_index(kind, path, collection):
+    """
+    Load the snapshot at `path` if it still matches the collection, otherwise
+    rebuild from Mongo and write a fresh snapshot.
+    """
+    if os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                snapshot_kind = str(data["kind"])
+            index = INDEX_TYPES[snapshot_kind].load(path)
+            if snapshot_kind == kind and len(index) == collection.count_documents({"embedding": {"$exists": True}}):
+                logger.info(f"Loaded {kind} vector index snapshot with {len(index)} vectors.")
+                return index
+        except Exception as e:
+            logger.warning(f"Vector index snapshot unusable, rebuilding: {e}")
+
+    index = build_vector_index(kind, collection)
+    index.save(path)
+    logger.info(f"Built {kind} vector index with {len(index)} vectors.")
+    return index